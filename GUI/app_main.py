@@ -13,7 +13,7 @@ except ImportError:
 
 # 自作モジュールのインポート（パスはプロジェクト構成に合わせる）
 from GUI.main_window import MainWindow
-from GUI.vo_se_engine import VoSeEngineWrapper
+from GUI.vo_se_engine import VO_SE_Engine
 
 def main():
     # 1. 高DPI対応（GUIを表示する前に必須）
@@ -30,13 +30,15 @@ def main():
 
     # (A) C言語エンジンのロード
     # ここで DLL/dylib のロードと関数定義が行われる
-    engine = VoSeEngineWrapper() 
+    engine = VO_SE_Engine()
 
     if pyi_splash:
-        pyi_splash.update_text("音源データを読み込み中...")
+        pyi_splash.update_text("画面を準備中...")
 
     # (B) メインウィンドウの作成
     # ここで TimelineWidget やサイドバーなどの重いGUIパーツが生成される
+    # 音源の読み込みはバックグラウンドで始まり、進捗はウィンドウのステータスバーに表示されるので、
+    # 読み込みの完了を待たずにスプラッシュを閉じてよい
     window = MainWindow(engine=engine)
 
     # (C) 擬似的な待機（ロードが速すぎてスプラッシュが見えない場合用）
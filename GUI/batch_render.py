@@ -0,0 +1,181 @@
+# batch_render.py
+#
+# プロジェクトファイル（*.json）をまとめてWAVに書き出すコマンドラインツール。
+# Qt / janome / pyaudio を読み込まないので、GUIのないビルドマシンでも動く。
+#
+#   python GUI/batch_render.py --voicebank audio_data/aoi --out-dir renders songs/*.json
+#
+# ファイルごとにプロセスを分けて並列に合成し、音源は各ワーカーで最初に1回だけ読み込む。
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from data_models import NoteEvent, PitchEvent
+from vo_se_engine import (
+    VO_SE_Engine, VoicebankLoadTask,
+    RESAMPLE_LINEAR, RESAMPLE_SINC_FAST, RESAMPLE_SINC_BEST,
+    WAV_PCM16, WAV_PCM24, WAV_FLOAT32,
+)
+
+PROJECT_APP_ID = "Vocaloid_Clone_App_12345"  # save_file_dialog_and_save_midi が書き込む app_id
+
+QUALITY_NAMES = {
+    "linear": RESAMPLE_LINEAR,
+    "sinc-fast": RESAMPLE_SINC_FAST,
+    "sinc-best": RESAMPLE_SINC_BEST,
+}
+
+FORMAT_NAMES = {
+    "pcm16": WAV_PCM16,
+    "pcm24": WAV_PCM24,
+    "float32": WAV_FLOAT32,
+}
+
+# --- ワーカープロセス ---
+
+_engine = None   # ワーカーごとに1つ（_init_worker で作る）
+_quality = RESAMPLE_SINC_BEST
+_sample_format = WAV_PCM16
+_dither = True
+
+
+def _init_worker(char_id: str, audio_dir: str, sample_rate: int, quality: int, render_threads: int,
+                 sample_format: int, dither: bool):
+    """ワーカー起動時に1回だけ呼ばれる。エンジンを作って音源を読み込んでおく"""
+    global _engine, _quality, _sample_format, _dither
+    _engine = VO_SE_Engine(sample_rate=sample_rate)
+    if _engine.lib is None:
+        raise RuntimeError(f"エンジンのライブラリを読み込めませんでした（先に make でビルドしてください）: {_engine.load_error}")
+    _engine.set_render_threads(render_threads)
+    _quality = quality
+    _sample_format = sample_format
+    _dither = dither
+
+    task = VoicebankLoadTask(_engine.lib, char_id, os.path.abspath(audio_dir), warm_up=True).start()
+    task.wait()
+    if not task.succeeded:
+        raise RuntimeError(f"音源の読み込みに失敗しました: {audio_dir} (result={task.result})")
+    _engine.active_character_id = char_id
+
+
+def _note_from_dict(data: dict) -> NoteEvent:
+    """プロジェクトファイルのノート（NoteEvent.to_dict の形式）を NoteEvent に戻す"""
+    lyric = data.get("lyrics", data.get("lyric", ""))
+    phonemes = list(data.get("phonemes") or [])
+    if not phonemes and lyric:
+        # 読みの変換（janome）はGUI側で行うので、ここでは歌詞をそのまま音素名として使う
+        phonemes = [lyric]
+    return NoteEvent(
+        note_number=int(data["pitch"]),
+        start_time=float(data["start"]),
+        duration=float(data["duration"]),
+        velocity=int(data.get("velocity", 100)),
+        lyric=lyric,
+        phonemes=phonemes,
+    )
+
+
+def load_project(path: str) -> tuple[list[NoteEvent], list[PitchEvent]]:
+    """save_file_dialog_and_save_midi で保存したプロジェクトファイルを読み込む"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("app_id") != PROJECT_APP_ID:
+        raise ValueError("サポートされていないプロジェクト形式です")
+    notes = [_note_from_dict(d) for d in data.get("notes", [])]
+    pitches = [PitchEvent(time=float(d["time"]), value=int(d["value"])) for d in data.get("pitch_data", [])]
+    return notes, pitches
+
+
+def _render_one(project_path: str, out_path: str) -> dict:
+    """1ファイルを合成して書き出し、所要時間と実時間比（合成・書き出しの時間 / 曲の長さ）を返す"""
+    result = {"project": project_path, "output": out_path, "error": None}
+    try:
+        notes, pitches = load_project(project_path)
+
+        t0 = time.perf_counter()
+        frames = _engine.export_wav(notes, pitches, out_path, sample_format=_sample_format,
+                                    dither=_dither, quality=_quality)
+        render_sec = time.perf_counter() - t0
+        if frames < 0:
+            raise RuntimeError("WAVを書き出せませんでした")
+
+        duration = frames / _engine.sample_rate
+        result.update(
+            notes=len(notes),
+            duration=duration,
+            render_sec=render_sec,
+            rtf=render_sec / duration if duration > 0 else 0.0,
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+# --- コマンドライン ---
+
+def _output_path(project_path: str, out_dir: str) -> str:
+    stem = os.path.splitext(os.path.basename(project_path))[0]
+    return os.path.join(out_dir, stem + ".wav")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="プロジェクトファイル（*.json）をまとめてWAVに書き出す")
+    parser.add_argument("projects", nargs="+", help="プロジェクトファイル（*.json）")
+    parser.add_argument("--voicebank", required=True, help="音源フォルダ、または *.vsepack")
+    parser.add_argument("--character-id", help="キャラクターID（省略時は音源フォルダ名）")
+    parser.add_argument("--out-dir", default="renders", help="WAVの書き出し先（既定: renders）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="並列に合成するプロセス数（既定: CPUコア数）")
+    parser.add_argument("--render-threads", type=int, default=1,
+                        help="ワーカー1つあたりの合成スレッド数（既定: 1。プロセスで並列化するため）")
+    parser.add_argument("--quality", choices=QUALITY_NAMES, default="sinc-best", help="リサンプル品質（既定: sinc-best）")
+    parser.add_argument("--format", choices=FORMAT_NAMES, default="pcm16", help="WAVのサンプル形式（既定: pcm16）")
+    parser.add_argument("--no-dither", action="store_true", help="整数形式に変換するときのディザをかけない")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    args = parser.parse_args(argv)
+
+    voicebank = os.path.abspath(args.voicebank)
+    char_id = args.character_id or os.path.splitext(os.path.basename(voicebank.rstrip(os.sep)))[0]
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    workers = max(1, min(args.workers, len(args.projects)))
+    init_args = (char_id, voicebank, args.sample_rate, QUALITY_NAMES[args.quality], args.render_threads,
+                 FORMAT_NAMES[args.format], not args.no_dither)
+
+    failed = 0
+    total_duration = 0.0
+    total_render = 0.0
+    t_start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+            futures = [pool.submit(_render_one, p, _output_path(p, args.out_dir)) for p in args.projects]
+            for future in as_completed(futures):
+                r = future.result()
+                if r["error"]:
+                    failed += 1
+                    print(f"[NG] {r['project']}: {r['error']}", file=sys.stderr)
+                    continue
+                total_duration += r["duration"]
+                total_render += r["render_sec"]
+                print(f"[OK] {r['project']} -> {r['output']}  notes={r['notes']}  "
+                      f"length={r['duration']:.2f}s  render={r['render_sec']:.2f}s  RTF={r['rtf']:.3f}")
+    except BrokenProcessPool:
+        # _init_worker が失敗した（エンジンや音源を読み込めない）。理由はワーカーの例外として表示されている
+        print("ワーカーを起動できませんでした。エンジンのビルドと --voicebank を確認してください。", file=sys.stderr)
+        return 2
+    wall = time.perf_counter() - t_start
+
+    done = len(args.projects) - failed
+    print(f"{done}/{len(args.projects)} files, audio {total_duration:.1f}s, render {total_render:.1f}s "
+          f"(RTF {total_render / total_duration if total_duration > 0 else 0.0:.3f}), "
+          f"wall {wall:.1f}s with {workers} workers")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
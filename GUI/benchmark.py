@@ -0,0 +1,279 @@
+# benchmark.py
+#
+# 合成の速さを測るベンチマーク。本物の音声データは使わず、正弦波を重ねた音素で合成用の音源を作り、
+# ノート数の違う曲（既定では 100 / 10,000 / 100,000 ノート）を乱数の種から毎回同じように作って測る。
+# Qt / janome / pyaudio は読み込まない。
+#
+#   python GUI/benchmark.py --out bench.json
+#   python GUI/benchmark.py --sizes 100,10000 --pitch-density 0,50 --quality sinc-best
+#
+# 測るもの（曲ごと）:
+#   init_engine            音源の読み込み
+#   _convert_to_c_structs  ノートをCの構造体にする処理
+#   synthesize             曲全体の合成（NumPy配列で受け取るまで）
+#   export_wav             WAVの書き出し
+# 結果は実時間比（処理時間 / 曲の長さ）、1秒あたりのノート数、ピークのメモリ使用量（RSS）をJSONで出す。
+# 曲ごとに新しいプロセスで測るので、ピークのメモリ使用量は前の曲の影響を受けない。
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from batch_render import QUALITY_NAMES, FORMAT_NAMES
+from data_models import NoteEvent, PitchEvent
+from vo_se_engine import VO_SE_Engine
+
+SAMPLE_RATE = 44100
+CHAR_ID = "bench"
+
+CONSONANTS = ("", "k", "s", "t", "n", "h", "m", "y", "r", "w", "g", "z", "d", "b", "p")
+VOWELS = ("a", "i", "u", "e", "o")
+
+
+# --- 合成用の音源（正弦波） ---
+
+def phoneme_names(count: int) -> list[str]:
+    """"a", "i", ..., "ka", "ki", ... の順に count 個（足りなければ番号を付けて増やす）"""
+    names = [c + v for c in CONSONANTS for v in VOWELS]
+    k = 2
+    while len(names) < count:
+        names += [f"{n}{k}" for n in names[:len(CONSONANTS) * len(VOWELS)]]
+        k += 1
+    return names[:count]
+
+
+def make_tone(rng: random.Random, length_sec: float) -> np.ndarray:
+    """倍音の強さが音素ごとに違う、母音らしい音（前後はフェード）"""
+    n = int(length_sec * SAMPLE_RATE)
+    t = np.arange(n, dtype=np.float64) / SAMPLE_RATE
+    f0 = rng.uniform(180.0, 260.0)
+    tone = np.zeros(n)
+    for h in range(1, 9):
+        tone += rng.uniform(0.2, 1.0) / h * np.sin(2.0 * math.pi * f0 * h * t + rng.uniform(0.0, math.pi))
+    tone *= 1.0 + 0.1 * np.sin(2.0 * math.pi * 5.5 * t)  # ビブラート代わりの揺れ
+    fade = min(n // 4, int(0.02 * SAMPLE_RATE))
+    if fade > 0:
+        ramp = np.linspace(0.0, 1.0, fade)
+        tone[:fade] *= ramp
+        tone[-fade:] *= ramp[::-1]
+    return (0.5 * tone / max(1e-9, np.max(np.abs(tone)))).astype(np.float32)
+
+
+def write_voicebank(audio_dir: str, count: int, seed: int) -> list[str]:
+    """audio_dir に音素 count 個分の WAV（16bit モノラル）を書き出し、音素名の一覧を返す"""
+    os.makedirs(audio_dir, exist_ok=True)
+    rng = random.Random(seed)
+    names = phoneme_names(count)
+    for name in names:
+        samples = make_tone(rng, rng.uniform(0.3, 0.8))
+        with wave.open(os.path.join(audio_dir, name + ".wav"), "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes((samples * 32767.0).astype("<i2").tobytes())
+    return names
+
+
+# --- 合成用の曲 ---
+
+def make_project(note_count: int, phonemes: list[str], seed: int, notes_per_sec: float, max_song_sec: float,
+                 max_phonemes: int, pitch_density: float) -> tuple[list[NoteEvent], list[PitchEvent]]:
+    """
+    ノート note_count 個の曲を作る（同じ引数なら毎回同じ曲）。
+    曲の長さは note_count / notes_per_sec 秒（max_song_sec まで。超える分はノートが重なって和音になる）。
+    音素はノートごとに 1〜max_phonemes 個、ピッチベンドは1秒あたり pitch_density 個。
+    """
+    rng = random.Random(seed)
+    song_sec = min(max_song_sec, max(1.0, note_count / notes_per_sec))
+    notes = []
+    for _ in range(note_count):
+        duration = rng.uniform(0.1, 0.6)
+        count = rng.randint(1, max_phonemes)
+        ph = [rng.choice(phonemes) for _ in range(count)]
+        notes.append(NoteEvent(
+            note_number=rng.randint(48, 79),
+            start_time=rng.uniform(0.0, max(0.0, song_sec - duration)),
+            duration=duration,
+            velocity=rng.randint(60, 127),
+            lyric="".join(ph),
+            phonemes=ph,
+        ))
+    notes.sort(key=lambda n: n.start_time)
+
+    pitches = []
+    value = 0
+    for k in range(int(song_sec * pitch_density)):
+        value = max(-8192, min(8191, value + rng.randint(-1024, 1024)))
+        pitches.append(PitchEvent(time=(k + rng.random()) / pitch_density, value=value))
+    return notes, pitches
+
+
+# --- 計測（曲ごとに別プロセス） ---
+
+def _peak_rss_bytes():
+    """このプロセスのピークのメモリ使用量（取れない環境では None）"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux は KB 単位
+
+
+def _timed(fn, repeat: int):
+    """fn を repeat 回呼び、(最後の戻り値, 所要時間のリスト) を返す"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return result, times
+
+
+def _summary(times: list[float], audio_sec: float, notes: int) -> dict:
+    """中央値の時間と、そこから求めた実時間比（audio_sec が None なら出さない）と1秒あたりのノート数"""
+    sec = statistics.median(times)
+    summary = {"sec": sec, "min_sec": min(times)}
+    if audio_sec is not None:
+        summary["rtf"] = sec / audio_sec if audio_sec > 0 else 0.0
+    summary["notes_per_sec"] = notes / sec if sec > 0 else 0.0
+    return summary
+
+
+def run_case(case: dict) -> dict:
+    """1曲分を測る（ワーカープロセスで呼ばれる）"""
+    engine = VO_SE_Engine(sample_rate=SAMPLE_RATE)
+    result = {"notes": case["notes"], "pitch_density": case["pitch_density"]}
+    if engine.lib is None:
+        result["error"] = f"エンジンのライブラリを読み込めませんでした（先に make でビルドしてください）: {engine.load_error}"
+        return result
+    engine.set_render_threads(case["threads"])
+
+    t0 = time.perf_counter()
+    loaded = engine.lib.init_engine(CHAR_ID.encode("utf-8"), case["audio_dir"].encode("utf-8"))
+    result["init_engine"] = {"sec": time.perf_counter() - t0}
+    if loaded != 0:
+        result["error"] = f"init_engine が失敗しました (result={loaded})"
+        return result
+    engine.active_character_id = CHAR_ID
+
+    notes, pitches = make_project(case["notes"], case["phonemes"], case["seed"], case["notes_per_sec"],
+                                  case["max_song_sec"], case["max_phonemes"], case["pitch_density"])
+    result["pitch_events"] = len(pitches)
+    result["phonemes"] = sum(len(n.phonemes) for n in notes)
+    engine.reset_perf_stats()
+
+    repeat = case["repeat"]
+    _, times = _timed(lambda: engine._convert_to_c_structs(notes, pitches), repeat)
+    result["convert_to_c_structs"] = _summary(times, None, len(notes))
+
+    audio, times = _timed(lambda: engine.synthesize(notes, pitches, quality=case["quality"]), repeat)
+    audio_sec = audio.size / SAMPLE_RATE
+    result["audio_sec"] = audio_sec
+    result["synthesize"] = _summary(times, audio_sec, len(notes))
+    del audio
+
+    wav_path = os.path.join(case["work_dir"], f"bench_{case['notes']}_{case['pitch_density']:g}.wav")
+    frames, times = _timed(lambda: engine.export_wav(notes, pitches, wav_path, sample_format=case["sample_format"],
+                                                     quality=case["quality"]), repeat)
+    if frames < 0:
+        result["error"] = "WAVを書き出せませんでした"
+    else:
+        result["export_wav"] = _summary(times, frames / SAMPLE_RATE, len(notes))
+        result["export_wav"]["bytes"] = os.path.getsize(wav_path)
+    if not case["keep_wav"] and os.path.exists(wav_path):
+        os.remove(wav_path)
+
+    result["engine_stats"] = engine.get_perf_stats()
+    result["peak_rss_bytes"] = _peak_rss_bytes()
+    return result
+
+
+# --- コマンドライン ---
+
+def _number_list(text: str, kind=int) -> list:
+    return [kind(v) for v in text.split(",") if v.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="合成の速さを測る（正弦波の音源と乱数で作った曲を使う）")
+    parser.add_argument("--sizes", type=_number_list, default=[100, 10000, 100000],
+                        help="曲のノート数（カンマ区切り。既定: 100,10000,100000）")
+    parser.add_argument("--pitch-density", type=lambda s: _number_list(s, float), default=[20.0],
+                        help="1秒あたりのピッチベンドの数（カンマ区切りで複数可。既定: 20）")
+    parser.add_argument("--max-phonemes", type=int, default=3, help="ノート1つあたりの音素の最大数（既定: 3）")
+    parser.add_argument("--voicebank-phonemes", type=int, default=50, help="音源の音素の数（既定: 50）")
+    parser.add_argument("--notes-per-sec", type=float, default=4.0, help="1秒あたりのノート数（既定: 4）")
+    parser.add_argument("--max-song-sec", type=float, default=600.0,
+                        help="曲の長さの上限（秒）。ノートが多い曲はこれに収まるよう重ねる（既定: 600）")
+    parser.add_argument("--quality", choices=QUALITY_NAMES, default="sinc-fast", help="リサンプル品質（既定: sinc-fast）")
+    parser.add_argument("--format", choices=FORMAT_NAMES, default="pcm16", help="WAVのサンプル形式（既定: pcm16）")
+    parser.add_argument("--threads", type=int, default=0, help="合成スレッド数（既定: 0 = CPUコア数）")
+    parser.add_argument("--repeat", type=int, default=3, help="各処理を繰り返す回数。中央値を使う（既定: 3）")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--work-dir", help="音源とWAVを置くフォルダ（既定: 一時フォルダ）")
+    parser.add_argument("--keep-wav", action="store_true", help="書き出したWAVを消さずに残す")
+    # エンジンは読み込み時などに標準出力へログを出すので、結果はファイルに書く
+    parser.add_argument("--out", default="benchmark.json", help="結果のJSONの書き出し先（既定: benchmark.json）")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="vose_bench_") as tmp:
+        work_dir = os.path.abspath(args.work_dir or tmp)
+        audio_dir = os.path.join(work_dir, "voicebank")
+        phonemes = write_voicebank(audio_dir, args.voicebank_phonemes, args.seed)
+
+        results = []
+        # 曲ごとにプロセスを起こし直す（fork だと親のメモリ使用量を引き継ぐので spawn）
+        context = multiprocessing.get_context("spawn")
+        for notes in args.sizes:
+            for density in args.pitch_density:
+                case = {
+                    "notes": notes, "pitch_density": density, "phonemes": phonemes, "audio_dir": audio_dir,
+                    "work_dir": work_dir, "seed": args.seed, "notes_per_sec": args.notes_per_sec,
+                    "max_song_sec": args.max_song_sec, "max_phonemes": args.max_phonemes,
+                    "quality": QUALITY_NAMES[args.quality], "sample_format": FORMAT_NAMES[args.format],
+                    "threads": args.threads, "repeat": max(1, args.repeat), "keep_wav": args.keep_wav,
+                }
+                print(f"notes={notes} pitch_density={density:g} ...", file=sys.stderr, flush=True)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    r = pool.submit(run_case, case).result()
+                if "error" in r:
+                    print(f"  [NG] {r['error']}", file=sys.stderr)
+                else:
+                    print(f"  synthesize RTF={r['synthesize']['rtf']:.4f} "
+                          f"({r['synthesize']['notes_per_sec']:.0f} notes/s), "
+                          f"convert {r['convert_to_c_structs']['sec'] * 1000:.1f} ms, "
+                          f"export RTF={r['export_wav']['rtf']:.4f}", file=sys.stderr)
+                results.append(r)
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "work_dir", "keep_wav")},
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    print(f"結果を {args.out} に書き出しました", file=sys.stderr)
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
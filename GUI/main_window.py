@@ -12,12 +12,15 @@ from PySide6.QtGui import QAction, QKeySequence, QKeyEvent
 from PySide6.QtCore import Slot, Qt, QTimer, Signal
 
 from GUI.vo_se_engine import VO_SE_Engine
+from GUI.playback_engine import PlaybackEngine
+from GUI.render_scheduler import RenderScheduler
+from GUI.preview_voice import PreviewVoice
 
 import numpy as np 
 
 from .timeline_widget import TimelineWidget
 from .keyboard_sidebar_widget import KeyboardSidebarWidget
-from .midi_manager import load_midi_file, MidiInputManager, midi_signals
+from .midi_manager import load_midi_file, MidiInputManager, MidiMonitor, midi_signals
 from .data_models import NoteEvent, PitchEvent
 from .graph_editor_widget import GraphEditorWidget
 
@@ -27,13 +30,19 @@ class MainWindow(QMainWindow):
     アプリケーションのメインウィンドウクラス。
     UIの構築、イベント接続、全体的なアプリケーションロジックを管理する。
     """
+
+    # 音源の読み込みスレッドからGUIへ進捗を渡す (段階, 読み込んだファイル数, 全体)
+    voicebank_load_progress = Signal(int, int, int)
+    voicebank_load_finished = Signal(int)
     
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, engine: VO_SE_Engine = None):
         super().__init__(parent)
         self.setWindowTitle("VO-SE Pro")
         self.setGeometry(100, 100, 700, 400)
         
-        self.vo_se_engine = VO_SE_Engine()
+        self.vo_se_engine = engine if engine is not None else VO_SE_Engine()
+        self.playback = PlaybackEngine(self.vo_se_engine) # 出力デバイスは最初の再生で開き、以降は開いたまま
+        self.render_scheduler = RenderScheduler(self.vo_se_engine) # 編集中の曲をバックグラウンドで合成しておく
         self.pitch_data = [] # self.pitch_data をここで初期化
 
         # --- UIコンポーネントの初期化 ---
@@ -50,11 +59,19 @@ class MainWindow(QMainWindow):
             self.timeline_widget.lowest_note_display
         )
         self.graph_editor_widget = GraphEditorWidget()
+
+        # ノートのクリック・ドラッグ時の試聴（再生とは別の小さいバッファの出力で鳴らす）
+        self.preview_voice = PreviewVoice(self.vo_se_engine)
+        self.timeline_widget.preview_voice = self.preview_voice
+        # MIDI入力をその場で鳴らすモニタリング（MIDIスレッドから直接プレビューボイスを鳴らす）
+        self.midi_monitor = MidiMonitor(self.preview_voice)
+        self.midi_manager = None
         
         self.play_button = QPushButton("再生/停止", self)
         self.record_button = QPushButton("録音 開始/停止", self)
         self.open_button = QPushButton("MIDIファイルを開く", self)
         self.loop_button = QPushButton("ループ再生: OFF", self)
+        self.monitor_button = QPushButton("モニター: OFF", self)
         
         # ★GUI改修案1: テンポラベルをシンプルに
         self.tempo_label = QLabel("BPM:", self) 
@@ -105,6 +122,7 @@ class MainWindow(QMainWindow):
         button_layout.addWidget(self.play_button)
         button_layout.addWidget(self.record_button)
         button_layout.addWidget(self.loop_button)
+        button_layout.addWidget(self.monitor_button)
 
         # キャラクター選択UIの追加
         self.character_selector = QComboBox(self)
@@ -134,7 +152,12 @@ class MainWindow(QMainWindow):
         container.setLayout(main_layout)
         self.setCentralWidget(container)
         
-        self.vo_se_engine.set_active_character("char_001")
+        self.voicebank_load_progress.connect(self.on_voicebank_load_progress)
+        self.voicebank_load_finished.connect(self.on_voicebank_load_finished)
+        if self.character_selector.count() > 0:
+            self.load_character(self.character_selector.currentData())
+        else:
+            self.status_label.setText("エラー: audio_data/ に音源が見つかりません。")
 
 
         # --- アクション、メニュー、シグナルの接続 ---
@@ -148,6 +171,7 @@ class MainWindow(QMainWindow):
         self.record_button.clicked.connect(self.on_record_toggled)
         self.open_button.clicked.connect(self.open_file_dialog_and_load_midi)
         self.loop_button.clicked.connect(self.on_loop_button_toggled)
+        self.monitor_button.clicked.connect(self.on_monitor_button_toggled)
         midi_signals.midi_event_signal.connect(self.update_gui_with_midi)
         midi_signals.midi_event_signal.connect(self.timeline_widget.highlight_note)
         midi_signals.midi_event_record_signal.connect(self.timeline_widget.record_midi_event)
@@ -160,8 +184,11 @@ class MainWindow(QMainWindow):
         self.timeline_widget.zoom_changed_signal.connect(self.graph_editor_widget.set_pixels_per_beat)
         
         self.timeline_widget.zoom_changed_signal.connect(self.update_scrollbar_range)
+        self.h_scrollbar.valueChanged.connect(self.update_render_visible_range)
+        self.timeline_widget.zoom_changed_signal.connect(self.update_render_visible_range)
         self.timeline_widget.vertical_zoom_changed_signal.connect(self.update_scrollbar_v_range)
         self.timeline_widget.notes_changed_signal.connect(self.update_scrollbar_range)
+        self.timeline_widget.notes_changed_signal.connect(self.on_notes_changed)
         
         self.graph_editor_widget.pitch_data_changed.connect(self.on_pitch_data_updated)
 
@@ -221,11 +248,8 @@ class MainWindow(QMainWindow):
         if self.is_playing:
             self.is_playing = False
             self.playback_timer.stop()
-            
-            # TODO: VO-SE Engineで再生中の音声があれば停止させる仕組みが必要
-            # 前回のバージョンの停止ロジックを統合
-            if self.vo_se_engine and hasattr(self.vo_se_engine, 'stream') and self.vo_se_engine.stream.is_active():
-                 self.vo_se_engine.stream.stop_stream()
+            self.playback.stop()
+            self.render_scheduler.set_playback_position(None)
             
             self.play_button.setText("再生/停止")
             self.status_label.setText("再生停止しました。")
@@ -247,26 +271,19 @@ class MainWindow(QMainWindow):
             pitch = self.pitch_data
             
             try:
-                self.status_label.setText("音声生成中...お待ちください。")
-                QApplication.processEvents()
-
-                audio_track = self.vo_se_engine.synthesize_track(notes, pitch, start_time, end_time)
-                
-                # エンジンのストリームが停止中であれば再開する (前回のバージョンのロジック)
-                if hasattr(self.vo_se_engine, 'stream') and not self.vo_se_engine.stream.is_active():
-                    self.vo_se_engine.stream.start_stream()
+                # 曲全体を先に合成せず、再生しながら先読みで合成する
+                # （バックグラウンドで合成済みの部分はマスターバッファから読む）
+                self.render_scheduler.update_project(notes, pitch)
+                self.render_scheduler.set_playback_position(start_time)
+                self.playback.set_project(notes, pitch, generation=self.render_scheduler.generation)
+                self.update_loop_range()
+                self.playback.play(start_time, None if self.is_looping else end_time)
 
                 self.current_playback_time = start_time
-                self.start_time_real = time.time() - self.current_playback_time
                 
                 self.is_playing = True
                 self.playback_timer.start()
                 
-                import threading
-                playback_thread = threading.Thread(target=self.vo_se_engine.play_audio, args=(audio_track,))
-                playback_thread.daemon = True
-                playback_thread.start()
-                
                 self.play_button.setText("■ 再生中 (停止)")
                 self.status_label.setText(f"再生開始しました (範囲: {start_time:.2f}s - {end_time:.2f}s)。")
 
@@ -287,6 +304,29 @@ class MainWindow(QMainWindow):
             self.loop_button.setText("ループ再生: OFF")
             self.status_label.setText("ループ再生を無効にしました。")
             self.is_looping = False
+        self.update_loop_range()
+
+    def update_loop_range(self):
+        """ループ区間を再生エンジンに渡す。区間は選択中のノート（選択がなければ曲全体）"""
+        if self.is_looping:
+            self.playback.set_loop(*self.timeline_widget.get_selected_notes_range())
+        else:
+            self.playback.set_loop(None)
+
+    @Slot()
+    def on_monitor_button_toggled(self):
+        """MIDI入力モニタリングの切り替え"""
+        enabled = not self.midi_monitor.enabled
+        self.midi_monitor.set_enabled(enabled)
+        if enabled:
+            self.monitor_button.setText("モニター: ON")
+            self.status_label.setText("MIDI入力をVO-SEで鳴らします。")
+        else:
+            stats = self.midi_monitor.get_latency_stats()
+            self.monitor_button.setText("モニター: OFF")
+            self.status_label.setText(
+                f"モニターを停止しました（平均レイテンシ {stats['total_avg_ms']:.1f}ms, {stats['events']} イベント）。"
+            )
 
     @Slot()
     def on_record_toggled(self):
@@ -309,7 +349,35 @@ class MainWindow(QMainWindow):
     @Slot()
     def on_character_changed(self):
         char_id = self.character_selector.currentData()
-        self.vo_se_engine.set_active_character(char_id)
+        self.load_character(char_id)
+
+    def load_character(self, char_id: str):
+        """名簿のキャラクターの音源をバックグラウンドで読み込む。進捗はステータスバーに表示する"""
+        char_info = self.vo_se_engine.characters.get(char_id)
+        if char_info is None:
+            self.status_label.setText(f"エラー: キャラクター {char_id} は名簿にありません。")
+            return
+        self.status_label.setText("音源データを読み込み中...")
+        self.vo_se_engine.set_active_character(
+            char_info,
+            on_progress=lambda stage, done, total, bytes_done, bytes_total:
+                self.voicebank_load_progress.emit(stage, done, total),
+            on_finished=self.voicebank_load_finished.emit,
+        )
+
+    @Slot(int, int, int)
+    def on_voicebank_load_progress(self, stage, done, total):
+        label = "音源データを読み込み中" if stage == 0 else "音源を準備中"
+        self.status_label.setText(f"{label}... ({done}/{total})")
+
+    @Slot(int)
+    def on_voicebank_load_finished(self, result):
+        if result == 0:
+            self.status_label.setText("音源の読み込みが完了しました。")
+        elif result == -2:
+            self.status_label.setText("音源の読み込みを中止しました。")
+        else:
+            self.status_label.setText("エラー: 音源を読み込めませんでした。")
 
 
     
@@ -318,8 +386,9 @@ class MainWindow(QMainWindow):
         """タイマーイベントごとに呼び出され、再生カーソル位置とGUIを同期更新する"""
         if self.is_playing:
             # --- 再生時刻の同期 ---
-            # システム時刻から計算するのではなく、VO_SE_Engineの現在時刻を取得する
-            self.current_playback_time = self.vo_se_engine.current_time_playback 
+            # システム時刻から計算するのではなく、実際に出力したフレーム数から求めた再生位置を使う
+            self.current_playback_time = self.playback.position
+            self.render_scheduler.set_playback_position(self.current_playback_time)
            
             # 再生時間を MM:SS.ms 形式にフォーマット
             mins = int(self.current_playback_time / 60)
@@ -329,27 +398,21 @@ class MainWindow(QMainWindow):
             self.time_display_label.setText(time_str)
           
             
-            # --- ループ処理のロジック ---
-            # ここではGUI側でループ範囲監視と巻き戻しを行う
+            # --- ループ処理 ---
+            # 折り返しは再生エンジンが音声側でサンプル単位に行う。ここでは選択範囲の変更を伝えるだけ
+            # （区間が変わらなければ set_loop は何もしない）
             if self.is_looping:
-                project_start_time, project_end_time = self.timeline_widget.get_selected_notes_range()
-                
-                # 再生時間が終了範囲を超えたら、開始時間まで巻き戻す
-                if self.current_playback_time >= project_end_time and project_end_time > project_start_time:
-                    self.current_playback_time = project_start_time
-                    # VO_SE_Engineの内部時刻も巻き戻す必要がある
-                    self.vo_se_engine.current_time_playback = self.current_playback_time 
-                
-                # 再生時間が開始範囲より前なら、開始時間まで進める (通常は発生しない想定だが安全策)
-                if self.current_playback_time < project_start_time:
-                    self.current_playback_time = project_start_time
-                    # VO_SE_Engineの内部時刻も巻き戻す必要がある
-                    self.vo_se_engine.current_time_playback = self.current_playback_time 
+                self.update_loop_range()
 
             # --- GUIの更新と自動スクロール ---
             self.timeline_widget.set_current_time(self.current_playback_time)
             self.graph_editor_widget.set_current_time(self.current_playback_time)
 
+            if self.playback.finished:
+                # 再生範囲の終わりまで出力し終えた
+                self.on_play_pause_toggled()
+                return
+
             # 自動スクロールのロジック
             current_beats = self.timeline_widget.seconds_to_beats(self.current_playback_time)
             cursor_x_pos = current_beats * self.timeline_widget.pixels_per_beat
@@ -381,6 +444,18 @@ class MainWindow(QMainWindow):
         
         self.h_scrollbar.setRange(0, max_scroll_value)
 
+    @Slot()
+    def update_render_visible_range(self):
+        """タイムラインに表示している範囲を、バックグラウンド合成で優先させる"""
+        ppb = self.timeline_widget.pixels_per_beat
+        if ppb <= 0: return
+        left = self.timeline_widget.scroll_x_offset
+        right = left + self.timeline_widget.width()
+        self.render_scheduler.set_visible_range(
+            self.timeline_widget.beats_to_seconds(left / ppb),
+            self.timeline_widget.beats_to_seconds(right / ppb)
+        )
+
 
     @Slot()
     def update_scrollbar_v_range(self):
@@ -556,12 +631,20 @@ class MainWindow(QMainWindow):
                 # スクロールバーの範囲を更新
                 self.update_scrollbar_range()
                 self.update_scrollbar_v_range()
+                self.render_scheduler.update_project(self.timeline_widget.notes_list, self.pitch_data)
+                self.update_render_visible_range()
+
+    @Slot()
+    def on_notes_changed(self):
+        """ノートが編集されたら、変更された時間範囲を記録させてバックグラウンドで合成し直す"""
+        self.render_scheduler.update_project(self.timeline_widget.notes_list, self.pitch_data)
 
     @Slot(list)
     def on_pitch_data_updated(self, new_pitch_events: list):
         """GraphEditorWidgetから更新されたピッチデータを受け取る"""
         # PitchEvent型への型ヒントを追加
         self.pitch_data: list[PitchEvent] = new_pitch_events
+        self.render_scheduler.update_project(self.timeline_widget.notes_list, self.pitch_data) # 変更された範囲だけ再合成させる
         print(f"ピッチデータが更新されました。総ポイント数: {len(self.pitch_data)}")
 
 
@@ -631,7 +714,7 @@ class MainWindow(QMainWindow):
             self.midi_manager = None
 
         if selected_port_name and selected_port_name != "ポートなし":
-            self.midi_manager = MidiInputManager(selected_port_name)
+            self.midi_manager = MidiInputManager(selected_port_name, monitor=self.midi_monitor)
             self.midi_manager.start() # 新しいポートで開始
             self.status_label.setText(f"MIDIポート: {selected_port_name} に接続済み")
         else:
@@ -646,6 +729,10 @@ class MainWindow(QMainWindow):
         if self.midi_manager: 
             self.midi_manager.stop()
         
+        self.render_scheduler.close()
+        self.playback.close()
+        self.preview_voice.close()
+
         if self.vo_se_engine:
             self.vo_se_engine.close()
 
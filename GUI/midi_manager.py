@@ -2,6 +2,7 @@
 
 import mido
 import threading
+import time
 from PySide6.QtCore import Signal, QObject
 from data_models import NoteEvent 
 
@@ -33,10 +34,91 @@ def load_midi_file(filepath):
         print(f"MIDIファイルの読み込みに失敗しました: {e}")
         return None
 
+class MidiMonitor:
+    """
+    MIDI入力をその場でプレビューボイスから鳴らす（ライブモニタリング）。
+    MidiInputManager.midi_callback からMIDIスレッドで直接呼ばれ、Qtのイベントループを通らない。
+    歌詞がないので、音素はキャラクターの既定の音素（PreviewVoice.default_phoneme）を使う。
+    """
+    def __init__(self, preview_voice, phoneme: str = None):
+        self.preview_voice = preview_voice
+        self.phoneme = phoneme          # None ならキャラクターの既定の音素
+        self.enabled = False
+        self._voices = {}               # ノート番号 -> ボイスID
+        self._lock = threading.Lock()
+        self.events = 0
+        self.dispatch_sum = 0.0         # コールバックを受けてからエンジンのキューに積むまで（秒）
+        self.dispatch_max = 0.0
+
+    def set_enabled(self, enabled: bool):
+        if enabled:
+            self.preview_voice.start() # MIDIスレッドでデバイスを開くことにならないように
+        self.enabled = enabled
+        if not enabled:
+            self.all_off()
+
+    def note_on(self, note: int, velocity: int, received: float):
+        phoneme = self.phoneme or self.preview_voice.default_phoneme()
+        if not phoneme:
+            return
+        voice = self.preview_voice.note_on(phoneme, note, velocity)
+        with self._lock:
+            old = self._voices.pop(note, -1)
+            if voice > 0:
+                self._voices[note] = voice
+        self.preview_voice.note_off(old) # 同じ鍵盤が離されずにもう一度押された
+        self._count(received)
+
+    def note_off(self, note: int, received: float):
+        with self._lock:
+            voice = self._voices.pop(note, -1)
+        self.preview_voice.note_off(voice)
+        self._count(received)
+
+    def all_off(self):
+        with self._lock:
+            voices = list(self._voices.values())
+            self._voices.clear()
+        for voice in voices:
+            self.preview_voice.note_off(voice)
+
+    def _count(self, received: float):
+        elapsed = time.perf_counter() - received
+        self.events += 1
+        self.dispatch_sum += elapsed
+        self.dispatch_max = max(self.dispatch_max, elapsed)
+
+    def get_latency_stats(self) -> dict:
+        """
+        モニタリングのレイテンシ（ミリ秒）。
+        dispatch はMIDIスレッドでの処理、engine は発音の指示からコールバックで鳴り始めるまで、
+        output は出力デバイスのバッファで、鍵盤から音が出るまではおよそ total になる。
+        engine はクリック時の試聴も含めたプレビューボイス全体の値。
+        """
+        stats = self.preview_voice.get_stats()
+        dispatch_avg = self.dispatch_sum / self.events * 1000.0 if self.events else 0.0
+        return {
+            "events": self.events,
+            "dispatch_avg_ms": dispatch_avg,
+            "dispatch_max_ms": self.dispatch_max * 1000.0,
+            "engine_avg_ms": stats["avg_latency_ms"],
+            "engine_max_ms": stats["max_latency_ms"],
+            "output_ms": stats["output_latency_ms"],
+            "total_avg_ms": dispatch_avg + stats["avg_latency_ms"] + stats["output_latency_ms"],
+        }
+
+    def reset_latency_stats(self):
+        self.events = 0
+        self.dispatch_sum = 0.0
+        self.dispatch_max = 0.0
+        self.preview_voice.reset_stats()
+
+
 class MidiInputManager:
-    def __init__(self, port_name=None):
+    def __init__(self, port_name=None, monitor: MidiMonitor = None):
         self.port_name = port_name
         self.port = None
+        self.monitor = monitor  # 有効なら受け取ったノートをその場で鳴らす
 
     @staticmethod
     def get_available_ports():
@@ -57,13 +139,23 @@ class MidiInputManager:
             print(f"MIDIポート {self.port_name} を開けません: {e}")
 
     def stop(self):
+        if self.monitor is not None:
+            self.monitor.all_off()
         if self.port:
             self.port.close()
             print("MIDIポートを閉じました。")
 
     def midi_callback(self, message):
-        import time
+        received = time.perf_counter()
         timestamp = time.time()
+        monitor = self.monitor
+        if monitor is not None and monitor.enabled:
+            # シグナルを出す前に鳴らす（GUIの処理を待たない）
+            if message.type == 'note_on' and message.velocity > 0:
+                monitor.note_on(message.note, message.velocity, received)
+            elif message.type == 'note_off' or (message.type == 'note_on' and message.velocity == 0):
+                monitor.note_off(message.note, received)
+
         if message.type == 'note_on' and message.velocity > 0:
             midi_signals.midi_event_signal.emit(message.note, message.velocity, 'on')
             midi_signals.midi_event_record_signal.emit(message.note, message.velocity, 'on', timestamp)
@@ -0,0 +1,407 @@
+# playback_engine.py
+#
+# コールバック方式のリアルタイム再生。
+# 出力ストリームは一度開いたら開きっぱなしにし、再生・停止・シークはストリームを開き直さずに行う。
+# 合成スレッドがCエンジンのストリーミング合成（vse_render_pull）でリングバッファを再生位置より先に埋めておき、
+# PyAudio のコールバックはリングバッファから取り出すだけにする。
+# 再生位置はコールバックが出力したフレーム数で数えるので、GUIのタイマーの揺れに左右されない。
+#
+# ループ再生では、ループ区間を一度だけ合成してキャッシュし、コールバックがその中でサンプル単位で折り返す。
+# 継ぎ目は区間の末尾を区間開始直前の音へクロスフェードさせておくので、折り返しで途切れない。
+#
+# RenderScheduler がバックグラウンドでマスターバッファへ合成済みの部分は、合成し直さずにそこから読む
+# （set_project に世代を渡したときだけ。世代が古くなっていたら読まずに通常どおり合成する）。
+
+import ctypes
+import threading
+
+import numpy as np
+
+
+LOOP_CROSSFADE_SEC = 0.01  # ループの継ぎ目のクロスフェード長
+
+
+class PlaybackEngine:
+    """
+    VO_SE_Engine の合成結果をリアルタイムに再生する。
+
+        playback = PlaybackEngine(engine)
+        playback.set_project(notes, pitch_events)
+        playback.play(start_time)          # 秒
+        ...
+        playback.position                  # 再生位置（秒）。GUIはこれを表示する
+        playback.stop()
+
+    再生中にノートを編集したら set_project を呼び直すと、まだ合成していない部分から新しい内容に切り替わる。
+    generation に RenderScheduler.generation を渡すと、バックグラウンドで合成済みの部分はそれを使う。
+
+        playback.set_loop(start, end)      # 秒。None でループ解除
+    """
+
+    def __init__(self, engine, block_frames: int = 512, buffer_frames: int = 16384, render_frames: int = 2048):
+        self.engine = engine
+        self.sample_rate = engine.sample_rate
+        self.block_frames = block_frames      # コールバック1回あたりのフレーム数
+        self.render_frames = render_frames    # 合成スレッドが1回に合成するフレーム数
+
+        # リングバッファ（合成スレッドが書き、コールバックが読む）
+        self._ring = np.zeros(buffer_frames, dtype=np.float32)
+        self._read = 0         # これまでに読んだフレーム数（リング上の位置は % len）
+        self._write = 0        # これまでに書いたフレーム数
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+        # 再生位置（タイムライン上のフレーム）。コールバックが出力した分だけ進む
+        self._play_frame = 0
+        self._write_frame = 0  # 次にリングバッファへ書くタイムライン上のフレーム
+        self._end_frame = None # ここまで再生したら止まる（None なら曲の終わりまで）
+        self._playing = False
+        self._finished = False
+        self._source_done = False
+        self.underruns = 0     # 合成が間に合わず無音を出した回数
+
+        # Cエンジンのストリーミング合成セッション（合成スレッドだけが触る）
+        self._session = None
+        self._pending = None   # 差し替え待ちの (request, keep_alive, generation)
+        self._seek_to = None   # 合成スレッドに伝えるシーク先
+
+        # ループ区間（タイムライン上のフレーム）と、合成済みの区間のキャッシュ
+        self._loop_range = None
+        self._loop_buf = None  # 継ぎ目のクロスフェード込み。合成し終わるまでは None
+        self._loop_gen = 0     # ループ区間か曲が変わるたびに増やし、古い合成結果を捨てる
+        self.loop_crossfade_frames = int(LOOP_CROSSFADE_SEC * self.sample_rate)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._render_loop, name="playback-render", daemon=True)
+        self._thread.start()
+
+        self._pyaudio = None
+        self._stream = None
+        self._pa_continue = None
+        self._out = np.zeros(block_frames, dtype=np.float32)
+
+    # --- 再生する内容 ---
+    def set_project(self, notes, pitch_events, quality: int = None, generation: int = None):
+        """
+        再生する曲を設定する（再生中でもよい。まだ合成していない部分から切り替わる）
+        generation: この内容をマスターバッファへ合成している世代（RenderScheduler.generation）
+        """
+        if not notes:
+            with self._lock:
+                self._pending = (None, None, None)
+                self._drop_loop_locked()
+            self._wake.set()
+            return
+
+        req, keep_alive = self.engine._make_request(notes, pitch_events, quality)  # keep_alive はセッションを閉じるまで保持
+        with self._lock:
+            self._pending = (req, keep_alive, generation)
+            self._drop_loop_locked()
+        self._wake.set()
+
+    def set_loop(self, start_time: float = None, end_time: float = None):
+        """start_time〜end_time（秒）をループ再生する。None か空の区間を渡すとループを解除する"""
+        if start_time is None or end_time is None or end_time <= start_time:
+            new_range = None
+        else:
+            new_range = (max(0, int(start_time * self.sample_rate)), int(end_time * self.sample_rate))
+        with self._lock:
+            if new_range == self._loop_range:
+                return
+            self._drop_loop_locked()
+            self._loop_range = new_range
+        self._wake.set()
+
+    @property
+    def loop_range(self):
+        """ループ区間（秒）。ループしていなければ None"""
+        r = self._loop_range
+        return None if r is None else (r[0] / self.sample_rate, r[1] / self.sample_rate)
+
+    def _drop_loop_locked(self):
+        """キャッシュしたループ区間を捨てる（_lock を持って呼ぶ）"""
+        if self._loop_buf is not None and self._loop_range is not None:
+            start, end = self._loop_range
+            if start <= self._play_frame < end:
+                # キャッシュから再生していた間、リングバッファは進んでいないので今の位置から合成し直す
+                self._reset_locked(self._play_frame)
+        self._loop_buf = None
+        self._loop_gen += 1
+
+    # --- 再生操作 ---
+    def play(self, start_time: float = None, end_time: float = None):
+        """start_time（秒）から再生する。省略すると現在位置から。end_time まで来たら止まる"""
+        self._ensure_stream()
+        if start_time is not None:
+            self.seek(start_time)
+        with self._lock:
+            self._end_frame = None if end_time is None else int(end_time * self.sample_rate)
+            self._finished = False
+            self._playing = True
+        self._wake.set()
+
+    def stop(self):
+        """再生を止める（デバイスは開いたまま。位置はそのまま残る）"""
+        with self._lock:
+            self._playing = False
+
+    def seek(self, time_sec: float):
+        """再生位置を移す。先読みしていた分は捨て、新しい位置から合成し直す"""
+        frame = max(0, int(time_sec * self.sample_rate))
+        with self._lock:
+            self._reset_locked(frame)
+        self._wake.set()
+
+    def _reset_locked(self, frame: int):
+        self._read = self._write = 0
+        self._play_frame = self._write_frame = frame
+        self._seek_to = frame
+        self._source_done = False
+        self._finished = False
+
+    @property
+    def is_playing(self) -> bool:
+        return self._playing
+
+    @property
+    def finished(self) -> bool:
+        """end_time（または曲の終わり）まで再生して止まったら True"""
+        return self._finished
+
+    @property
+    def position_frames(self) -> int:
+        """再生位置（タイムライン上のフレーム）。出力したフレーム数で進む"""
+        return self._play_frame
+
+    @property
+    def position(self) -> float:
+        """再生位置（秒）"""
+        return self._play_frame / self.sample_rate
+
+    # --- 出力ストリーム ---
+    def _ensure_stream(self):
+        if self._stream is not None:
+            return
+        import pyaudio
+        self._pa_continue = pyaudio.paContinue
+        self._pyaudio = pyaudio.PyAudio()
+        self._stream = self._pyaudio.open(
+            format=pyaudio.paFloat32, channels=1, rate=self.sample_rate, output=True,
+            frames_per_buffer=self.block_frames, stream_callback=self._callback
+        )
+        self._stream.start_stream()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if frame_count > self._out.size:
+            self._out = np.zeros(frame_count, dtype=np.float32)
+        out = self._out[:frame_count]
+        self._fill(out)
+        return (out.tobytes(), self._pa_continue)
+
+    def _fill(self, out):
+        """出力ブロック out をリングバッファから埋める（足りない分と停止中は無音）"""
+        frame_count = out.size
+        out.fill(0.0)
+        with self._lock:
+            if self._playing and self._loop_range is not None and self._fill_loop_locked(out):
+                pass
+            elif self._playing:
+                want = frame_count
+                if self._end_frame is not None:
+                    want = max(0, min(want, self._end_frame - self._play_frame))
+                n = min(want, self._write - self._read)
+                if n > 0:
+                    self._copy_from_ring(out, n)
+                    self._read += n
+                    self._play_frame += n
+                if n < want and not self._source_done:
+                    self.underruns += 1
+                reached_end = self._end_frame is not None and self._play_frame >= self._end_frame
+                if reached_end or (self._source_done and self._read == self._write):
+                    self._playing = False
+                    self._finished = True
+        self._wake.set()
+
+    def _fill_loop_locked(self, out) -> bool:
+        """ループ区間の中ならキャッシュから出力ブロックを埋めて True を返す"""
+        start, end = self._loop_range
+        loop = self._loop_buf
+        if loop is None:
+            if self._play_frame >= end:
+                # キャッシュが間に合わなかった。リングバッファを巻き戻して区間の先頭から合成し直す
+                self._reset_locked(start)
+            return False
+        if not (start <= self._play_frame < end):
+            return False
+
+        # 区間の終わりで先頭へサンプル単位で折り返す（継ぎ目のクロスフェードはキャッシュに含まれている）
+        pos = self._play_frame - start
+        filled = 0
+        while filled < out.size:
+            n = min(out.size - filled, loop.size - pos)
+            out[filled:filled + n] = loop[pos:pos + n]
+            filled += n
+            pos = (pos + n) % loop.size
+        self._play_frame = start + pos
+        return True
+
+    def _copy_from_ring(self, out, n):
+        size = self._ring.size
+        start = self._read % size
+        first = min(n, size - start)
+        out[:first] = self._ring[start:start + first]
+        if first < n:
+            out[first:n] = self._ring[:n - first]
+
+    def _copy_to_ring(self, data):
+        size = self._ring.size
+        n = data.size
+        start = self._write % size
+        first = min(n, size - start)
+        self._ring[start:start + first] = data[:first]
+        if first < n:
+            self._ring[:n - first] = data[first:]
+
+    # --- 合成スレッド ---
+    def _render_loop(self):
+        lib = self.engine.lib
+        keep_alive = None
+        req = None
+        master_gen = None       # マスターバッファから読める世代
+        session_stale = False   # マスターバッファから読んだ分、セッションの位置が遅れている
+        loop_job = None
+        block = np.zeros(self.render_frames, dtype=np.float32)
+        block_ptr = block.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+
+        while self._running:
+            with self._lock:
+                pending, self._pending = self._pending, None
+                seek_to, self._seek_to = self._seek_to, None
+                free = self._ring.size - (self._write - self._read)
+                write_frame = self._write_frame
+                loop_gen, loop_range, loop_ready = self._loop_gen, self._loop_range, self._loop_buf is not None
+
+            if pending is not None:
+                # 曲が差し替えられた。先読みしてある分の続きから新しいセッションで合成する
+                req, new_keep_alive, master_gen = pending
+                if self._session:
+                    lib.vse_render_close(self._session)
+                self._session = lib.vse_render_open(ctypes.byref(req)) if req is not None else None
+                keep_alive = new_keep_alive
+                if self._session:
+                    lib.vse_render_seek(self._session, write_frame)
+                session_stale = False
+                with self._lock:
+                    self._source_done = self._session is None
+            elif seek_to is not None and self._session:
+                lib.vse_render_seek(self._session, seek_to)
+                session_stale = False
+
+            if loop_job is not None and loop_job.gen != loop_gen:
+                loop_job.close()
+                loop_job = None
+            if loop_job is None and loop_range is not None and not loop_ready and req is not None:
+                loop_job = _LoopRender(lib, req, loop_range, self.loop_crossfade_frames, loop_gen)
+
+            if not self._session or free < self.render_frames:
+                # 先読みが足りている間にループ区間を少しずつ合成する
+                if loop_job is not None:
+                    if loop_job.step(self.render_frames):
+                        with self._lock:
+                            if self._loop_gen == loop_job.gen:
+                                self._loop_buf = loop_job.result()
+                        loop_job.close()
+                        loop_job = None
+                    continue
+                self._wake.wait(0.05)
+                self._wake.clear()
+                continue
+
+            written = 0
+            if master_gen is not None:
+                written = lib.vse_master_read(master_gen, req.resample_quality, write_frame, block_ptr, self.render_frames)
+                session_stale = session_stale or written > 0
+            if written <= 0:
+                if session_stale:
+                    lib.vse_render_seek(self._session, write_frame)
+                    session_stale = False
+                written = lib.vse_render_pull(self._session, block_ptr, self.render_frames)
+            with self._lock:
+                if self._seek_to is not None or self._pending is not None:
+                    continue  # 合成している間にシーク・差し替えがあったので捨てる
+                if written <= 0:
+                    self._source_done = True
+                else:
+                    self._copy_to_ring(block[:written])
+                    self._write += written
+                    self._write_frame += written
+
+            if written <= 0:
+                self._wake.wait(0.05)
+                self._wake.clear()
+
+        if loop_job is not None:
+            loop_job.close()
+        if self._session:
+            lib.vse_render_close(self._session)
+            self._session = None
+        keep_alive = None
+
+    def close(self):
+        """ストリームと合成スレッドを終了する"""
+        self._running = False
+        self._wake.set()
+        self._thread.join(timeout=1.0)
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._pyaudio is not None:
+            self._pyaudio.terminate()
+            self._pyaudio = None
+
+
+class _LoopRender:
+    """
+    ループ区間を専用のセッションで少しずつ合成する（合成スレッドだけが使う）。
+    区間の直前 crossfade フレームも一緒に合成し、区間の末尾をそこへ等パワーでクロスフェードさせる。
+    こうしておくと、末尾から先頭へ折り返したとき区間開始直前からそのまま続けて鳴らしたのと同じつながりになる。
+    """
+
+    def __init__(self, lib, req, loop_range, crossfade: int, gen: int):
+        self.lib = lib
+        self.gen = gen
+        start, end = loop_range
+        self.pre = min(crossfade, start)
+        self.buf = np.zeros(self.pre + (end - start), dtype=np.float32)
+        self.pos = 0
+        self.session = lib.vse_render_open(ctypes.byref(req))
+        if self.session:
+            lib.vse_render_seek(self.session, start - self.pre)
+
+    def step(self, frames: int) -> bool:
+        """最大 frames フレーム合成する。区間を合成し終えたら True"""
+        n = min(frames, self.buf.size - self.pos)
+        if self.session and n > 0:
+            ptr = self.buf[self.pos:].ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+            written = self.lib.vse_render_pull(self.session, ptr, n)
+            if written < n:
+                n = self.buf.size - self.pos  # 曲の終わりより先は無音のまま
+        else:
+            n = self.buf.size - self.pos
+        self.pos += n
+        return self.pos >= self.buf.size
+
+    def result(self):
+        loop = self.buf[self.pre:].copy()
+        x = min(self.pre, loop.size)
+        if x > 0:
+            t = (np.arange(x, dtype=np.float32) + 0.5) / x * (np.pi / 2)
+            lead_in = self.buf[self.pre - x:self.pre]
+            loop[-x:] = loop[-x:] * np.cos(t) + lead_in * np.sin(t)
+        return loop
+
+    def close(self):
+        if self.session:
+            self.lib.vse_render_close(self.session)
+            self.session = None
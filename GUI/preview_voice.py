@@ -0,0 +1,117 @@
+# preview_voice.py
+#
+# ノートのクリックや編集時の試聴。
+# Cエンジンのプレビューボイス（vse_preview_*）を、小さいバッファで開いた専用の出力ストリームで鳴らす。
+# 発音・消音はエンジンのキューに積むだけなのでGUIスレッドを止めず、複数の音を重ねて鳴らせる。
+
+import ctypes
+import threading
+
+import numpy as np
+
+from vo_se_engine import VsePreviewStats
+
+PREVIEW_BLOCK_FRAMES = 128   # 44100Hz で約2.9ms。クリックから音が出るまでを 20ms 未満に収めるため小さくする
+
+
+class PreviewVoice:
+    """
+    試聴用の発音。
+
+        preview = PreviewVoice(engine)
+        voice = preview.note_on(note.phonemes[0], note.note_number, note.velocity)
+        ...
+        preview.note_off(voice)
+
+    キャラクターの読み込みが終わるとエンジンがアタック部分を用意する（VO_SE_Engine.set_active_character）。
+    """
+
+    def __init__(self, engine, block_frames: int = PREVIEW_BLOCK_FRAMES):
+        self.engine = engine
+        self.lib = engine.lib
+        self.sample_rate = engine.sample_rate
+        self.block_frames = block_frames
+        self._pyaudio = None
+        self._stream = None
+        self._pa_continue = None
+        self._stream_lock = threading.Lock()
+        self._out = np.zeros(block_frames, dtype=np.float32)
+
+    def start(self):
+        """出力ストリームを開いておく（最初の発音の前に開いておくと、その分待たされない）"""
+        self._ensure_stream()
+
+    # --- 発音 ---
+    def note_on(self, phoneme: str, note_number: int, velocity: int = 100) -> int:
+        """鳴らし始める（すぐ戻る）。戻り値は note_off に渡すボイスID（鳴らせなければ -1）"""
+        self._ensure_stream()
+        return self.lib.vse_preview_note_on(phoneme.encode('utf-8'), note_number, velocity)
+
+    def default_phoneme(self) -> str:
+        """歌詞のない発音に使う音素名（キャラクターの母音 "a"、なければ最初の音素）。準備前は None"""
+        buf = ctypes.create_string_buffer(64)
+        if self.lib.vse_preview_default_phoneme(buf, len(buf)) != 0:
+            return None
+        return buf.value.decode('utf-8', errors='replace')
+
+    def note_off(self, voice_id: int):
+        if voice_id > 0:
+            self.lib.vse_preview_note_off(voice_id)
+
+    def all_off(self):
+        self.lib.vse_preview_all_off()
+
+    # --- レイテンシ ---
+    def get_stats(self) -> dict:
+        """
+        発音数とレイテンシの統計。
+        *_latency_ms は発音の指示からコールバックで鳴らし始めるまで、
+        output_latency_ms は出力デバイスのバッファ分で、クリックから音が出るまではその合計になる。
+        """
+        stats = VsePreviewStats()
+        self.lib.vse_preview_get_stats(ctypes.byref(stats))
+        result = {name: getattr(stats, name) for name, _ in VsePreviewStats._fields_}
+        output_ms = self._stream.get_output_latency() * 1000.0 if self._stream is not None else 0.0
+        result["output_latency_ms"] = output_ms
+        result["click_to_sound_ms"] = result["avg_latency_ms"] + output_ms
+        return result
+
+    def reset_stats(self):
+        self.lib.vse_preview_reset_stats()
+
+    # --- 出力ストリーム ---
+    def _ensure_stream(self):
+        if self._stream is not None:
+            return
+        with self._stream_lock:
+            if self._stream is not None:
+                return
+            import pyaudio
+            self._pa_continue = pyaudio.paContinue
+            self._pyaudio = pyaudio.PyAudio()
+            self._stream = self._pyaudio.open(
+                format=pyaudio.paFloat32, channels=1, rate=self.sample_rate, output=True,
+                frames_per_buffer=self.block_frames, stream_callback=self._callback
+            )
+            self._stream.start_stream()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if frame_count > self._out.size:
+            self._out = np.zeros(frame_count, dtype=np.float32)
+        out = self._out[:frame_count]
+        self._fill(out)
+        return (out.tobytes(), self._pa_continue)
+
+    def _fill(self, out):
+        out.fill(0.0)
+        self.lib.vse_preview_render(out.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), out.size)
+
+    def close(self):
+        self.all_off()
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._pyaudio is not None:
+            self._pyaudio.terminate()
+            self._pyaudio = None
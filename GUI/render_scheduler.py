@@ -0,0 +1,251 @@
+# render_scheduler.py
+#
+# 編集中の曲をバックグラウンドでマスターバッファへ合成しておくスケジューラ。
+# 曲を BACKGROUND_CHUNK_SEC 秒ごとの区間に分け、優先度の高い区間から1つずつ合成する。
+#
+#   1. 再生位置から PLAYBACK_LOOKAHEAD_SEC 秒先まで（再生中だけ）
+#   2. タイムラインに表示している範囲
+#   3. それ以外（曲の先頭から順に）
+#
+# 編集するたびに VO_SE_Engine.render_generation が進み、エンジン側で古い世代の合成はノート・音素の境目で中止される。
+# 中止された区間は新しい世代で合成し直す（編集された範囲はエンジン側で合成済みから外れているので、
+# 変更のない区間はすぐに終わる）。
+# 合成済みの部分は PlaybackEngine が vse_master_read で読むので、再生時に同じ部分を合成し直さなくてよい。
+
+import ctypes
+import heapq
+import itertools
+import threading
+
+import numpy as np
+
+from vo_se_engine import RENDER_CANCELLED
+
+PRIORITY_PLAYBACK = 0
+PRIORITY_VISIBLE = 1
+PRIORITY_BACKGROUND = 2
+
+BACKGROUND_CHUNK_SEC = 5.0     # 1回の合成ジョブで扱う長さ
+PLAYBACK_LOOKAHEAD_SEC = 10.0  # 再生位置からこの先までを最優先で合成する
+SONG_TAIL_SEC = 1.0            # 最後のノートの後ろに残す余韻
+
+
+class RenderScheduler:
+    """
+    VO_SE_Engine のマスターバッファをバックグラウンドのスレッドで合成する。
+
+        scheduler = RenderScheduler(engine)
+        scheduler.update_project(notes, pitch_events)   # 編集のたびに呼ぶ
+        scheduler.set_visible_range(start, end)         # 秒。スクロール・ズームのたびに呼ぶ
+        scheduler.set_playback_position(t)              # 再生中は再生位置（秒）、停止したら None
+        audio = scheduler.read(start, end)              # 合成済みなら波形、まだなら None
+        scheduler.close()
+
+    on_rendered(start, end) は区間を1つ合成し終えるたびに合成スレッドから呼ばれる。
+    """
+
+    def __init__(self, engine, on_rendered=None):
+        self.engine = engine
+        self.sample_rate = engine.sample_rate
+        self.on_rendered = on_rendered
+
+        self._cond = threading.Condition()
+        self._notes = []
+        self._pitch_events = []
+        self._quality = engine.resample_quality
+        self._song_end = 0.0
+        self._visible = None       # (開始秒, 終了秒)
+        self._play_chunk = None    # 再生位置のある区間の番号
+        self._queue = []           # [(優先度, 登録順, 区間の番号), ...]
+        self._order = itertools.count()
+        self._done = set()         # 今の世代で合成し終えた区間
+        self._generation = None    # キューを作ったときの世代
+        self._busy = False
+
+        self.jobs_done = 0
+        self.jobs_cancelled = 0
+        self.jobs_failed = 0
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="render-scheduler", daemon=True)
+        self._thread.start()
+
+    # --- GUIスレッドから呼ぶ ---
+    def update_project(self, notes, pitch_events, quality: int = None):
+        """編集後の曲を渡す。変更された範囲を記録して世代を進め、合成し直させる"""
+        notes = list(notes)
+        pitch_events = list(pitch_events)
+        with self._cond:
+            self._notes = notes
+            self._pitch_events = pitch_events
+            new_quality = self.engine.resample_quality if quality is None else quality
+            if new_quality != self._quality:
+                self._quality = new_quality
+                self.engine.mark_all_dirty()
+            self._song_end = max((n.start_time + n.duration for n in notes), default=0.0)
+            if notes:
+                self._song_end += SONG_TAIL_SEC
+            self.engine.mark_notes_dirty(notes)
+            self.engine.mark_pitch_dirty(pitch_events)
+            self._cond.notify()
+
+    def set_visible_range(self, start: float, end: float):
+        """タイムラインに表示している範囲（秒）を優先して合成する"""
+        with self._cond:
+            visible = (max(0.0, start), max(0.0, end))
+            if visible == self._visible:
+                return
+            self._visible = visible
+            self._rebuild_queue_locked()
+            self._cond.notify()
+
+    def set_playback_position(self, time_sec):
+        """再生位置（秒）の先を最優先で合成する。停止したら None"""
+        chunk = None if time_sec is None else int(max(0.0, time_sec) // BACKGROUND_CHUNK_SEC)
+        with self._cond:
+            if chunk == self._play_chunk:
+                return  # 区間が変わったときだけ並べ直す
+            self._play_chunk = chunk
+            self._rebuild_queue_locked()
+            self._cond.notify()
+
+    @property
+    def generation(self) -> int:
+        """最新の世代（PlaybackEngine.set_project に渡す）"""
+        return self.engine.render_generation
+
+    @property
+    def is_idle(self) -> bool:
+        """今の世代の区間をすべて合成し終えていれば True"""
+        with self._cond:
+            return self._idle_locked()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """今の世代を合成し終えるまで待つ。タイムアウトしたら False"""
+        with self._cond:
+            return self._cond.wait_for(self._idle_locked, timeout)
+
+    def read(self, start: float, end: float):
+        """[start, end) 秒の合成済みの波形を返す。今の世代でまだ合成していない部分があれば None"""
+        first = max(0, int(start * self.sample_rate))
+        count = int(end * self.sample_rate) - first
+        if count <= 0:
+            return np.zeros(0, dtype=np.float32)
+        out = np.empty(count, dtype=np.float32)
+        copied = self.engine.lib.vse_master_read(
+            self.generation, self._quality, first, out.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), count
+        )
+        return out if copied else None
+
+    def close(self):
+        """合成スレッドを止める（実行中のジョブは中止させる）"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        # 世代を進めて、実行中の合成をすぐに抜けさせる
+        self.engine.mark_all_dirty()
+        self._thread.join(timeout=2.0)
+
+    # --- キュー ---
+    def _chunk_count_locked(self) -> int:
+        if self._song_end <= 0.0:
+            return 0
+        return int(self._song_end // BACKGROUND_CHUNK_SEC) + 1
+
+    def _idle_locked(self) -> bool:
+        if self._busy or self._generation != self.engine.render_generation:
+            return False
+        return all(i in self._done for i in range(self._chunk_count_locked()))
+
+    def _rebuild_queue_locked(self):
+        """優先度ごとに区間を並べ直す（合成済みの区間は入れない）"""
+        count = self._chunk_count_locked()
+        prio = [PRIORITY_BACKGROUND] * count
+        if self._visible is not None:
+            first = int(self._visible[0] // BACKGROUND_CHUNK_SEC)
+            last = int(self._visible[1] // BACKGROUND_CHUNK_SEC)
+            for i in range(max(0, first), min(count - 1, last) + 1):
+                prio[i] = PRIORITY_VISIBLE
+        play_order = []
+        if self._play_chunk is not None:
+            ahead = int(PLAYBACK_LOOKAHEAD_SEC // BACKGROUND_CHUNK_SEC)
+            play_order = range(self._play_chunk, min(count, self._play_chunk + ahead + 1))
+            for i in play_order:
+                prio[i] = PRIORITY_PLAYBACK
+
+        self._queue = []
+        self._order = itertools.count()
+        # 再生位置の先は近い順、それ以外は曲の先頭から順に
+        for i in play_order:
+            if i not in self._done:
+                self._queue.append((PRIORITY_PLAYBACK, next(self._order), i))
+        for i in range(count):
+            if i not in self._done and prio[i] != PRIORITY_PLAYBACK:
+                self._queue.append((prio[i], next(self._order), i))
+        heapq.heapify(self._queue)
+
+    def _next_job_locked(self):
+        """次に合成する区間の番号。世代が変わっていたらキューを作り直す"""
+        generation = self.engine.render_generation
+        if generation != self._generation:
+            self._generation = generation
+            self._done = set()
+            self._rebuild_queue_locked()
+        while self._queue:
+            _, _, chunk = heapq.heappop(self._queue)
+            if chunk not in self._done:
+                return generation, chunk
+        return generation, None
+
+    # --- 合成スレッド ---
+    def _run(self):
+        lib = self.engine.lib
+        request = None  # (世代, SynthesisRequest, keep_alive)
+
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    generation, chunk = self._next_job_locked()
+                    if chunk is not None:
+                        break
+                    self._cond.notify_all()  # wait_idle を起こす
+                    # 編集は update_project で通知されるが、エンジンを直接触る変更（キャラクター切り替えなど）は世代だけで気づく
+                    self._cond.wait(0.5)
+                self._busy = True
+                notes, pitch_events, quality = self._notes, self._pitch_events, self._quality
+
+            try:
+                if request is None or request[0] != generation:
+                    req, keep_alive = self.engine._make_request(notes, pitch_events, quality)
+                    request = (generation, req, keep_alive)
+                req = request[1]
+
+                start = chunk * BACKGROUND_CHUNK_SEC
+                end = start + BACKGROUND_CHUNK_SEC
+                dirty, full = self.engine.take_dirty_ranges()
+                ranges = (ctypes.c_float * (2 * len(dirty)))(*[t for r in dirty for t in r])
+                result = lib.vse_master_render_job(
+                    ctypes.byref(req), ranges, len(dirty), 1 if full else 0, start, end, generation
+                )
+            finally:
+                with self._cond:
+                    self._busy = False
+
+            if result == RENDER_CANCELLED:
+                # 編集されたので、新しい世代のキューからやり直す（変更範囲はエンジン側で無効化済み）
+                self.jobs_cancelled += 1
+                continue
+            if result < 0:
+                self.jobs_failed += 1
+                self.engine.mark_all_dirty()
+                continue
+
+            with self._cond:
+                if self._generation == generation:
+                    self._done.add(chunk)
+                self.jobs_done += 1
+                self._cond.notify_all()
+            if self.on_rendered is not None:
+                self.on_rendered(start, end)
@@ -28,58 +28,6 @@ class TimelineWidget(QWidget):
     vertical_zoom_changed_signal = Signal()
     notes_changed_signal = Signal()
  
-    def __init__(self, parent=None):
-   def __init__(self, parent=None):
-        super().__init__(parent)
-        self.engine = VoSeEngineWrapper()
-        self.pixels_per_second = 100
-        self.note_height = 20  # 1音階の高さ
-        self.base_midi = 84    # 上端の音程(C5)
-        self.notes = []
-
-    def y_to_midi(self, y):
-        return self.base_midi - (y // self.note_height)
-
-    def mousePressEvent(self, event):
-        # クリックした場所の音程を取得
-        midi_note = self.y_to_midi(event.position().y())
-        
-        # エンジンに音程を伝えて音を出す（プレビュー）
-        self.engine.set_pitch(midi_note)
-        self.engine.play_preview() 
-        self.update()
-
-    def paintEvent(self, event):
-        painter = QPainter(self)
-        # 背景（ピアノロール風の横線）
-        self._draw_piano_roll_grid(painter)
-        
-        for note in self.notes:
-            # note.pitch にMIDI番号が入っている想定
-            x = int(note.start_time * self.pixels_per_second)
-            y = self.midi_to_y(note.pitch)
-            width = int(note.duration * self.pixels_per_second)
-            
-            rect = QRect(x, y, width, self.note_height)
-            painter.setBrush(QColor(150, 200, 255))
-            painter.drawRect(rect)
-            painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, note.lyric)
-
-    def _draw_piano_roll_grid(self, painter):
-        painter.setPen(QPen(QColor(230, 230, 230), 1))
-        for i in range(0, self.height(), self.note_height):
-            painter.drawLine(0, i, self.width(), i)
-
-    def mouseReleaseEvent(self, event):
-        # クリックした位置から音程を特定
-        midi_note = self.y_to_midi(int(event.position().y()))
-        print(f"選択された音程: MIDI {midi_note}")
-        
-        # 【重要】ここでC言語エンジンへ音程変更を通知する
-        # self.engine.set_pitch(midi_note) 
-        # self.engine.render_preview()
-
-
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setMinimumSize(400, 200)
@@ -98,6 +46,9 @@ class TimelineWidget(QWidget):
         
         self.edit_mode = None
         self.drag_start_pos = None
+        self.preview_voice = None   # PreviewVoice（MainWindow が設定する）。クリック・ドラッグ中のノートを試聴する
+        self._preview_id = -1
+        self._preview_pitch = None
         self.drag_start_note_pos = None
         self.target_note = None
         self.is_additive_selection_mode = False
@@ -318,6 +269,7 @@ class TimelineWidget(QWidget):
                     self.drag_start_pos = clicked_point
                     self.drag_start_note_pos = {'start': note.start_time, 'duration': note.duration, 'pitch': note.note_number}
                     self.edit_mode = 'resize' if abs(clicked_point.x() - (start_x + width)) < 5 else 'move'
+                    self._start_preview(note)
                     break
             if not clicked_on_note:
                 if not self.is_additive_selection_mode:
@@ -335,6 +287,8 @@ class TimelineWidget(QWidget):
                 delta_pitch = round(delta_y / self.key_height_pixels)
                 self.target_note.start_time = self.beats_to_seconds(self.seconds_to_beats(self.drag_start_note_pos['start']) + delta_beats)
                 self.target_note.note_number = self.drag_start_note_pos['pitch'] - delta_pitch
+                if self.target_note.note_number != self._preview_pitch:
+                    self._start_preview(self.target_note) # 音程が変わったら鳴らし直す
             elif self.edit_mode == 'resize' and self.target_note:
                 delta_x = event.position().x() - self.drag_start_pos.x()
                 delta_beats = delta_x / self.pixels_per_beat
@@ -344,6 +298,7 @@ class TimelineWidget(QWidget):
 
     def mouseReleaseEvent(self, event: QMouseEvent):
         if event.button() == Qt.LeftButton:
+            self._stop_preview()
             if self.edit_mode == 'select_box' and self.selection_start_pos and self.selection_end_pos:
                 final_rect = QRect(self.selection_start_pos, self.selection_end_pos).normalized()
                 for note in self.notes_list:
@@ -377,6 +332,21 @@ class TimelineWidget(QWidget):
             self.drag_start_note_pos = None
             self.target_note = None
 
+    def _start_preview(self, note: NoteEvent):
+        """ノートの最初の音素を試聴する（エンジンのキューに積むだけなのでGUIスレッドは止まらない）"""
+        self._stop_preview()
+        phoneme = note.phonemes[0] if note.phonemes else note.lyric
+        if self.preview_voice is None or not phoneme:
+            return
+        self._preview_id = self.preview_voice.note_on(phoneme, note.note_number, note.velocity)
+        self._preview_pitch = note.note_number
+
+    def _stop_preview(self):
+        if self.preview_voice is not None and self._preview_id > 0:
+            self.preview_voice.note_off(self._preview_id)
+        self._preview_id = -1
+        self._preview_pitch = None
+
     # --- (3) キーボードイベント処理とアクション ---
     def keyPressEvent(self, event: QKeyEvent):
         if event.modifiers() == Qt.ControlModifier and event.key() == Qt.Key_C: self.copy_selected_notes_to_clipboard()
@@ -4,84 +4,13 @@ import ctypes
 import os
 import platform
 import numpy as np
-import pyaudio
 from data_models import NoteEvent, PitchEvent, CharacterInfo
-import ctypes
 import math
 import sys
-
-def get_resource_path(relative_path):
-    # PyInstallerが展開する一時フォルダのパス、または通常実行時のパスを取得
-    base_path = getattr(sys, '_MEIPASS', os.path.abspath("."))
-    return os.path.join(base_path, relative_path)
-
-# DLLの読み込み部分
-dll_name = "engine.dll" if os.name == 'nt' else "engine.dylib"
-dll_path = get_resource_path(f"VO_SE_engine_C/lib/{dll_name}")
-self.lib = ctypes.CDLL(dll_path)
-if getattr(sys, 'frozen', False):
-    # インストーラー（実行ファイル）として動いている場合
-    base_dir = sys._MEIPASS
-else:
-    # 通常のPythonスクリプトとして動いている場合
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-
-# C言語側の構造体と合わせる
-class C_NoteEvent(ctypes.Structure):
-    _fields_ = [
-        ("frequency", ctypes.c_float),
-        ("duration", ctypes.c_float),
-        ("lyric", ctypes.c_char_p)
-    ]
-
-def export_wav(self, notes_list, output_path="output/output.wav"):
-    # 1. PythonのノートリストをC言語用の構造体配列に変換
-    c_notes_array = (C_NoteEvent * len(notes_list))()
-    
-    for i, note in enumerate(notes_list):
-        c_notes_array[i].frequency = self.midi_to_hz(note.pitch)
-        c_notes_array[i].duration = note.duration
-        c_notes_array[i].lyric = note.lyric.encode('utf-8')
-
-    # 2. C言語の書き出し関数を呼び出す
-    self.lib.execute_render_to_file(
-        output_path.encode('utf-8'), 
-        c_notes_array, 
-        len(notes_list)
-    )
-    
-
-class VoSeEngineWrapper:
-    def __init__(self):
-        # C言語でビルドしたDLLをロード
-        try:
-            self.lib = ctypes.CDLL("./VO_SE_engine_C/lib/engine.dll")
-            # C関数の引数型定義: void set_target_frequency(float freq)
-            self.lib.set_target_frequency.argtypes = [ctypes.c_float]
-        except Exception as e:
-            print(f"DLLロード失敗: {e}")
-        # OSに応じたライブラリのロード
-        dll_path = os.path.abspath("./VO_SE_engine_C/lib/engine.dll")
-        self.lib = ctypes.CDLL(dll_path)
-
-        # C関数の型定義
-        # void set_frequency(float hz)
-        self.lib.set_frequency.argtypes = [ctypes.c_float]
-        self.lib.play_note.argtypes = []
-
-    def midi_to_hz(self, midi_note):
-        # MIDIノート番号から周波数(Hz)への変換公式
-        return 440.0 * math.pow(2.0, (midi_note - 69.0) / 12.0)
-
-    def set_pitch(self, midi_note):
-        hz = self.midi_to_hz(midi_note)
-        print(f"DEBUG: 周波数 {hz:.2f}Hz をエンジンに送信")
-        self.lib.set_frequency(hz)
-
-    def play_preview(self):
-        self.lib.play_note()
-
-
+import bisect
+import itertools
+import threading
+import time
 
 def get_base_path():
     """実行ファイル(Nuitka/PyInstaller)化されていても、開発中でも正しくルートを返す"""
@@ -91,96 +20,6 @@ def get_base_path():
     # 開発中の実行時（GUI/vo_se_engine.pyから見たプロジェクトルート）
     return os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
-# --- 実際の使用例 ---
-base = get_base_path()
-
-# 拡張子の自動判別
-ext = ".dll" if platform.system() == "Windows" else ".dylib"
-
-# C言語エンジンのパスを結合
-lib_path = os.path.join(base, "VO_SE_engine_C", "lib", f"engine{ext}")
-
-# 音源フォルダのパスを結合
-audio_dir = os.path.join(base, "audio_data")
-
-print(f"Loading Engine from: {lib_path}")
-print(f"Audio Data Path: {audio_dir}")
-
-
-
-class VO_SE_Engine:
-    def __init__(self, sample_rate: int = 44100):
-        self.sample_rate = sample_rate
-        self.active_character_id = None
-        self._keep_alive = []  # C側へ渡すデータのメモリ解放を防ぐ
-
-        # --- 1. C 言語ライブラリ (.dylib / .dll) のパスを特定 ---
-        # OS に応じて拡張子を自動判別
-        ext = ".dylib" if platform.system() == "Darwin" else ".dll"
-        # ライブラリの保存場所（VO_SE_engine_C/lib/ 内）を指定
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        lib_path = os.path.join(base_dir, "../VO_SE_engine_C/lib/engine" + ext)
-
-        # --- 2. ライブラリを Python にロード ---
-        try:
-            # これが「連絡口」を開く核心の処理です
-            self.lib = ctypes.CDLL(lib_path)
-            
-            # C 言語の関数の「引数」と「戻り値」の型を Python に教えてあげる (大事！)
-            self._setup_c_interfaces()
-            print(f"C-Engine Loaded Successfully: {lib_path}")
-        except Exception as e:
-            print(f"C-Engine Load Error: {e}")
-            print("注意: 先に 'make' 等で C 言語をビルドして engine" + ext + " を作成してください。")
-
-        # --- 3. 音声再生用 (PyAudio) の初期化 ---
-        self.pyaudio_instance = pyaudio.PyAudio()
-
-    def _setup_c_interfaces(self):
-        """C 言語の関数を Python で正しく呼べるように設定する"""
-        # init_engine(char* char_id, char* audio_dir)
-        self.lib.init_engine.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
-        self.lib.init_engine.restype = ctypes.c_int
-
-        # request_synthesis_full(...) -> float*
-        from .vo_se_engine import SynthesisRequest # 構造体定義
-        self.lib.request_synthesis_full.argtypes = [SynthesisRequest, ctypes.POINTER(ctypes.c_int)]
-        self.lib.request_synthesis_full.restype = ctypes.POINTER(ctypes.c_float)
-
-        # vse_free_buffer(float*)
-        self.lib.vse_free_buffer.argtypes = [ctypes.POINTER(ctypes.c_float)]
-        self.lib.vse_free_buffer.restype = None
-
-
-    def switch_character(self, char_id: str):
-        """
-        GUIから選ばれたIDを元に、Cエンジンへ切り替えを指示する
-        """
-        if char_id not in self.available_characters:
-            print(f"エラー: {char_id} というキャラクターは名簿にありません。")
-            return False
-        
-        char = self.available_characters[char_id]
-        
-        # パスを絶対パスに変換（C言語側で確実に読み込むため）
-        abs_path = os.path.abspath(char.audio_dir)
-        
-        # C言語の init_engine(char* id, char* dir) を呼び出し
-        # 2025年現在、文字列は .encode('utf-8') で渡すのが鉄則です
-        result = self.lib.init_engine(
-            char.id.encode('utf-8'), 
-            abs_path.encode('utf-8')
-        )
-        
-        if result == 0:
-            self.current_char_id = char_id
-            print(f"C-Engine: {char.name} への切り替えに成功しました。")
-            return True
-        else:
-            print(f"C-Engine: {char.name} の音源ロードに失敗しました。")
-            return False
-
-
 
 # --- 1. C言語と共通のデータ構造定義 (ctypes) ---
 
@@ -198,53 +37,257 @@ class CNoteEvent(ctypes.Structure):
         ("phoneme_count", ctypes.c_int)
     ]
 
+def _struct_dtype(struct, formats: dict) -> np.dtype:
+    """ctypes の構造体と同じ並びの NumPy の構造化配列の型（オフセットと大きさは struct から取る）"""
+    return np.dtype({
+        "names": list(formats),
+        "formats": list(formats.values()),
+        "offsets": [getattr(struct, name).offset for name in formats],
+        "itemsize": ctypes.sizeof(struct)
+    })
+
+# CNoteEvent / CPitchEvent と同じメモリ配置。この型の配列はそのまま C に渡せる
+NOTE_DTYPE = _struct_dtype(CNoteEvent, {
+    "note_number": np.int32,
+    "start_time": np.float32,
+    "duration": np.float32,
+    "velocity": np.int32,
+    "lyrics": "S256",
+    "phonemes": np.uintp,      # char**（音素表の中の、このノートの先頭）
+    "phoneme_count": np.int32
+})
+PITCH_DTYPE = _struct_dtype(CPitchEvent, {"time": np.float32, "value": np.int32})
+
 class SynthesisRequest(ctypes.Structure):
     _fields_ = [
         ("notes", ctypes.POINTER(CNoteEvent)),
         ("note_count", ctypes.c_int),
         ("pitch_events", ctypes.POINTER(CPitchEvent)),
         ("pitch_event_count", ctypes.c_int),
-        ("sample_rate", ctypes.c_int)
+        ("sample_rate", ctypes.c_int),
+        ("resample_quality", ctypes.c_int)
+    ]
+
+# リサンプルの品質（SynthesisRequest.resample_quality）
+RESAMPLE_LINEAR = 0      # 線形補間（プレビュー向け、最速）
+RESAMPLE_SINC_FAST = 1   # 8タップの窓付き sinc
+RESAMPLE_SINC_BEST = 2   # 32タップの窓付き sinc（書き出し向け）
+
+# WAV書き出しのサンプル形式（export_wav）
+WAV_PCM16 = 16
+WAV_PCM24 = 24
+WAV_FLOAT32 = 32
+
+class VseLookupStats(ctypes.Structure):
+    _fields_ = [
+        ("lookups", ctypes.c_longlong),
+        ("hits", ctypes.c_longlong),
+        ("alias_hits", ctypes.c_longlong),
+        ("fallback_hits", ctypes.c_longlong),
+        ("misses", ctypes.c_longlong)
     ]
 
+class VseCacheStats(ctypes.Structure):
+    _fields_ = [
+        ("hits", ctypes.c_longlong),
+        ("misses", ctypes.c_longlong),
+        ("evictions", ctypes.c_longlong),
+        ("entries", ctypes.c_longlong),
+        ("bytes", ctypes.c_size_t),
+        ("limit", ctypes.c_size_t)
+    ]
+
+class VsePoolStats(ctypes.Structure):
+    _fields_ = [
+        ("loads", ctypes.c_longlong),
+        ("switches", ctypes.c_longlong),
+        ("evictions", ctypes.c_longlong),
+        ("resident", ctypes.c_int),
+        ("bytes", ctypes.c_size_t),
+        ("budget", ctypes.c_size_t)
+    ]
+
+class VsePreviewStats(ctypes.Structure):
+    _fields_ = [
+        ("triggers", ctypes.c_longlong),
+        ("dropped", ctypes.c_longlong),
+        ("stolen", ctypes.c_longlong),
+        ("active_voices", ctypes.c_int),
+        ("last_latency_ms", ctypes.c_double),
+        ("max_latency_ms", ctypes.c_double),
+        ("avg_latency_ms", ctypes.c_double)
+    ]
+
+class VseScratchStats(ctypes.Structure):
+    _fields_ = [
+        ("renders", ctypes.c_longlong),
+        ("heap_allocs", ctypes.c_longlong),
+        ("last_render_allocs", ctypes.c_longlong),
+        ("max_render_allocs", ctypes.c_longlong),
+        ("zero_alloc_renders", ctypes.c_longlong),
+        ("reserved_bytes", ctypes.c_longlong),
+        ("peak_bytes", ctypes.c_longlong)
+    ]
+
+# 合成の段階（VsePerfStats.stages の並び）
+PERF_STAGES = ("render", "index", "pitch", "lookup", "cache", "resample", "mix", "alloc", "encode")
+
+class VseStageStat(ctypes.Structure):
+    _fields_ = [
+        ("calls", ctypes.c_longlong),
+        ("ns", ctypes.c_longlong)
+    ]
+
+class VsePerfStats(ctypes.Structure):
+    _fields_ = [
+        ("stages", VseStageStat * len(PERF_STAGES)),
+        ("rendered_frames", ctypes.c_longlong),
+        ("voicebank_loads", ctypes.c_longlong),
+        ("voicebank_load_ns", ctypes.c_longlong),
+        ("voicebank_bytes", ctypes.c_longlong)
+    ]
+
+# vse_load_character の進捗コールバック
+# (stage, files_done, files_total, bytes_done, bytes_total, user_data)
+VseLoadProgressCallback = ctypes.CFUNCTYPE(
+    None, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong, ctypes.c_void_p
+)
+
+VSE_LOAD_STAGE_READ = 0      # 音源ファイルの読み込み
+VSE_LOAD_STAGE_WARM_UP = 1   # ウォームアップ
+VSE_LOAD_CANCELLED = -2
+RENDER_CANCELLED = -2        # vse_master_render_job が新しい世代に置き換えられて中止された
+
+class VoicebankLoadTask:
+    """
+    音源の読み込みをバックグラウンドスレッドで行う。
+    on_progress(stage, files_done, files_total, bytes_done, bytes_total) と on_finished(result) は
+    読み込みスレッドから呼ばれるので、GUIを更新する場合は Signal などでメインスレッドに渡すこと。
+    """
+    def __init__(self, lib, char_id: str, audio_dir: str, on_progress=None, on_finished=None, warm_up: bool = True):
+        self.lib = lib
+        self.char_id = char_id
+        self.audio_dir = audio_dir
+        self.warm_up = warm_up
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.progress = (VSE_LOAD_STAGE_READ, 0, 0, 0, 0)
+        self.result = None
+        self._done = threading.Event()
+        self._callback = VseLoadProgressCallback(self._report) # Cから呼ばれている間は解放させない
+        self._thread = threading.Thread(target=self._run, name=f"voicebank-load-{char_id}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _report(self, stage, files_done, files_total, bytes_done, bytes_total, user_data):
+        self.progress = (stage, files_done, files_total, bytes_done, bytes_total)
+        if self.on_progress:
+            self.on_progress(*self.progress)
+
+    def _run(self):
+        try:
+            self.result = self.lib.vse_load_character(
+                self.char_id.encode('utf-8'), self.audio_dir.encode('utf-8'),
+                self._callback, None, 1 if self.warm_up else 0
+            )
+        finally:
+            self._done.set()
+        if self.on_finished:
+            self.on_finished(self.result)
+
+    def cancel(self):
+        """読み込みを中止させる（エンジンは実行中の読み込みをすべて中止する）"""
+        if not self._done.is_set():
+            self.lib.vse_cancel_load()
+
+    def wait(self, timeout: float = None) -> bool:
+        """読み込みが終わるまで待つ。終わっていれば True"""
+        return self._done.wait(timeout)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def succeeded(self) -> bool:
+        return self.result == 0
+
+class AudioBufferPool:
+    """
+    合成先の float32 バッファを使い回すためのプール。
+    acquire で必要な長さ以上のバッファを借り、使い終わったら release で返す。
+    """
+    def __init__(self, max_buffers: int = 4):
+        self.max_buffers = max_buffers
+        self._free: list[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def acquire(self, min_length: int) -> np.ndarray:
+        with self._lock:
+            candidates = [b for b in self._free if b.size >= min_length]
+            if candidates:
+                buf = min(candidates, key=lambda b: b.size)
+                self._free.remove(buf)
+                return buf
+        # 少し大きめに確保しておくと、編集で曲が伸びても再確保せずに済む
+        return np.empty(int(min_length * 1.25) + 1, dtype=np.float32)
+
+    def release(self, buf: np.ndarray):
+        if buf.base is not None: buf = buf.base # スライスで返された場合は元の配列に戻す
+        with self._lock:
+            if any(b is buf for b in self._free): return
+            self._free.append(buf)
+            if len(self._free) > self.max_buffers:
+                self._free.remove(min(self._free, key=lambda b: b.size))
+
+
 # --- 2. エンジン本体のクラス ---
 
 class VO_SE_Engine:
     def __init__(self, sample_rate: int = 44100):
         self.sample_rate = sample_rate
         self.active_character_id = None
-        self.pyaudio_instance = pyaudio.PyAudio()
+        self.pyaudio_instance = None  # 初めて再生するときに作る（バッチレンダリングでは pyaudio を読み込まない）
         self._keep_alive = [] # Cへ渡すデータのメモリ解放を防ぐためのリスト
+        # 音素名 -> C文字列のアドレス。音素名は曲の中で何度も出てくるので、エンコードはエンジンごとに1回だけ
+        self._phoneme_addresses = {}
+        self._phoneme_buffers = []  # 上のアドレスの実体（エンジンが生きている間は解放しない）
+
+        # 差分レンダリング用: 前回合成したときのノート/ピッチの状態と、変更された時間範囲
+        self._note_snapshot = {}       # id(note) -> (開始秒, 終了秒, 合成に関わる値)
+        self._pitch_snapshot = []      # [(time, value), ...]
+        self._dirty_ranges = []        # [(開始秒, 終了秒), ...]
+        self._needs_full_render = True
+        # 変更を記録するたびに進める世代番号。古い世代のバックグラウンド合成はエンジン側で中止される
+        self.render_generation = 0
+        # _marshal_notes（ノートをCの構造体にする処理）の回数と時間。get_perf_stats で "marshal" として返す
+        self._marshal_calls = 0
+        self._marshal_ns = 0
+        self._perf_lock = threading.Lock()
+        self._dirty_lock = threading.Lock()  # GUIスレッドとバックグラウンド合成スレッドの両方から触る
+
+        self.buffer_pool = AudioBufferPool()
+        self._load_task = None  # 実行中の音源読み込み（VoicebankLoadTask）
+        self.characters = self.scan_characters()  # キャラクターID -> CharacterInfo（GUIの選択肢）
+        self.resample_quality = RESAMPLE_LINEAR  # quality を省略したときの品質（プレビューは速さ優先）
 
         # --- C言語ライブラリのロード (OS自動判別) ---
-        ext = ".dylib" if platform.system() == "Darwin" else ".dll"
+        ext = {"Darwin": ".dylib", "Windows": ".dll"}.get(platform.system(), ".so")
         lib_path = os.path.abspath(os.path.join(os.path.dirname(__file__), f"../VO_SE_engine_C/lib/engine{ext}"))
-        
+        self.lib = None
+        self.load_error = None  # 読み込めなかったときの理由（GUIは起動を続け、バッチ処理はここで止める）
+
         try:
             self.lib = ctypes.CDLL(lib_path)
             self._setup_c_interfaces()
             print(f"C-Engine Loaded: {lib_path}")
         except Exception as e:
+            self.lib = None
+            self.load_error = str(e)
             print(f"C-Engine Load Error: {e}\nビルドされたライブラリが lib/ にあるか確認してください。")
 
-    　　# GUI/vo_se_engine.py の VO_SE_Engine クラス内に追加
-
-　　　def load_character(self, char_id: str, folder_path: str):
-        """
-        C言語エンジンに音源の読み込みを命令する
-        """
-        path_bytes = os.path.abspath(folder_path).encode('utf-8')
-        id_bytes = char_id.encode('utf-8')
-    
-        # C言語の init_engine を呼び出す
-        result = self.lib.init_engine(id_bytes, path_bytes)
-    
-        if result == 0:
-           print(f"成功: キャラクター {char_id} をロードしました。")
-        else:
-           print(f"失敗: {folder_path} が見つからないか、読み込めませんでした。")
-
-
     def _setup_c_interfaces(self):
         """C言語関数の引数と戻り値を設定"""
         # init_engine(char* id, char* dir)
@@ -259,57 +302,435 @@ class VO_SE_Engine:
         self.lib.vse_free_buffer.argtypes = [ctypes.POINTER(ctypes.c_float)]
         self.lib.vse_free_buffer.restype = None
 
-    def set_active_character(self, char_info: CharacterInfo):
-        """キャラクターを切り替え、Cエンジンに音源をロードさせる"""
-        self.active_character_id = char_info.id
-        audio_dir = os.path.abspath(char_info.engine_params.get("audio_dir", ""))
-        result = self.lib.init_engine(char_info.id.encode('utf-8'), audio_dir.encode('utf-8'))
-        if result == 0:
-            print(f"Character {char_info.name} loaded successfully.")
-        else:
-            print(f"Failed to load character {char_info.name}.")
+        # 区間だけの合成: vse_render_window(request, start, end, int*) -> float*
+        self.lib.vse_render_window.argtypes = [
+            ctypes.POINTER(SynthesisRequest), ctypes.c_float, ctypes.c_float, ctypes.POINTER(ctypes.c_int)
+        ]
+        self.lib.vse_render_window.restype = ctypes.POINTER(ctypes.c_float)
+
+        # 呼び出し側のバッファへの直接合成: vse_render_length / vse_render_into
+        self.lib.vse_render_length.argtypes = [ctypes.POINTER(SynthesisRequest)]
+        self.lib.vse_render_length.restype = ctypes.c_int
+        self.lib.vse_render_into.argtypes = [
+            ctypes.POINTER(SynthesisRequest), ctypes.POINTER(ctypes.c_float), ctypes.c_int
+        ]
+        self.lib.vse_render_into.restype = ctypes.c_int
+
+        # ストリーミング合成: vse_render_open / vse_render_pull / vse_render_close
+        self.lib.vse_render_open.argtypes = [ctypes.POINTER(SynthesisRequest)]
+        self.lib.vse_render_open.restype = ctypes.c_void_p
+        self.lib.vse_render_pull.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_float), ctypes.c_int]
+        self.lib.vse_render_pull.restype = ctypes.c_int
+        self.lib.vse_render_total_frames.argtypes = [ctypes.c_void_p]
+        self.lib.vse_render_total_frames.restype = ctypes.c_int
+        self.lib.vse_render_close.argtypes = [ctypes.c_void_p]
+        self.lib.vse_render_close.restype = None
+        self.lib.vse_render_seek.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        self.lib.vse_render_seek.restype = ctypes.c_int
+
+        # WAV書き出し: vse_render_to_wav(request, path, sample_format, dither)
+        self.lib.vse_render_to_wav.argtypes = [
+            ctypes.POINTER(SynthesisRequest), ctypes.c_char_p, ctypes.c_int, ctypes.c_int
+        ]
+        self.lib.vse_render_to_wav.restype = ctypes.c_int
+
+        # 遅延読み込み（メモリマップ）
+        self.lib.vse_set_load_mode.argtypes = [ctypes.c_int]
+        self.lib.vse_set_load_mode.restype = None
+        self.lib.vse_get_loaded_phoneme_count.argtypes = [ctypes.POINTER(ctypes.c_int)]
+        self.lib.vse_get_loaded_phoneme_count.restype = ctypes.c_int
+        self.lib.vse_compile_voicebank.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+        self.lib.vse_compile_voicebank.restype = ctypes.c_int
+
+        # 常駐音源プール
+        self.lib.vse_activate_character.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+        self.lib.vse_activate_character.restype = ctypes.c_int
+        self.lib.vse_unload_character.argtypes = [ctypes.c_char_p]
+        self.lib.vse_unload_character.restype = ctypes.c_int
+        self.lib.vse_set_voicebank_budget.argtypes = [ctypes.c_size_t]
+        self.lib.vse_set_voicebank_budget.restype = None
+
+        # 非同期読み込み: vse_load_character / vse_cancel_load
+        self.lib.vse_load_character.argtypes = [
+            ctypes.c_char_p, ctypes.c_char_p, VseLoadProgressCallback, ctypes.c_void_p, ctypes.c_int
+        ]
+        self.lib.vse_load_character.restype = ctypes.c_int
+        self.lib.vse_cancel_load.argtypes = []
+        self.lib.vse_cancel_load.restype = None
+        self.lib.vse_get_voicebank_pool_stats.argtypes = [ctypes.POINTER(VsePoolStats)]
+        self.lib.vse_get_voicebank_pool_stats.restype = None
+
+        # 音素検索の統計: vse_get_lookup_stats / vse_get_missing_phoneme / vse_reset_lookup_stats
+        self.lib.vse_get_lookup_stats.argtypes = [ctypes.POINTER(VseLookupStats)]
+        self.lib.vse_get_lookup_stats.restype = None
+        self.lib.vse_get_missing_phoneme_count.argtypes = []
+        self.lib.vse_get_missing_phoneme_count.restype = ctypes.c_int
+        self.lib.vse_get_missing_phoneme.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        self.lib.vse_get_missing_phoneme.restype = ctypes.c_longlong
+        self.lib.vse_reset_lookup_stats.argtypes = []
+        self.lib.vse_reset_lookup_stats.restype = None
+        self.lib.vse_add_phoneme_alias.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+        self.lib.vse_add_phoneme_alias.restype = ctypes.c_int
+        self.lib.vse_add_phoneme_fallback.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+        self.lib.vse_add_phoneme_fallback.restype = ctypes.c_int
+
+        # リサンプル結果キャッシュ
+        self.lib.vse_set_resample_cache_limit.argtypes = [ctypes.c_size_t]
+        self.lib.vse_set_resample_cache_limit.restype = None
+        self.lib.vse_get_resample_cache_stats.argtypes = [ctypes.POINTER(VseCacheStats)]
+        self.lib.vse_get_resample_cache_stats.restype = None
+        self.lib.vse_clear_resample_cache.argtypes = []
+        self.lib.vse_clear_resample_cache.restype = None
+
+        # リサンプラ単体: vse_resample(input, input_len, output, output_len, quality)
+        self.lib.vse_resample.argtypes = [
+            ctypes.POINTER(ctypes.c_float), ctypes.c_int, ctypes.POINTER(ctypes.c_float), ctypes.c_int, ctypes.c_int
+        ]
+        self.lib.vse_resample.restype = None
+
+        # マルチスレッド合成
+        self.lib.vse_set_thread_count.argtypes = [ctypes.c_int]
+        self.lib.vse_set_thread_count.restype = None
+        self.lib.vse_get_thread_count.argtypes = []
+        self.lib.vse_get_thread_count.restype = ctypes.c_int
+
+        # 合成用の作業領域の統計
+        self.lib.vse_get_scratch_stats.argtypes = [ctypes.POINTER(VseScratchStats)]
+        self.lib.vse_get_scratch_stats.restype = None
+        self.lib.vse_reset_scratch_stats.argtypes = []
+        self.lib.vse_reset_scratch_stats.restype = None
+
+        # 段階ごとの計測
+        self.lib.vse_get_perf_stats.argtypes = [ctypes.POINTER(VsePerfStats)]
+        self.lib.vse_get_perf_stats.restype = None
+        self.lib.vse_reset_perf_stats.argtypes = []
+        self.lib.vse_reset_perf_stats.restype = None
+
+        # 差分レンダリング: vse_master_render / vse_master_buffer / vse_master_reset
+        self.lib.vse_master_render.argtypes = [
+            ctypes.POINTER(SynthesisRequest), ctypes.POINTER(ctypes.c_float), ctypes.c_int, ctypes.c_int
+        ]
+        self.lib.vse_master_render.restype = ctypes.c_int
+        self.lib.vse_master_render_window.argtypes = [
+            ctypes.POINTER(SynthesisRequest), ctypes.POINTER(ctypes.c_float), ctypes.c_int, ctypes.c_int,
+            ctypes.c_float, ctypes.c_float
+        ]
+        self.lib.vse_master_render_window.restype = ctypes.c_int
+        self.lib.vse_master_buffer.argtypes = [ctypes.POINTER(ctypes.c_int)]
+        self.lib.vse_master_buffer.restype = ctypes.POINTER(ctypes.c_float)
+        self.lib.vse_master_reset.argtypes = []
+        self.lib.vse_master_reset.restype = None
+
+        # バックグラウンド合成: 世代付きのマスター合成と、合成済み部分の読み出し
+        self.lib.vse_master_render_job.argtypes = [
+            ctypes.POINTER(SynthesisRequest), ctypes.POINTER(ctypes.c_float), ctypes.c_int, ctypes.c_int,
+            ctypes.c_float, ctypes.c_float, ctypes.c_int
+        ]
+        self.lib.vse_master_render_job.restype = ctypes.c_int
+        self.lib.vse_master_supersede.argtypes = [ctypes.c_int]
+        self.lib.vse_master_supersede.restype = None
+        self.lib.vse_master_read.argtypes = [
+            ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_float), ctypes.c_int
+        ]
+        self.lib.vse_master_read.restype = ctypes.c_int
+
+        # プレビューボイス（クリック・編集時の試聴）
+        self.lib.vse_preview_prepare.argtypes = []
+        self.lib.vse_preview_prepare.restype = ctypes.c_int
+        self.lib.vse_preview_note_on.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+        self.lib.vse_preview_note_on.restype = ctypes.c_int
+        self.lib.vse_preview_default_phoneme.argtypes = [ctypes.c_char_p, ctypes.c_int]
+        self.lib.vse_preview_default_phoneme.restype = ctypes.c_int
+        self.lib.vse_preview_note_off.argtypes = [ctypes.c_int]
+        self.lib.vse_preview_note_off.restype = None
+        self.lib.vse_preview_all_off.argtypes = []
+        self.lib.vse_preview_all_off.restype = None
+        self.lib.vse_preview_render.argtypes = [ctypes.POINTER(ctypes.c_float), ctypes.c_int]
+        self.lib.vse_preview_render.restype = ctypes.c_int
+        self.lib.vse_preview_get_stats.argtypes = [ctypes.POINTER(VsePreviewStats)]
+        self.lib.vse_preview_get_stats.restype = None
+        self.lib.vse_preview_reset_stats.argtypes = []
+        self.lib.vse_preview_reset_stats.restype = None
+
+    def scan_characters(self, root: str = None) -> dict:
+        """
+        音源フォルダ（既定はプロジェクトルートの audio_data/）の下のフォルダと *.vsepack を
+        1つずつキャラクターとして名簿にする。キャラクターIDと表示名はフォルダ名（拡張子なし）
+        """
+        root = root or os.path.join(get_base_path(), "audio_data")
+        characters = {}
+        if not os.path.isdir(root):
+            return characters
+        for entry in sorted(os.listdir(root)):
+            path = os.path.join(root, entry)
+            char_id, ext = os.path.splitext(entry)
+            if os.path.isdir(path) or ext == ".vsepack":
+                characters.setdefault(char_id, CharacterInfo(id=char_id, name=char_id, audio_dir=path))
+        return characters
+
+    def set_active_character(self, char_info: CharacterInfo, on_progress=None, on_finished=None,
+                             warm_up: bool = True) -> VoicebankLoadTask:
+        """
+        キャラクターを切り替え、Cエンジンに音源をロードさせる。
+        読み込みはバックグラウンドで行い、すぐに戻る（終わるまでは前のキャラクターで合成される）。
+        一度読み込んだキャラクターはメモリ上限の範囲でエンジンに常駐するので、
+        行き来するだけなら読み込み直さずにすぐ切り替わる。
+        on_progress / on_finished は VoicebankLoadTask を参照。読み込み中の前の切り替えは中止する。
+        """
+        if self._load_task and not self._load_task.done:
+            self._load_task.cancel()
+            self._load_task.wait()
+
+        audio_dir = os.path.abspath(char_info.audio_dir)
+
+        def finished(result):
+            if result == 0:
+                self.active_character_id = char_info.id
+                self.mark_all_dirty() # 音源が変わったので全体を合成し直す
+                self.lib.vse_preview_prepare() # 試聴用のアタック部分も読み込みスレッドで用意しておく
+                print(f"Character {char_info.name} loaded successfully.")
+            elif result == VSE_LOAD_CANCELLED:
+                print(f"Loading character {char_info.name} was cancelled.")
+            else:
+                print(f"Failed to load character {char_info.name}.")
+            if on_finished:
+                on_finished(result)
+
+        self._load_task = VoicebankLoadTask(
+            self.lib, char_info.id, audio_dir, on_progress=on_progress, on_finished=finished, warm_up=warm_up
+        ).start()
+        return self._load_task
+
+    def cancel_character_load(self):
+        if self._load_task:
+            self._load_task.cancel()
+
+    def wait_for_character_load(self, timeout: float = None) -> bool:
+        """実行中の音源読み込みが終わるまで待つ（スクリプトやテスト用）"""
+        return self._load_task.wait(timeout) if self._load_task else True
+
+    def set_lazy_loading(self, enabled: bool):
+        """
+        True にすると、次のキャラクター読み込みから WAV をメモリマップするだけにし、
+        各音素は初めて合成に使うときにデコードする（大きな音源でもすぐに切り替わる）。
+        """
+        self.lib.vse_set_load_mode(1 if enabled else 0)
+
+    def compile_voicebank(self, audio_dir: str, out_path: str = None) -> int:
+        """
+        音源フォルダの WAV を1ファイルの音源パックにまとめる。
+        out_path を省略するとフォルダ内の voicebank.vsepack に書き出すので、
+        次からはそのフォルダを読み込むだけでパックが使われる。
+        戻り値はまとめた音素数（失敗時は -1）。
+        """
+        audio_dir = os.path.abspath(audio_dir)
+        if out_path is None:
+            out_path = os.path.join(audio_dir, "voicebank.vsepack")
+        return self.lib.vse_compile_voicebank(audio_dir.encode('utf-8'), os.path.abspath(out_path).encode('utf-8'))
+
+    def set_voicebank_budget(self, budget_bytes: int):
+        """常駐させる音源のメモリ上限（バイト）。超えると最後に使ったのが古いキャラクターから外す"""
+        self.lib.vse_set_voicebank_budget(budget_bytes)
+
+    def get_voicebank_pool_stats(self) -> dict:
+        stats = VsePoolStats()
+        self.lib.vse_get_voicebank_pool_stats(ctypes.byref(stats))
+        return {name: getattr(stats, name) for name, _ in VsePoolStats._fields_}
+
+    def unload_character(self, char_id: str) -> int:
+        """キャラクターの音源をエンジンから外す（音源ファイルを差し替えたときなど）"""
+        return self.lib.vse_unload_character(char_id.encode('utf-8'))
+
+    def get_loaded_phoneme_count(self) -> tuple[int, int]:
+        """(デコード済みの音素数, 登録されている音素数) を返す"""
+        total = ctypes.c_int(0)
+        loaded = self.lib.vse_get_loaded_phoneme_count(ctypes.byref(total))
+        return loaded, total.value
+
+    def add_phoneme_alias(self, alias: str, target: str) -> bool:
+        """音素の別名を登録する（例: "ア" -> "a"）"""
+        return self.lib.vse_add_phoneme_alias(alias.encode('utf-8'), target.encode('utf-8')) == 0
+
+    def add_phoneme_fallback(self, name: str, fallback: str) -> bool:
+        """音源にない音素の代わりに鳴らす音素を登録する"""
+        return self.lib.vse_add_phoneme_fallback(name.encode('utf-8'), fallback.encode('utf-8')) == 0
+
+    def get_lookup_stats(self) -> dict:
+        """
+        音素検索の統計を返す。
+        missing には歌詞が参照しているのにキャラクターが持っていない音素名と、その回数が入る。
+        """
+        stats = VseLookupStats()
+        self.lib.vse_get_lookup_stats(ctypes.byref(stats))
+
+        missing = {}
+        name_buf = ctypes.create_string_buffer(64)
+        for i in range(self.lib.vse_get_missing_phoneme_count()):
+            count = self.lib.vse_get_missing_phoneme(i, name_buf, len(name_buf))
+            missing[name_buf.value.decode('utf-8', errors='replace')] = count
+
+        return {
+            "lookups": stats.lookups,
+            "hits": stats.hits,
+            "alias_hits": stats.alias_hits,
+            "fallback_hits": stats.fallback_hits,
+            "misses": stats.misses,
+            "missing": missing
+        }
+
+    def reset_lookup_stats(self):
+        self.lib.vse_reset_lookup_stats()
+
+    def set_render_threads(self, count: int):
+        """
+        合成に使うスレッド数を設定する（0 = CPUコア数、1 = シングルスレッド）。
+        スレッド数を変えても合成結果はビット単位で同じ。
+        """
+        self.lib.vse_set_thread_count(count)
+
+    def get_render_threads(self) -> int:
+        return self.lib.vse_get_thread_count()
+
+    def set_resample_quality(self, quality: int):
+        """
+        quality を省略した合成で使うリサンプル品質（RESAMPLE_LINEAR / RESAMPLE_SINC_FAST / RESAMPLE_SINC_BEST）。
+        書き出しなどでは synthesize(..., quality=RESAMPLE_SINC_BEST) のように呼び出しごとに指定できる。
+        """
+        self.resample_quality = quality
+
+    def set_resample_cache_limit(self, limit_bytes: int):
+        """リサンプル済み音素のキャッシュ上限（バイト）を設定する"""
+        self.lib.vse_set_resample_cache_limit(limit_bytes)
+
+    def get_resample_cache_stats(self) -> dict:
+        stats = VseCacheStats()
+        self.lib.vse_get_resample_cache_stats(ctypes.byref(stats))
+        return {name: getattr(stats, name) for name, _ in VseCacheStats._fields_}
+
+    def clear_resample_cache(self):
+        self.lib.vse_clear_resample_cache()
+
+    def get_scratch_stats(self) -> dict:
+        """
+        合成中のヒープ確保の統計を返す（合成1回 = ストリーミングの1ブロック、または区間・全体の合成1回）。
+        同じ曲を再生し続けているときは last_render_allocs が 0 になっているはず。
+        """
+        stats = VseScratchStats()
+        self.lib.vse_get_scratch_stats(ctypes.byref(stats))
+        return {name: getattr(stats, name) for name, _ in VseScratchStats._fields_}
+
+    def reset_scratch_stats(self):
+        self.lib.vse_reset_scratch_stats()
+
+    def get_perf_stats(self) -> dict:
+        """
+        段階ごとの回数と時間（ミリ秒）、音源の読み込みを返す。合成のたびに出力して、どこに時間がかかっているかを見る用。
+        "render" は合成の呼び出し全体の時間、それ以外は全スレッドの合計（並列合成では "render" より長くなる）。
+        "marshal" はPython側でノートをCの構造体にした時間。
+        """
+        stats = VsePerfStats()
+        self.lib.vse_get_perf_stats(ctypes.byref(stats))
+        stages = {
+            name: {"calls": st.calls, "ms": st.ns / 1e6} for name, st in zip(PERF_STAGES, stats.stages)
+        }
+        with self._perf_lock:
+            stages["marshal"] = {"calls": self._marshal_calls, "ms": self._marshal_ns / 1e6}
+        render_sec = stats.stages[0].ns / 1e9
+        audio_sec = stats.rendered_frames / self.sample_rate
+        return {
+            "stages": stages,
+            "rendered_frames": stats.rendered_frames,
+            "rtf": render_sec / audio_sec if audio_sec > 0 else 0.0,  # 合成時間 / 合成した音声の長さ
+            "voicebank_loads": stats.voicebank_loads,
+            "voicebank_load_ms": stats.voicebank_load_ns / 1e6,
+            "voicebank_bytes": stats.voicebank_bytes
+        }
+
+    def reset_perf_stats(self):
+        self.lib.vse_reset_perf_stats()
+        with self._perf_lock:
+            self._marshal_calls = 0
+            self._marshal_ns = 0
 
     def _convert_to_c_structs(self, py_notes, py_pitches):
         """PythonのリストをCの構造体配列に変換"""
-        self._keep_alive = [] # 以前のデータをクリア
-        
-        # 1. ノートの変換
-        c_notes = (CNoteEvent * len(py_notes))()
-        for i, n in enumerate(py_notes):
-            c_notes[i].note_number = n.note_number
-            c_notes[i].start_time = n.start_time
-            c_notes[i].duration = n.duration
-            c_notes[i].velocity = n.velocity
-            c_notes[i].lyrics = n.lyric.encode('utf-8')
-            
-            # 音素リスト(char**)の構築
-            if n.phonemes:
-                ph_bytes = [p.encode('utf-8') for p in n.phonemes]
-                ph_array = (ctypes.c_char_p * len(ph_bytes))(*ph_bytes)
-                self._keep_alive.append(ph_array) # C側実行中に消えないよう保持
-                c_notes[i].phonemes = ph_array
-                c_notes[i].phoneme_count = len(ph_bytes)
-
-        # 2. ピッチイベントの変換
-        c_pitches = (CPitchEvent * len(py_pitches))(*[
-            CPitchEvent(p.time, p.value) for p in py_pitches
-        ])
-        
+        c_notes, c_pitches, self._keep_alive = self._marshal_notes(py_notes, py_pitches)
         return c_notes, c_pitches
 
-    def synthesize(self, notes: list[NoteEvent], pitch_events: list[PitchEvent]) -> np.ndarray:
-        """Cエンジンを呼び出して音声を合成し、NumPy配列を返す"""
-        if not notes: return np.zeros(0, dtype=np.float32)
+    def _marshal_notes(self, py_notes, py_pitches):
+        """
+        _convert_to_c_structs の本体。音素表も一緒に返すので、
+        バックグラウンド合成のスレッドから呼んでも他の合成の保持リストと混ざらない。
 
-        c_notes, c_pitches = self._convert_to_c_structs(notes, pitch_events)
-        
+        ノートは NOTE_DTYPE の構造化配列1つに列ごとにまとめて書き込み、音素は全ノート分を1本の char* の表にする
+        （各ノートの phonemes は表の中の自分の先頭を指す）。ノートごとに ctypes のオブジェクトを作らない。
+        lyrics はC側で使っていないので空のまま渡す。
+        """
+        t0 = time.perf_counter_ns()
+        count = len(py_notes)
+
+        # 1. ノートの変換
+        notes = np.zeros(count, dtype=NOTE_DTYPE)
+        notes["note_number"] = [n.note_number for n in py_notes]
+        notes["start_time"] = [n.start_time for n in py_notes]
+        notes["duration"] = [n.duration for n in py_notes]
+        notes["velocity"] = [n.velocity for n in py_notes]
+
+        # 音素表（char* を全ノート分つなげたもの）と、各ノートの先頭位置
+        phonemes = [n.phonemes for n in py_notes]
+        counts = np.fromiter(map(len, phonemes), dtype=np.int32, count=count)
+        names = list(itertools.chain.from_iterable(phonemes))
+        for name in set(names).difference(self._phoneme_addresses):
+            self._intern_phoneme(name)
+        table = np.array(list(map(self._phoneme_addresses.__getitem__, names)), dtype=np.uintp)
+        starts = np.cumsum(counts, dtype=np.intp) - counts
+        ptr_size = ctypes.sizeof(ctypes.c_char_p)
+        notes["phonemes"] = np.where(counts > 0, table.ctypes.data + starts * ptr_size, 0)
+        notes["phoneme_count"] = counts
+        c_notes = (CNoteEvent * count).from_buffer(notes)  # notes と同じメモリ（notes は c_notes が保持する）
+
+        # 2. ピッチイベントの変換（エンジンは時刻順に1回なめてピッチカーブを作るので、並べてから渡す）
+        times = np.array([p.time for p in py_pitches], dtype=np.float64)
+        order = np.argsort(times, kind="stable")
+        pitches = np.empty(len(py_pitches), dtype=PITCH_DTYPE)
+        pitches["time"] = times[order]
+        pitches["value"] = np.array([p.value for p in py_pitches], dtype=np.int32)[order]
+        c_pitches = (CPitchEvent * len(pitches)).from_buffer(pitches)
+
+        elapsed = time.perf_counter_ns() - t0
+        with self._perf_lock:
+            self._marshal_calls += 1
+            self._marshal_ns += elapsed
+        return c_notes, c_pitches, [table] # 音素表はC側の実行中に消えないよう保持
+
+    def _intern_phoneme(self, name: str):
+        """音素名をC文字列にして、そのアドレスを覚えておく（別スレッドと同時に呼ばれても先に登録したほうを使う）"""
+        buf = ctypes.create_string_buffer(name.encode('utf-8'))
+        address = ctypes.addressof(buf)
+        if self._phoneme_addresses.setdefault(name, address) == address:
+            self._phoneme_buffers.append(buf)
+
+    def _make_request(self, notes, pitch_events, quality: int = None):
+        """
+        ノートとピッチイベントから SynthesisRequest を作る（quality を省略したら resample_quality）。
+        戻り値: (req, keep_alive)。keep_alive はCが req を使い終わるまで保持すること（ノート配列と音素表の実体）
+        """
+        c_notes, c_pitches, ph_arrays = self._marshal_notes(notes, pitch_events)
         req = SynthesisRequest(
             notes=c_notes,
             note_count=len(notes),
             pitch_events=c_pitches,
             pitch_event_count=len(pitch_events),
-            sample_rate=self.sample_rate
+            sample_rate=self.sample_rate,
+            resample_quality=self.resample_quality if quality is None else quality
         )
+        return req, (c_notes, c_pitches, ph_arrays)
+
+    def synthesize(self, notes: list[NoteEvent], pitch_events: list[PitchEvent], quality: int = None) -> np.ndarray:
+        """Cエンジンを呼び出して音声を合成し、NumPy配列を返す"""
+        if not notes: return np.zeros(0, dtype=np.float32)
+
+        req, keep_alive = self._make_request(notes, pitch_events, quality)
 
         out_count = ctypes.c_int(0)
         # C関数の呼び出し
@@ -326,9 +747,201 @@ class VO_SE_Engine:
         
         return np.zeros(0, dtype=np.float32)
 
+    def synthesize_window(self, notes: list[NoteEvent], pitch_events: list[PitchEvent], start_time: float,
+                          end_time: float, quality: int = None) -> np.ndarray:
+        """
+        [start_time, end_time) だけを合成して返す（長さはその範囲の分）。
+        範囲にかかるノートだけを合成するので、曲のどこを指定しても範囲の長さの分しかかからない。
+        マスターバッファは使わず、更新もしない。
+        """
+        if not notes or end_time <= start_time: return np.zeros(0, dtype=np.float32)
+
+        req, keep_alive = self._make_request(notes, pitch_events, quality)
+
+        out_count = ctypes.c_int(0)
+        audio_ptr = self.lib.vse_render_window(ctypes.byref(req), start_time, end_time, ctypes.byref(out_count))
+        if not audio_ptr: return np.zeros(0, dtype=np.float32)
+
+        audio_data = np.zeros(0, dtype=np.float32)
+        if out_count.value > 0:
+            audio_data = np.ctypeslib.as_array(audio_ptr, shape=(out_count.value,)).copy()
+        self.lib.vse_free_buffer(audio_ptr)
+        return audio_data
+
+    def synthesize_into(self, notes: list[NoteEvent], pitch_events: list[PitchEvent], out: np.ndarray = None,
+                        quality: int = None) -> np.ndarray:
+        """
+        合成結果を out に直接書き込み、書き込んだ部分のビューを返す（コピーなし）。
+        out を省略すると buffer_pool から借りる（使い終わったら buffer_pool.release で返す）。
+        out が曲より短い場合は out の長さまで合成する。
+        """
+        if not notes: return np.zeros(0, dtype=np.float32)
+
+        req, keep_alive = self._make_request(notes, pitch_events, quality)
+
+        if out is None:
+            out = self.buffer_pool.acquire(self.lib.vse_render_length(ctypes.byref(req)))
+        if out.dtype != np.float32 or out.ndim != 1 or not out.flags.c_contiguous or not out.flags.writeable:
+            raise ValueError("out には書き込み可能な1次元・連続の float32 配列を渡してください。")
+
+        written = self.lib.vse_render_into(
+            ctypes.byref(req), out.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), out.size
+        )
+        return out[:written]
+
+    def synthesize_stream(self, notes: list[NoteEvent], pitch_events: list[PitchEvent], block_size: int = 4096,
+                          quality: int = None):
+        """
+        曲全体を確保せず、block_size サンプルずつ合成した NumPy 配列を順に返すジェネレータ。
+        最初のブロックはすぐに返るので、長い曲でも再生を待たずに始められる。
+        """
+        if not notes: return
+
+        req, keep_alive = self._make_request(notes, pitch_events, quality)
+
+        session = self.lib.vse_render_open(ctypes.byref(req))
+        if not session: return
+
+        try:
+            while True:
+                block = np.empty(block_size, dtype=np.float32)
+                written = self.lib.vse_render_pull(
+                    session, block.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), block_size
+                )
+                if written <= 0: break
+                yield block[:written]
+        finally:
+            self.lib.vse_render_close(session)
+
+    def export_wav(self, notes: list[NoteEvent], pitch_events: list[PitchEvent], output_path: str,
+                   sample_format: int = WAV_PCM16, dither: bool = True, quality: int = RESAMPLE_SINC_BEST) -> int:
+        """
+        曲全体をWAVファイルに書き出す。合成・変換・書き込みはCエンジンがブロック単位で行うので、
+        長い曲でもメモリは一定で、Python側に音声データは戻らない。
+        sample_format: WAV_PCM16 / WAV_PCM24 / WAV_FLOAT32。dither は整数形式のときだけ効く。
+        戻り値: 書き出したサンプル数（失敗時は -1）
+        """
+        if not notes: return -1
+
+        req, keep_alive = self._make_request(notes, pitch_events, quality)
+        return self.lib.vse_render_to_wav(
+            ctypes.byref(req), os.path.abspath(output_path).encode('utf-8'), sample_format, 1 if dither else 0
+        )
+
+    # --- 差分レンダリング ---
+    def mark_all_dirty(self):
+        """次の synthesize_track で全体を合成し直す"""
+        with self._dirty_lock:
+            self._needs_full_render = True
+            self._dirty_ranges = []
+            self._bump_generation()
+
+    def _bump_generation(self):
+        """世代を進め、実行中の古い世代の合成を中止させる（_dirty_lock を持った状態で呼ぶ）"""
+        self.render_generation += 1
+        self.lib.vse_master_supersede(self.render_generation)
+
+    def take_dirty_ranges(self) -> tuple[list[tuple[float, float]], bool]:
+        """記録済みの変更範囲と「全体を合成し直すか」を取り出してクリアする"""
+        with self._dirty_lock:
+            ranges, full = self._dirty_ranges, self._needs_full_render
+            self._dirty_ranges = []
+            self._needs_full_render = False
+            return ranges, full
+
+    def mark_notes_dirty(self, notes: list[NoteEvent]):
+        """
+        前回の状態と比べて、追加・削除・変更されたノートの時間範囲（変更前と変更後の両方）を記録する。
+        TimelineWidget.notes_changed_signal から呼ばれる。
+        """
+        new_snapshot = {}
+        for n in notes:
+            key = (n.note_number, n.start_time, n.duration, n.velocity, tuple(n.phonemes))
+            new_snapshot[id(n)] = (n.start_time, n.start_time + n.duration, key)
+
+        with self._dirty_lock:
+            changed = []
+            for note_id, old in self._note_snapshot.items():
+                new = new_snapshot.get(note_id)
+                if new is None or new[2] != old[2]:
+                    changed.append((old[0], old[1]))
+            for note_id, new in new_snapshot.items():
+                old = self._note_snapshot.get(note_id)
+                if old is None or old[2] != new[2]:
+                    changed.append((new[0], new[1]))
+
+            self._note_snapshot = new_snapshot
+            if changed:
+                self._dirty_ranges.extend(changed)
+                self._bump_generation()
+
+    def mark_pitch_dirty(self, pitch_events: list[PitchEvent]):
+        """
+        変更されたピッチイベントの前後のイベントまでを変更範囲として記録する。
+        （範囲にかかるノートはエンジン側で丸ごと合成し直される）
+        GraphEditorWidget.pitch_data_changed から呼ばれる。
+        """
+        new_snapshot = sorted((p.time, p.value) for p in pitch_events)
+        with self._dirty_lock:
+            changed = set(self._pitch_snapshot).symmetric_difference(new_snapshot)
+            if changed:
+                for events in (self._pitch_snapshot, new_snapshot):
+                    times = [t for t, _ in events]
+                    for t, _ in changed:
+                        i = bisect.bisect_left(times, t)
+                        start = times[i - 1] if i > 0 else 0.0
+                        j = i + 1 if i < len(times) and times[i] == t else i
+                        # 最後のイベントより後ろはその値が続くので、曲の終わりまでが影響を受ける
+                        end = times[j] if j < len(times) else math.inf
+                        self._dirty_ranges.append((min(start, t), end))
+                self._bump_generation()
+            self._pitch_snapshot = new_snapshot
+
+    def synthesize_track(self, notes: list[NoteEvent], pitch_events: list[PitchEvent], start_time: float, end_time: float,
+                         quality: int = None) -> np.ndarray:
+        """
+        [start_time, end_time) の音声を返す。
+        エンジン側のマスターバッファのうち、この範囲でまだ合成していない部分と前回から変更された部分だけを合成し直す
+        （曲の後ろのほうを再生しても、合成するのはその範囲の分だけ）。
+        """
+        if not notes: return np.zeros(0, dtype=np.float32)
+
+        # シグナルを経由しない変更もここで拾う
+        self.mark_notes_dirty(notes)
+        self.mark_pitch_dirty(pitch_events)
+
+        req, keep_alive = self._make_request(notes, pitch_events, quality)
+
+        generation = self.render_generation
+        dirty, full = self.take_dirty_ranges()
+        ranges = (ctypes.c_float * (2 * len(dirty)))(*[t for r in dirty for t in r])
+        total = self.lib.vse_master_render_window(
+            ctypes.byref(req), ranges, len(dirty), 1 if full else 0, start_time, end_time
+        )
+        if total == RENDER_CANCELLED:
+            # 合成中に新しい編集が入った。変更範囲はエンジン側で無効化済みなので、次の呼び出しで合成し直される
+            return np.zeros(0, dtype=np.float32)
+        if total < 0:
+            # 失敗したときは次回全体を合成し直す
+            self.mark_all_dirty()
+            return np.zeros(0, dtype=np.float32)
+
+        # バックグラウンド合成がマスターバッファを伸ばしている最中でも安全なように、コピーはエンジン側で行う
+        start = max(0, int(start_time * self.sample_rate))
+        end = min(total, int(end_time * self.sample_rate))
+        if end <= start: return np.zeros(0, dtype=np.float32)
+        out = np.empty(end - start, dtype=np.float32)
+        copied = self.lib.vse_master_read(
+            generation, req.resample_quality, start, out.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), end - start
+        )
+        return out if copied else np.zeros(0, dtype=np.float32)
+
     def play_audio(self, audio_data: np.ndarray):
         """合成した音声を再生する"""
         if audio_data.size == 0: return
+        import pyaudio
+        if self.pyaudio_instance is None:
+            self.pyaudio_instance = pyaudio.PyAudio()
         stream = self.pyaudio_instance.open(
             format=pyaudio.paFloat32, channels=1, rate=self.sample_rate, output=True
         )
@@ -338,5 +951,10 @@ class VO_SE_Engine:
 
     def close(self):
         """終了処理"""
-        self.pyaudio_instance.terminate()
+        if self._load_task and not self._load_task.done:
+            self._load_task.cancel()
+            self._load_task.wait()
+        if self.pyaudio_instance is not None:
+            self.pyaudio_instance.terminate()
+            self.pyaudio_instance = None
 
@@ -0,0 +1,85 @@
+// mix_bench.c
+// 音素を出力に重ねる処理の速度比較（make bench で実行）
+// 従来の複数パス（リサンプル -> 音量のループ -> apply_crossfade_range / memcpy）と、
+// 1パスのミックスカーネル（mix_linear_rate / mix_span）で、1秒あたりに重ねられるサンプル数を測る。
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "audio_types.h"
+#include "synthesizer_core.h"
+
+#define SAMPLE_RATE 44100
+#define FADE_LEN (SAMPLE_RATE * 5 / 1000)
+#define OUT_LEN (SAMPLE_RATE * 10)
+
+static double now_sec(void) {
+    struct timespec ts;
+    timespec_get(&ts, TIME_UTC);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+// 従来の処理: リサンプル（またはキャッシュからのコピー）、音量、クロスフェードを別々のループで行う
+static void mix_multipass(float* out, const float* input, int input_len, float rate, float amp,
+                          int ph_len, int crossfade, float* tmp, int cached) {
+    if (cached) {
+        for (int j = 0; j < ph_len; j++) tmp[j] = input[j] * amp;
+    } else {
+        resample_linear_rate_range(input, input_len, tmp, ph_len, rate, 0, ph_len);
+        for (int j = 0; j < ph_len; j++) tmp[j] *= amp;
+    }
+    if (crossfade) apply_crossfade_range(out, tmp, ph_len, FADE_LEN, 0, ph_len);
+    else memcpy(out, tmp, sizeof(float) * ph_len);
+}
+
+// 1パスのミックスカーネル
+static void mix_fused(float* out, const float* input, int input_len, float rate, float amp,
+                      int ph_len, int crossfade, const FadeTable* fade, int cached) {
+    if (cached) mix_span(out, input, amp, ph_len, 0, ph_len, fade, crossfade);
+    else mix_linear_rate(out, input, input_len, rate, amp, ph_len, 0, ph_len, fade, crossfade);
+}
+
+int main(void) {
+    static const double lengths[] = {0.05, 0.2, 0.5};  // 音素の長さ（秒）
+    int in_len = SAMPLE_RATE / 2;
+
+    float* input = (float*)malloc(sizeof(float) * OUT_LEN);
+    float* out = (float*)calloc(OUT_LEN, sizeof(float));
+    float* tmp = (float*)malloc(sizeof(float) * OUT_LEN);
+    FadeTable fade;
+    if (!input || !out || !tmp || fade_table_init(&fade, FADE_LEN) != 0) return 1;
+    for (int i = 0; i < OUT_LEN; i++) input[i] = (float)sin(2.0 * 3.14159265358979323846 * 220.0 * i / SAMPLE_RATE);
+
+    printf("%-8s %8s %14s %14s %9s\n", "source", "length", "multi Ms/s", "fused Ms/s", "speedup");
+    for (int cached = 0; cached <= 1; cached++) {
+        for (int l = 0; l < (int)(sizeof(lengths) / sizeof(lengths[0])); l++) {
+            int ph_len = (int)(SAMPLE_RATE * lengths[l]);
+            int count = OUT_LEN / ph_len;
+            double rate_ms[2];
+            for (int fused = 0; fused <= 1; fused++) {
+                double best = 1e30;
+                for (int r = 0; r < 5; r++) {
+                    double t0 = now_sec();
+                    for (int p = 0; p < count; p++) {
+                        const float* src = cached ? input + p % 7 : input;
+                        if (fused) mix_fused(out + p * ph_len, src, in_len, 1.0f, 0.8f, ph_len, p > 0, &fade, cached);
+                        else mix_multipass(out + p * ph_len, src, in_len, 1.0f, 0.8f, ph_len, p > 0, tmp, cached);
+                    }
+                    double dt = now_sec() - t0;
+                    if (dt < best) best = dt;
+                }
+                rate_ms[fused] = (double)count * ph_len / best / 1e6;
+            }
+            printf("%-8s %7.2fs %14.1f %14.1f %8.2fx\n", cached ? "cached" : "linear", lengths[l],
+                   rate_ms[0], rate_ms[1], rate_ms[1] / rate_ms[0]);
+        }
+    }
+
+    fade_table_free(&fade);
+    free(input);
+    free(out);
+    free(tmp);
+    return 0;
+}
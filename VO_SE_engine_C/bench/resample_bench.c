@@ -0,0 +1,68 @@
+// resample_bench.c
+// リサンプラの速度と折り返しの比較（make bench で実行）
+// 各品質で 1 秒分の波形を何通りかの長さにリサンプルし、1秒あたりの出力サンプル数を測る。
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#include "audio_types.h"
+#include "api_interface.h"
+
+#define SAMPLE_RATE 44100
+#define REPEAT 20
+
+static double now_sec(void) {
+    struct timespec ts;
+    timespec_get(&ts, TIME_UTC);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+// 出力の二乗平均平方根
+static double rms(const float* x, int n) {
+    double sum = 0.0;
+    for (int i = 0; i < n; i++) sum += (double)x[i] * x[i];
+    return sqrt(sum / n);
+}
+
+int main(void) {
+    static const char* names[] = {"linear", "sinc_fast", "sinc_best"};
+    static const double scales[] = {0.5, 0.97, 1.0, 1.5, 2.0};  // 出力の長さ / 入力の長さ
+    int in_len = SAMPLE_RATE;
+
+    float* input = (float*)malloc(sizeof(float) * in_len);
+    float* output = (float*)malloc(sizeof(float) * in_len * 2);
+    if (!input || !output) return 1;
+
+    // 速度: 倍音の多い波形（ノコギリ波）
+    for (int i = 0; i < in_len; i++) input[i] = (float)(2.0 * fmod(i * 220.0 / SAMPLE_RATE, 1.0) - 1.0);
+
+    printf("%-10s %8s %14s %10s\n", "quality", "scale", "Msamples/s", "vs linear");
+    for (int s = 0; s < (int)(sizeof(scales) / sizeof(scales[0])); s++) {
+        int out_len = (int)(in_len * scales[s]);
+        double linear_rate = 0.0;
+        for (int q = VSE_RESAMPLE_LINEAR; q <= VSE_RESAMPLE_SINC_BEST; q++) {
+            vse_resample(input, in_len, output, out_len, q);  // フィルタ表の作成を計測から外す
+            double t0 = now_sec();
+            for (int r = 0; r < REPEAT; r++) vse_resample(input, in_len, output, out_len, q);
+            double rate = (double)out_len * REPEAT / (now_sec() - t0) / 1e6;
+            if (q == VSE_RESAMPLE_LINEAR) linear_rate = rate;
+            printf("%-10s %8.2f %14.1f %9.2fx\n", names[q], scales[s], rate, rate / linear_rate);
+        }
+    }
+
+    // 折り返し: 15kHz の正弦波を半分の長さ（ナイキスト 11.025kHz 相当）に縮めたときに残る成分
+    for (int i = 0; i < in_len; i++) input[i] = (float)sin(2.0 * 3.14159265358979323846 * 15000.0 * i / SAMPLE_RATE);
+    printf("\n15kHz sine shrunk to 1/2 (ideal output: silence)\n");
+    for (int q = VSE_RESAMPLE_LINEAR; q <= VSE_RESAMPLE_SINC_BEST; q++) {
+        int out_len = in_len / 2;
+        vse_resample(input, in_len, output, out_len, q);
+        // 端の影響を避けて中央部分で測る
+        double level = rms(output + out_len / 4, out_len / 2);
+        printf("%-10s alias rms %.4f (%.1f dB)\n", names[q], level, 20.0 * log10(level / sqrt(0.5) + 1e-12));
+    }
+
+    free(input);
+    free(output);
+    return 0;
+}
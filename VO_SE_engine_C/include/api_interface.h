@@ -13,30 +13,330 @@
 // --- Pythonから呼び出す関数（公開API） ---
 
 /**
- * エンジンの初期化
- * サンプリングレートなどを設定し、メモリを確保する
+ * エンジンの初期化（キャラクターの音源読み込み）
+ * audio_dir 内の .wav を読み込み、音素名のインデックスを作る
+ * audio_dir に alias.txt / fallback.txt（"名前=音素" の行）があれば別名・代用音素として登録する
+ * audio_dir に .vsepack ファイルを渡すか、フォルダに voicebank.vsepack があれば
+ * WAV をスキャンせずにパックを1回マップするだけで読み込む
+ * 読み込んだキャラクターはメモリ上限の範囲で常駐させ、既に常駐していれば読み込まずに切り替える
  */
-API_EXPORT int init_engine(int sample_rate);
+API_EXPORT int init_engine(const char* char_id, const char* audio_dir);
 
 /**
- * ターゲット周波数の設定
- * タイムラインのY軸から計算されたHzをここに渡す
+ * audio_dir の WAV をすべてデコードし、1ファイルの音源パック（.vsepack）にまとめる
+ * パックには音素名の索引と float32 モノラルの波形が並んでいる
+ * 戻り値: まとめた音素数。失敗時は -1
  */
-API_EXPORT void set_frequency(float hz);
+API_EXPORT int vse_compile_voicebank(const char* audio_dir, const char* out_path);
+
+// 読み込みの段階
+#define VSE_LOAD_STAGE_READ    0  // 音源ファイルの読み込み
+#define VSE_LOAD_STAGE_WARM_UP 1  // ウォームアップ
+#define VSE_LOAD_CANCELLED    -2  // vse_cancel_load で中止された
+
+/**
+ * 読み込みの進捗を受け取るコールバック（読み込んでいるスレッドから呼ばれる）
+ * stage: VSE_LOAD_STAGE_READ / VSE_LOAD_STAGE_WARM_UP
+ * files_done / files_total: 処理した音素ファイル数 / 全体
+ * bytes_done / bytes_total: 処理したバイト数 / 全体
+ */
+typedef void (*VseLoadProgressCallback)(int stage, int files_done, int files_total,
+                                        long long bytes_done, long long bytes_total, void* user_data);
+
+/**
+ * init_engine の進捗・キャンセル・ウォームアップ付き版
+ * 呼び出したスレッドで読み込むので、GUIからは別スレッドで呼ぶ。読み込みが終わるまで合成は前のキャラクターのまま
+ * warm_up: 0 以外なら、波形のページを読み込ませ合成スレッドを起こしておく（切り替え直後の合成を速くする）
+ * 戻り値: 成功 0 / 失敗 -1 / 中止 VSE_LOAD_CANCELLED
+ */
+API_EXPORT int vse_load_character(const char* char_id, const char* audio_dir,
+                                  VseLoadProgressCallback callback, void* user_data, int warm_up);
+
+/**
+ * 実行中の vse_load_character をすべて中止させる（どのスレッドから呼んでもよい）
+ */
+API_EXPORT void vse_cancel_load(void);
+
+/**
+ * 常駐しているキャラクターを合成に使うキャラクターにする（ディスクからは読まない）
+ * audio_dir が NULL の場合は char_id だけで探す。常駐していなければ -1
+ */
+API_EXPORT int vse_activate_character(const char* char_id, const char* audio_dir);
+
+/**
+ * キャラクターの音源をメモリから外す（合成中のものは外さない）
+ * 戻り値: 外した数
+ */
+API_EXPORT int vse_unload_character(const char* char_id);
+
+/**
+ * 常駐させる音源のメモリ上限（バイト）。超えた分は最後に使ったのが古いものから外す
+ * アクティブなキャラクターは外さない
+ */
+API_EXPORT void vse_set_voicebank_budget(size_t bytes);
+
+/**
+ * 常駐音源プールの統計を取得する
+ */
+API_EXPORT void vse_get_voicebank_pool_stats(VsePoolStats* out);
+
+/**
+ * 次の init_engine からの読み込みモード
+ * 0: 起動時にすべてのWAVをデコードする
+ * 1: WAVをメモリマップするだけにして、各音素は初めて使うときにデコードする
+ *    （32bit float モノラルのWAVはデコードせずマップした領域をそのまま使う）
+ */
+API_EXPORT void vse_set_load_mode(int mode);
+
+/**
+ * デコード済みの音素数を返す。total には登録されている音素数が入る
+ */
+API_EXPORT int vse_get_loaded_phoneme_count(int* total);
+
+/**
+ * 音素の別名を登録する（target は読み込み済みの音素名）
+ */
+API_EXPORT int vse_add_phoneme_alias(const char* alias, const char* target);
+
+/**
+ * 音源にない音素の代わりに使う音素を登録する
+ */
+API_EXPORT int vse_add_phoneme_fallback(const char* name, const char* fallback);
+
+/**
+ * 音素検索の統計を取得する
+ */
+API_EXPORT void vse_get_lookup_stats(VseLookupStats* out);
 
 /**
- * 音素の読み込みと再生準備
- * lyric: "a", "i" などの音素名
+ * 音源になかった音素名の種類数
  */
-API_EXPORT void prepare_phoneme(const char* lyric);
+API_EXPORT int vse_get_missing_phoneme_count(void);
+
+/**
+ * index 番目の見つからなかった音素名を name_buf に書き込み、その回数を返す
+ */
+API_EXPORT long long vse_get_missing_phoneme(int index, char* name_buf, int buf_len);
+
+/**
+ * 音素検索の統計をリセットする
+ */
+API_EXPORT void vse_reset_lookup_stats(void);
 
 /**
  * レンダリング（書き出し）の実行
  * output_path: 保存先のファイルパス
  * notes: ノートデータの配列
  * count: ノートの数
+ * 16bit PCM（ディザあり）、VSE_RESAMPLE_SINC_BEST で書き出す
+ */
+API_EXPORT void execute_render_to_file(const char* output_path, CNoteEvent* notes, int count);
+
+/**
+ * リクエスト全体を合成しながらWAVファイルに書き出す
+ * 曲全体のバッファは確保せず、一定サイズのブロックごとに合成・変換・書き込みを行う
+ * sample_format: VSE_WAV_PCM16 / VSE_WAV_PCM24 / VSE_WAV_FLOAT32
+ * dither: 0 以外なら整数形式への変換で TPDF ディザをかける（毎回同じ乱数列）
+ * 戻り値: 書き出したサンプル数。失敗時は -1
+ */
+API_EXPORT int vse_render_to_wav(const SynthesisRequest* request, const char* output_path, int sample_format, int dither);
+
+/**
+ * リサンプル結果キャッシュの上限（バイト）を設定する。超えた分は古いものから捨てる
+ */
+API_EXPORT void vse_set_resample_cache_limit(size_t bytes);
+
+/**
+ * リサンプル結果キャッシュの統計を取得する
+ */
+API_EXPORT void vse_get_resample_cache_stats(VseCacheStats* out);
+
+/**
+ * リサンプル結果キャッシュを空にし、統計をリセットする
+ */
+API_EXPORT void vse_clear_resample_cache(void);
+
+/**
+ * 合成に使うスレッド数を設定する（0 = CPUコア数、1 = シングルスレッド）
+ * スレッド数を変えても合成結果はビット単位で同じ
+ */
+API_EXPORT void vse_set_thread_count(int count);
+
+/**
+ * 実際に使われるスレッド数
+ */
+API_EXPORT int vse_get_thread_count(void);
+
+/**
+ * 1つの波形を input_len から output_len サンプルにリサンプルする
+ * quality: VSE_RESAMPLE_LINEAR / VSE_RESAMPLE_SINC_FAST / VSE_RESAMPLE_SINC_BEST
+ * 合成では SynthesisRequest.resample_quality で品質を選ぶ
+ */
+API_EXPORT void vse_resample(const float* input, int input_len, float* output, int output_len, int quality);
+
+/**
+ * リクエスト全体を合成し、新しく確保したバッファを返す
+ * 使い終わったバッファは vse_free_buffer で解放する
+ */
+API_EXPORT float* request_synthesis_full(SynthesisRequest request, int* out_sample_count);
+
+/**
+ * タイムラインの [start, end) 秒だけを合成し、その長さのバッファを返す
+ * 区間にかかるノートだけを合成するので、曲のどこを合成しても区間の長さの分しかかからない
+ * 結果は曲全体を合成したときの同じ区間と一致する。使い終わったバッファは vse_free_buffer で解放する
+ */
+API_EXPORT float* vse_render_window(const SynthesisRequest* request, float start, float end, int* out_sample_count);
+
+/**
+ * request_synthesis_full / vse_render_window が返したバッファを解放する
+ */
+API_EXPORT void vse_free_buffer(float* buffer);
+
+/**
+ * リクエスト全体を合成したときの長さ（サンプル数）
+ */
+API_EXPORT int vse_render_length(const SynthesisRequest* request);
+
+/**
+ * 呼び出し側が用意したバッファ out に直接合成する（コピーなし）
+ * 戻り値: 書き込んだサンプル数
+ */
+API_EXPORT int vse_render_into(const SynthesisRequest* request, float* out, int out_len);
+
+/**
+ * ストリーミング合成セッション
+ * 曲全体を一度に確保せず、ブロック単位で合成結果を取り出す
+ */
+typedef struct VseRenderSession VseRenderSession;
+
+/**
+ * セッションの開始
+ * request: 合成リクエスト（notes / pitch_events はセッション終了まで保持すること）
+ * 戻り値: セッション。ノートがない場合やメモリ不足の場合は NULL
+ */
+API_EXPORT VseRenderSession* vse_render_open(const SynthesisRequest* request);
+
+/**
+ * 次のブロックを合成する
+ * out: 書き込み先（max_frames サンプル分）
+ * 戻り値: 書き込んだサンプル数。曲の最後まで到達したら 0
+ */
+API_EXPORT int vse_render_pull(VseRenderSession* session, float* out, int max_frames);
+
+/**
+ * 次に合成する位置を frame（サンプル）に移す。再生位置の変更に使う
+ * 戻り値: 移した位置（0〜全体の長さに丸める）。session が NULL なら -1
+ */
+API_EXPORT int vse_render_seek(VseRenderSession* session, int frame);
+
+/**
+ * セッション全体の長さ（サンプル数）
+ */
+API_EXPORT int vse_render_total_frames(const VseRenderSession* session);
+
+/**
+ * セッションの終了
+ */
+API_EXPORT void vse_render_close(VseRenderSession* session);
+
+/**
+ * 差分レンダリング: 編集された時間範囲だけを合成し直してマスターバッファを更新する
+ * dirty_ranges: [開始秒, 終了秒] の組を range_count 個並べた配列
+ * full_render: 0 以外なら全体を合成し直す
+ * 戻り値: マスターバッファの長さ（サンプル数）。失敗時は -1
+ */
+API_EXPORT int vse_master_render(const SynthesisRequest* request, const float* dirty_ranges, int range_count, int full_render);
+
+/**
+ * vse_master_render と同じだが、合成するのは [start, end) 秒のうちまだ合成していない部分と編集された部分だけ
+ * 範囲の外で編集された部分は、その範囲が要求されるまで合成しない
+ * 戻り値: マスターバッファの長さ（サンプル数）。失敗時は -1、合成中に次の世代が来たら VSE_RENDER_CANCELLED
+ */
+API_EXPORT int vse_master_render_window(const SynthesisRequest* request, const float* dirty_ranges, int range_count,
+                                        int full_render, float start, float end);
+
+// --- バックグラウンド合成（世代付きのマスター合成） ---
+#define VSE_RENDER_CANCELLED  -2  // 新しい世代に置き換えられて中止された
+
+/**
+ * vse_master_render_window の世代付き版
+ * 合成中に generation より新しい世代が vse_master_supersede されたら、合成ループの中で中止する
+ * 編集された範囲（dirty_ranges）は中止されても合成済みから外されるので、呼び出し側で持ち越さなくてよい
+ * 戻り値: マスターバッファの長さ / 失敗 -1 / 中止 VSE_RENDER_CANCELLED
+ */
+API_EXPORT int vse_master_render_job(const SynthesisRequest* request, const float* dirty_ranges, int range_count,
+                                     int full_render, float start, float end, int generation);
+
+/**
+ * 最新の世代を設定し、それより前の世代の vse_master_render_job を中止させる（どのスレッドから呼んでもよい）
+ */
+API_EXPORT void vse_master_supersede(int generation);
+
+/**
+ * マスターバッファの [frame, frame + count) を out にコピーする（合成中の別スレッドからも呼べる）
+ * generation・quality で合成した内容で、範囲がすべて合成済みのときだけコピーする
+ * 戻り値: コピーしたサンプル数。まだ合成されていなければ 0
+ */
+API_EXPORT int vse_master_read(int generation, int quality, int frame, float* out, int count);
+
+/**
+ * マスターバッファの先頭ポインタと長さ
+ */
+API_EXPORT const float* vse_master_buffer(int* out_len);
+
+/**
+ * マスターバッファを解放する
+ */
+API_EXPORT void vse_master_reset(void);
+
+/**
+ * アクティブなキャラクターの音素のアタック部分をプレビュー用に読み込む
+ * 戻り値: 音素の数。キャラクター未読み込みなら -1
+ */
+API_EXPORT int vse_preview_prepare(void);
+
+/**
+ * 音素をノート番号の高さで鳴らし始める（すぐ戻る）
+ * 戻り値: ボイスID。鳴らせない場合は -1
+ */
+API_EXPORT int vse_preview_note_on(const char* phoneme, int note_number, int velocity);
+
+/**
+ * 歌詞のない発音（MIDI入力のモニタリングなど）に使う音素名。戻り値: 見つからなければ -1
+ */
+API_EXPORT int vse_preview_default_phoneme(char* buf, int buf_len);
+
+/**
+ * ボイスを止める / すべて止める（すぐ戻る）
+ */
+API_EXPORT void vse_preview_note_off(int voice_id);
+API_EXPORT void vse_preview_all_off(void);
+
+/**
+ * 鳴っているプレビューを out に足し込む（出力デバイスのコールバックから呼ぶ）
+ * 戻り値: 鳴っているボイスの数
+ */
+API_EXPORT int vse_preview_render(float* out, int frames);
+
+/**
+ * プレビューの統計（発音から鳴り始めるまでのレイテンシなど）
+ */
+API_EXPORT void vse_preview_get_stats(VsePreviewStats* out);
+API_EXPORT void vse_preview_reset_stats(void);
+
+/**
+ * 合成用の作業領域の統計（合成ごとのヒープ確保回数など）
+ * 同じくらいの合成を続けていれば last_render_allocs は 0 になる
+ */
+API_EXPORT void vse_get_scratch_stats(VseScratchStats* out);
+API_EXPORT void vse_reset_scratch_stats(void);
+
+/**
+ * 段階ごとの時間と回数（音素の検索・リサンプル・ミックス・作業領域の確保・書き出しなど）と音源の読み込み
+ * カウンタは足すだけなので、合成中に読んでもよい
  */
-API_EXPORT void execute_render_to_file(const char* output_path, NoteEvent* notes, int count);
+API_EXPORT void vse_get_perf_stats(VsePerfStats* out);
+API_EXPORT void vse_reset_perf_stats(void);
 
 /**
  * エンジンの解放
@@ -1,6 +1,8 @@
 #ifndef AUDIO_TYPES_H
 #define AUDIO_TYPES_H
 
+#include <stddef.h>
+
 #define MAX_LYRIC_LENGTH 256
 #define MAX_PHONEMES_COUNT 32
 
@@ -21,4 +23,102 @@ typedef struct {
     int phoneme_count;
 } CNoteEvent;
 
+// リサンプルの品質（SynthesisRequest.resample_quality）
+#define VSE_RESAMPLE_LINEAR    0  // 線形補間（プレビュー向け、最速）
+#define VSE_RESAMPLE_SINC_FAST 1  // 8タップの窓付き sinc
+#define VSE_RESAMPLE_SINC_BEST 2  // 32タップの窓付き sinc（書き出し向け）
+
+// WAV書き出しのサンプル形式（vse_render_to_wav）
+#define VSE_WAV_PCM16   16  // 16bit 整数
+#define VSE_WAV_PCM24   24  // 24bit 整数
+#define VSE_WAV_FLOAT32 32  // 32bit float
+
+// 合成リクエスト（Python側の SynthesisRequest と同じ並び）
+typedef struct {
+    CNoteEvent* notes;
+    int note_count;
+    CPitchEvent* pitch_events;  // 時刻順（ピッチカーブにして再生速度に反映する。±8192 = ±2半音）
+    int pitch_event_count;
+    int sample_rate;
+    int resample_quality;       // VSE_RESAMPLE_*（0 = 線形補間）
+} SynthesisRequest;
+
+// 音素検索の統計（find_phoneme の結果ごとの回数）
+typedef struct {
+    long long lookups;        // 検索回数
+    long long hits;           // 音源ファイル名で見つかった
+    long long alias_hits;     // alias.txt の別名で見つかった
+    long long fallback_hits;  // 見つからず fallback.txt の代用音素を使った
+    long long misses;         // 音源にない音素（代用の有無に関わらず数える）
+} VseLookupStats;
+
+// リサンプル結果キャッシュの統計
+typedef struct {
+    long long hits;
+    long long misses;
+    long long evictions;
+    long long entries;   // 現在保持している波形の数
+    size_t bytes;        // 現在の使用量
+    size_t limit;        // 上限（バイト）
+} VseCacheStats;
+
+// 常駐音源プールの統計（vse_get_voicebank_pool_stats）
+typedef struct {
+    long long loads;       // ディスクから読み込んだ回数
+    long long switches;    // 読み込まずに切り替えた回数
+    long long evictions;   // メモリ上限で外した回数
+    int resident;          // 常駐しているキャラクター数
+    size_t bytes;          // 常駐している音源のメモリ量
+    size_t budget;         // メモリ上限
+} VsePoolStats;
+
+// プレビューボイスの統計
+typedef struct {
+    long long triggers;       // 鳴らし始めた数
+    long long dropped;        // キューが満杯で捨てた指示
+    long long stolen;         // 発音数の上限で止めたボイス
+    int active_voices;        // 直近のコールバックで鳴っていた数
+    double last_latency_ms;   // 発音の指示からコールバックで鳴らし始めるまで（出力デバイスのバッファは含まない）
+    double max_latency_ms;
+    double avg_latency_ms;
+} VsePreviewStats;
+
+// 合成用の作業領域（スクラッチアリーナ）の統計
+// 合成1回 = vse_render_pull の1ブロック、または区間・全体・マスターの合成1回
+typedef struct {
+    long long renders;             // 数えた合成の回数
+    long long heap_allocs;         // 合成中のヒープ確保の合計（作業領域の拡張・リサンプルキャッシュへの登録）
+    long long last_render_allocs;  // 直近の合成でのヒープ確保回数
+    long long max_render_allocs;   // 1回の合成でのヒープ確保回数の最大
+    long long zero_alloc_renders;  // ヒープ確保なしで終わった合成の回数
+    long long reserved_bytes;      // 作業領域として確保している量（全アリーナの合計）
+    long long peak_bytes;          // 1つのアリーナで1回に使った量の最大
+} VseScratchStats;
+
+// 合成の段階（VsePerfStats.stages の添字）
+#define VSE_STAGE_RENDER   0  // 合成の呼び出し全体（壁時計時間）
+#define VSE_STAGE_INDEX    1  // ノートの区間インデックスの作成
+#define VSE_STAGE_PITCH    2  // ピッチカーブの作成
+#define VSE_STAGE_LOOKUP   3  // 音素の検索と読み込み
+#define VSE_STAGE_CACHE    4  // リサンプルキャッシュからの取得（なければリサンプルして登録）
+#define VSE_STAGE_RESAMPLE 5  // キャッシュを通さないリサンプル
+#define VSE_STAGE_MIX      6  // 音量とクロスフェードをかけて重ねる（線形補間はリサンプルも同じループ）
+#define VSE_STAGE_ALLOC    7  // 作業領域のヒープ確保
+#define VSE_STAGE_ENCODE   8  // WAV書き出しのサンプル変換と書き込み
+#define VSE_STAGE_COUNT    9
+
+typedef struct {
+    long long calls;  // 回数
+    long long ns;     // 合計時間（ナノ秒）
+} VseStageStat;
+
+// 段階ごとの計測（vse_get_perf_stats）
+typedef struct {
+    VseStageStat stages[VSE_STAGE_COUNT];  // RENDER 以外は全スレッドの合計（並列合成では壁時計時間より長くなる）
+    long long rendered_frames;             // 合成したサンプル数
+    long long voicebank_loads;             // 読み込んだ音源の数（常駐しているものへの切り替えは数えない）
+    long long voicebank_load_ns;           // 音源の読み込み（ウォームアップを含む）にかかった時間の合計
+    long long voicebank_bytes;             // 読み込んだ音源の大きさの合計
+} VsePerfStats;
+
 #endif
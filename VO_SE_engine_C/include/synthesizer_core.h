@@ -1,16 +1,50 @@
 #ifndef SYNTHESIZER_CORE_H
 #define SYNTHESIZER_CORE_H
 
+#include <stdint.h>
 #include "audio_types.h"
 
 // MIDIノートから周波数へ変換
 float note_to_hz(int note_number);
 
 // 線形補間リサンプリング
-void resample_linear(float* src, int src_len, float* dest, int dest_len);
+void resample_linear(const float* src, int src_len, float* dest, int dest_len);
+
+// 線形補間リサンプリング（出力の [from, from + count) だけを計算）
+void resample_linear_range(const float* src, int src_len, float* dest, int dest_len, int from, int count);
+
+// 線形補間リサンプリング（読み取り速度を rate 倍にする。読み切ったあとは 0）
+void resample_linear_rate_range(const float* src, int src_len, float* dest, int dest_len, float rate, int from, int count);
 
 // クロスフェード適用
-void apply_crossfade(float* out_buffer, int current_pos, float* new_sample, int sample_len, int fade_samples);
+void apply_crossfade(float* out_buffer, int current_pos, const float* new_sample, int sample_len, int fade_samples);
 
-#endif
+// クロスフェード適用（new_sample の [from, from + count) だけを重ねる）
+void apply_crossfade_range(float* dest, const float* new_sample, int sample_len, int fade_samples, int from, int count);
+
+// WAV書き出し用: float（-1.0〜1.0）を n サンプル変換する
+// scratch: n 個分の作業領域（ディザの乱数用）。dither_state が NULL ならディザなし
+void convert_to_pcm16(const float* in, int16_t* out, int n, float* scratch, uint32_t* dither_state);
+void convert_to_pcm24(const float* in, uint8_t* out, int n, float* scratch, uint32_t* dither_state);
+void convert_to_float32(const float* in, float* out, int n);
+
+// 等パワークロスフェードの係数表（j = 0..len-1 で fade_in = sin(π/2·j/len), fade_out = cos(π/2·j/len)）
+typedef struct {
+    int len;
+    float* fade_in;
+    float* fade_out;
+} FadeTable;
 
+int fade_table_init(FadeTable* table, int len);
+void fade_table_free(FadeTable* table);
+
+// 長さ ph_len の音素の [from, from + count) に gain を掛けて dest に重ねる（dest / src は from 番目を指す）
+// crossfade が 0 なら上書き、0 以外なら先頭と末尾の fade->len サンプルを等パワーでクロスフェードし、間は足し込む
+void mix_span(float* dest, const float* src, float gain, int ph_len, int from, int count,
+              const FadeTable* fade, int crossfade);
+
+// mix_span と同じだが、src の代わりに線形補間リサンプル（resample_linear_rate_range と同じ値）をその場で計算する
+void mix_linear_rate(float* dest, const float* input, int input_len, float rate, float gain,
+                     int ph_len, int from, int count, const FadeTable* fade, int crossfade);
+
+#endif
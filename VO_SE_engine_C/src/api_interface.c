@@ -3,6 +3,18 @@
 #include <stdlib.h>   // malloc, free用
 #include <string.h>   // strstr, strncpy用
 #include <stdint.h>   // uint64_t用
+#include <math.h>     // powf用
+#include <limits.h>   // INT_MAX用
+#include <pthread.h>  // マルチスレッド合成用
+#include <sys/stat.h> // stat, fstat用
+#include <time.h>     // clock_gettime用
+#ifdef _WIN32
+#include <windows.h>  // CPUコア数の取得用
+#else
+#include <unistd.h>   // sysconf用
+#include <fcntl.h>    // open用
+#include <sys/mman.h> // mmap用
+#endif
 
 #ifndef DR_WAV_IMPLEMENTATION
 #define DR_WAV_IMPLEMENTATION
@@ -19,283 +31,3247 @@
   #define EXPORT __attribute__((visibility("default")))
 #endif
 
-// 音素ライブラリの最大数
-#define MAX_LIB_SIZE 256
 
-#include "../include/api_interface.h"
-#include "../include/synthesizer_core.h"
-#include <stdio.h>
+// --- ユーティリティ関数 ---
+// 経過時間の計測用の単調増加クロック（ナノ秒）。システム時刻の変更の影響を受けない
+static uint64_t monotonic_ns(void) {
+#ifdef _WIN32
+    static LARGE_INTEGER freq;
+    LARGE_INTEGER now;
+    if (freq.QuadPart == 0) QueryPerformanceFrequency(&freq);
+    QueryPerformanceCounter(&now);
+    return (uint64_t)((double)now.QuadPart * 1e9 / (double)freq.QuadPart);
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000ull + (uint64_t)ts.tv_nsec;
+#endif
+}
 
-// エンジン内部で保持する現在の周波数
-float global_frequency = 440.0f;
+// --- 段階ごとの計測 ---
+// 合成の段階ごとの時間と回数。カウンタはアトミックに足すだけなので、合成中でも読み出せる。
+// 音素ごとに何度も通る段階（検索・リサンプル・ミックス）は区間を合成する間ローカルに貯め、最後にまとめて足す。
+static VsePerfStats g_perf;
 
-// Pythonから呼ばれる関数
-__declspec(dllexport) void set_frequency(float hz) {
-    global_frequency = hz;
-    // synthesizer_core.c 内の合成パラメータを更新
-    update_resampling_ratio(hz); 
+static inline void perf_count(long long* counter, long long value) {
+    __atomic_fetch_add(counter, value, __ATOMIC_RELAXED);
 }
 
-__declspec(dllexport) void play_note() {
-    // 実際にWAVデータを読み込み、global_frequencyでリサンプリングして再生
-    render_audio_stream();
+// t0 からの経過時間を stage に足す
+static void perf_add(int stage, uint64_t t0) {
+    perf_count(&g_perf.stages[stage].calls, 1);
+    perf_count(&g_perf.stages[stage].ns, (long long)(monotonic_ns() - t0));
 }
 
-// Pythonから呼び出されるEXPORT関数
-void set_target_frequency(float freq) {
-    current_frequency = freq;
-    // ここで synthesizer_core の波形生成パラメータを更新する
-    update_synth_pitch(current_frequency);
-    printf("C-Engine: 音程を %f Hz に変更しました\n", freq);
+// local[stage] に t0 からの経過時間を足し、今の時刻を返す（次の段階の開始時刻として使う）
+static inline uint64_t perf_lap(VseStageStat* local, int stage, uint64_t t0) {
+    uint64_t now = monotonic_ns();
+    local[stage].calls++;
+    local[stage].ns += (long long)(now - t0);
+    return now;
 }
 
+// ローカルに貯めた分を足す
+static void perf_flush(const VseStageStat* local) {
+    for (int i = 0; i < VSE_STAGE_COUNT; i++) {
+        if (local[i].calls == 0) continue;
+        perf_count(&g_perf.stages[i].calls, local[i].calls);
+        perf_count(&g_perf.stages[i].ns, local[i].ns);
+    }
+}
 
-typedef struct {
-    char name[MAX_PHONEMES_COUNT]; // "a", "k", "s" など
-    float* samples;
-    uint64_t count;
-} Phoneme;
+// 合成の呼び出し1回分（t0 から今まで、frames サンプル）
+static void perf_render_done(uint64_t t0, int frames) {
+    perf_add(VSE_STAGE_RENDER, t0);
+    perf_count(&g_perf.rendered_frames, frames);
+}
 
-// 1つに統一
-static Phoneme g_lib[MAX_LIB_SIZE];
-static int g_lib_cnt = 0;
+EXPORT void vse_get_perf_stats(VsePerfStats* out) {
+    if (!out) return;
+    const long long* src = (const long long*)&g_perf;
+    long long* dst = (long long*)out;
+    for (size_t i = 0; i < sizeof(VsePerfStats) / sizeof(long long); i++) {
+        dst[i] = __atomic_load_n(&src[i], __ATOMIC_RELAXED);
+    }
+}
 
-// エンジンの初期化（自動スキャン版に集約）
-EXPORT int init_engine(const char* char_id, const char* audio_dir) {
-    // 1. 既存のメモリを解放（キャラクター切り替え時用）
-    for (int i = 0; i < g_lib_cnt; i++) {
-        if (g_lib[i].samples) {
-            // drwav_open で確保したメモリは drwav_free または free で解放
-            drwav_free(g_lib[i].samples, NULL);
-        }
+EXPORT void vse_reset_perf_stats(void) {
+    long long* dst = (long long*)&g_perf;
+    for (size_t i = 0; i < sizeof(VsePerfStats) / sizeof(long long); i++) {
+        __atomic_store_n(&dst[i], 0, __ATOMIC_RELAXED);
     }
-    g_lib_cnt = 0;
+}
 
-    printf("C-Engine: Scanning directory [%s] for character [%s]...\n", audio_dir, char_id);
+void resample_linear(const float* input, int input_len, float* output, int output_len) {
+    resample_linear_range(input, input_len, output, output_len, 0, output_len);
+}
 
-    // 2. ディレクトリを開く
-    DIR *dir = opendir(audio_dir);
-    if (!dir) {
-        printf("Error: Could not open directory %s\n", audio_dir);
-        return -1;
+// 出力全体のうち [from, from + count) の区間だけを計算する版（ブロック合成用）
+// 各サンプルの値は出力位置だけで決まるので、全体を一度に計算した結果と完全に一致する
+void resample_linear_range(const float* input, int input_len, float* output, int output_len, int from, int count) {
+    resample_linear_rate_range(input, input_len, output, output_len, 1.0f, from, count);
+}
+
+// 読み取り速度を rate 倍にした版（ピッチベンドが一定の区間用）。rate = 1.0 なら resample_linear_range と同じ
+// 元の波形を読み切ったあとは無音になる
+void resample_linear_rate_range(const float* input, int input_len, float* output, int output_len, float rate, int from, int count) {
+    for (int k = 0; k < count; k++) {
+        int i = from + k;
+        float t = (float)i * (input_len - 1) / (output_len - 1) * rate;
+        int t_int = (int)t;
+        float t_frac = t - t_int;
+        if (t_int + 1 < input_len) {
+            output[k] = input[t_int] * (1.0f - t_frac) + input[t_int + 1] * t_frac;
+        } else if (t_int < input_len) {
+            output[k] = input[t_int];
+        } else {
+            output[k] = 0.0f;
+        }
     }
+}   
+void apply_crossfade(float* dest, int dest_start, const float* src, int src_len, int fade_len) {
+    apply_crossfade_range(&dest[dest_start], src, src_len, fade_len, 0, src_len);
+}
 
-    struct dirent *ent;
-    while ((ent = readdir(dir)) != NULL) {
-        // .wav ファイルを探す
-        if (strstr(ent->d_name, ".wav") != NULL) {
-            if (g_lib_cnt >= MAX_LIB_SIZE) break;
-
-            char filepath[512];
-            snprintf(filepath, sizeof(filepath), "%s/%s", audio_dir, ent->d_name);
-
-            unsigned int channels;
-            unsigned int sampleRate;
-            drwav_uint64 totalPCMFrameCount;
-            
-            // WAV読み込み
-            float* pSampleData = drwav_open_file_and_read_pcm_frames_f32(
-                filepath, &channels, &sampleRate, &totalPCMFrameCount, NULL);
-
-            if (pSampleData) {
-                // ファイル名から音素名を作る (例: "a.wav" -> "a")
-                char ph_name[MAX_PHONEMES_COUNT];
-                size_t len = strlen(ent->d_name);
-                if (len > 4) {
-                    strncpy(ph_name, ent->d_name, len - 4);
-                    ph_name[len - 4] = '\0';
-
-                    // ライブラリに登録
-                    strncpy(g_lib[g_lib_cnt].name, ph_name, MAX_PHONEMES_COUNT);
-                    g_lib[g_lib_cnt].samples = pSampleData;
-                    g_lib[g_lib_cnt].count = totalPCMFrameCount;
-                    
-                    printf("  -> Loaded: [%s] (%llu samples)\n", ph_name, (unsigned long long)totalPCMFrameCount);
-                    g_lib_cnt++;
-                } else {
-                    drwav_free(pSampleData, NULL);
-                }
-            }
+// src の [from, from + count) 区間だけを dest に重ねる版
+// dest / src はどちらも区間の先頭（from 番目）を指す
+void apply_crossfade_range(float* dest, const float* src, int src_len, int fade_len, int from, int count) {
+    for (int k = 0; k < count; k++) {
+        int i = from + k;
+        if (i < fade_len) {
+            float fade_in = (float)i / fade_len;
+            float fade_out = 1.0f - fade_in;
+            dest[k] = dest[k] * fade_out + src[k] * fade_in;
+        } else if (i >= src_len - fade_len) {
+            float fade_out = (float)(src_len - i) / fade_len;
+            float fade_in = 1.0f - fade_out;
+            dest[k] = dest[k] * fade_out + src[k] * fade_in;
+        } else {
+            dest[k] += src[k];
         }
     }
-    closedir(dir);
-    printf("C-Engine: Successfully loaded %d phonemes.\n", g_lib_cnt);
-    return 0;
 }
 
-// 続いて request_synthesis_full などの実装へ...
 
+// --- 窓付き sinc リサンプラ（ポリフェーズ） ---
+// 線形補間より折り返しが少ない。フィルタ係数は品質と遮断周波数ごとに一度だけ計算して使い回す。
+// 1サンプルの計算は taps 個の連続した係数と入力の内積なので、コンパイラがベクトル化しやすい。
+#define SINC_CUTOFF_BUCKETS 32   // 縮小率を 1/4 刻みで 8 倍まで区別する
+#define SINC_LANES 8             // 内積の部分和の数（タップ数はこの倍数にする）
 
+typedef struct {
+    int taps;        // 偶数
+    int phases;      // 1サンプル間の分割数
+    float cutoff;    // 遮断周波数（ナイキスト比）
+    float* coeffs;   // phases × taps。各行の合計は 1
+} SincTable;
 
+typedef struct {
+    int taps;
+    int phases;
+    double beta;     // カイザー窓のパラメータ
+} SincQuality;
 
+// VSE_RESAMPLE_SINC_FAST / VSE_RESAMPLE_SINC_BEST の設定
+static const SincQuality g_sinc_qualities[] = {
+    {0, 0, 0.0},        // VSE_RESAMPLE_LINEAR（使わない）
+    {8, 128, 6.0},      // VSE_RESAMPLE_SINC_FAST
+    {32, 512, 9.0},     // VSE_RESAMPLE_SINC_BEST
+};
 
+static SincTable* g_sinc_tables[3][SINC_CUTOFF_BUCKETS];
+static pthread_mutex_t g_sinc_lock = PTHREAD_MUTEX_INITIALIZER;
 
-typedef struct {
-    char name[32];      // "a", "i", "u" など
-    float* samples;      // WAVの生データ
-    uint64_t count;      // サンプル数
-} Phoneme;
+// 0次の第1種変形ベッセル関数（カイザー窓用）
+static double bessel_i0(double x) {
+    double sum = 1.0, term = 1.0;
+    for (int k = 1; k < 32; k++) {
+        term *= (x / (2.0 * k)) * (x / (2.0 * k));
+        sum += term;
+        if (term < sum * 1e-12) break;
+    }
+    return sum;
+}
 
-Phoneme g_library[128];  // 最大128音素まで保持
-int g_phoneme_count = 0;
+static SincTable* sinc_table_build(const SincQuality* q, float cutoff) {
+    SincTable* table = (SincTable*)malloc(sizeof(SincTable));
+    if (!table) return NULL;
+    table->taps = q->taps;
+    table->phases = q->phases;
+    table->cutoff = cutoff;
+    table->coeffs = (float*)malloc(sizeof(float) * q->taps * q->phases);
+    if (!table->coeffs) {
+        free(table);
+        return NULL;
+    }
+    int half = q->taps / 2;
+    double norm = bessel_i0(q->beta);
+    for (int p = 0; p < q->phases; p++) {
+        double frac = (double)p / q->phases;
+        double sum = 0.0;
+        float* row = &table->coeffs[p * q->taps];
+        for (int k = 0; k < q->taps; k++) {
+            // タップ k は読み取り位置から d サンプル離れた入力に掛かる
+            double d = (k - half + 1) - frac;
+            double x = 3.14159265358979323846 * cutoff * d;
+            double sinc = fabs(x) < 1e-9 ? 1.0 : sin(x) / x;
+            double w = d / half;
+            double window = fabs(w) >= 1.0 ? 0.0 : bessel_i0(q->beta * sqrt(1.0 - w * w)) / norm;
+            row[k] = (float)(sinc * window);
+            sum += row[k];
+        }
+        for (int k = 0; k < q->taps; k++) row[k] = (float)(row[k] / sum);
+    }
+    return table;
+}
 
-// キャラクター切り替え時に呼ばれる
-EXPORT int init_engine(const char* char_id, const char* audio_dir) {
-    // 1. 今まで読み込んでいた音源をメモリから消す（メモリリーク防止）
-    for (int i = 0; i < g_phoneme_count; i++) {
-        if (g_library[i].samples) free(g_library[i].samples);
+/**
+ * 品質と読み取り間隔（出力1サンプルあたりに進む入力サンプル数）に合うフィルタを返す
+ * 縮小（間隔 > 1）の場合は折り返さないよう遮断周波数を下げる。初回だけ計算する
+ */
+static const SincTable* sinc_table_get(int quality, double step) {
+    int bucket = 0;
+    if (step > 1.0) {
+        bucket = (int)ceil(step * 4.0) - 4;
+        if (bucket >= SINC_CUTOFF_BUCKETS) bucket = SINC_CUTOFF_BUCKETS - 1;
     }
-    g_phoneme_count = 0;
+    SincTable* table = __atomic_load_n(&g_sinc_tables[quality][bucket], __ATOMIC_ACQUIRE);
+    if (table) return table;
 
-    // 2. audio_dir をスキャンして新しいWAVを読み込む
-    // (ここに前述の dr_wav を使ったロード処理を書く)
-    printf("C-Engine: キャラクター %s の音源を %s から読み込みます...\n", char_id, audio_dir);
-    
-    return 0; // 成功
+    pthread_mutex_lock(&g_sinc_lock);
+    table = g_sinc_tables[quality][bucket];
+    if (!table) {
+        float cutoff = 0.95f * 4.0f / (bucket + 4);
+        table = sinc_table_build(&g_sinc_qualities[quality], cutoff);
+        __atomic_store_n(&g_sinc_tables[quality][bucket], table, __ATOMIC_RELEASE);
+    }
+    pthread_mutex_unlock(&g_sinc_lock);
+    return table;
 }
 
+static void sinc_tables_free(void) {
+    pthread_mutex_lock(&g_sinc_lock);
+    for (int q = 0; q < 3; q++) {
+        for (int b = 0; b < SINC_CUTOFF_BUCKETS; b++) {
+            if (g_sinc_tables[q][b]) free(g_sinc_tables[q][b]->coeffs);
+            free(g_sinc_tables[q][b]);
+            g_sinc_tables[q][b] = NULL;
+        }
+    }
+    pthread_mutex_unlock(&g_sinc_lock);
+}
 
+// 入力の位置 t の値をフィルタで補間する。範囲外の入力は 0 とみなす
+static inline float sinc_sample(const SincTable* table, const float* input, int input_len, double t) {
+    int taps = table->taps;
+    int t_int = (int)floor(t);
+    int phase = (int)((t - t_int) * table->phases);
+    if (phase >= table->phases) phase = table->phases - 1;
+    const float* row = &table->coeffs[phase * taps];
+    int base = t_int - taps / 2 + 1;
 
-
-// --- ユーティリティ関数 ---
-void resample_linear(const float* input, int input_len, float* output, int output_len) {
-    for (int i = 0; i < output_len; i++) {
-        float t = (float)i * (input_len - 1) / (output_len - 1);
-        int t_int = (int)t;
-        float t_frac = t - t_int;
-        if (t_int + 1 < input_len) {
-            output[i] = input[t_int] * (1.0f - t_frac) + input[t_int + 1] * t_frac;
-        } else {
-            output[i] = input[t_int];
+    float acc = 0.0f;
+    if (base >= 0 && base + taps <= input_len) {
+        // SINC_LANES 本の部分和に分けて、並べ替えなしでベクトル命令に載るようにする（taps は SINC_LANES の倍数）
+        const float* src = &input[base];
+        float lanes[SINC_LANES] = {0};
+        for (int k = 0; k < taps; k += SINC_LANES) {
+            for (int l = 0; l < SINC_LANES; l++) lanes[l] += row[k + l] * src[k + l];
         }
-    }
-}   
-void apply_crossfade(float* dest, int dest_start, const float* src, int src_len, int fade_len) {
-    for (int i = 0; i < src_len; i++) {
-        if (i < fade_len) {
-            float fade_in = (float)i / fade_len;
-            float fade_out = 1.0f - fade_in;
-            dest[dest_start + i] = dest[dest_start + i] * fade_out + src[i] * fade_in;
-        } else if (i >= src_len - fade_len) {
-            float fade_out = (float)(src_len - i) / fade_len;
-            float fade_in = 1.0f - fade_out;
-            dest[dest_start + i] = dest[dest_start + i] * fade_out + src[i] * fade_in;
-        } else {
-            dest[dest_start + i] += src[i];
+        for (int l = 0; l < SINC_LANES; l++) acc += lanes[l];
+    } else {
+        for (int k = 0; k < taps; k++) {
+            int j = base + k;
+            if (j >= 0 && j < input_len) acc += row[k] * input[j];
         }
     }
+    return acc;
+}
+
+/**
+ * resample_linear_rate_range の sinc 版（読み取り位置の決め方は同じ）
+ * 読み取り間隔は double で一度だけ計算する。元の波形を読み切ったあとは無音
+ */
+static void resample_sinc_rate_range(int quality, const float* input, int input_len, float* output, int output_len,
+                                     float rate, int from, int count) {
+    double step = output_len > 1 ? (double)(input_len - 1) / (output_len - 1) * rate : 0.0;
+    const SincTable* table = sinc_table_get(quality, step);
+    if (!table) {
+        resample_linear_rate_range(input, input_len, output, output_len, rate, from, count);
+        return;
+    }
+    for (int k = 0; k < count; k++) {
+        double t = step * (from + k);
+        output[k] = t < input_len ? sinc_sample(table, input, input_len, t) : 0.0f;
+    }
+}
+
+/**
+ * 単体のリサンプル（品質の比較やプレビュー用）
+ * quality: VSE_RESAMPLE_LINEAR / VSE_RESAMPLE_SINC_FAST / VSE_RESAMPLE_SINC_BEST
+ */
+EXPORT void vse_resample(const float* input, int input_len, float* output, int output_len, int quality) {
+    if (!input || !output || input_len <= 0 || output_len <= 0) return;
+    if (quality == VSE_RESAMPLE_SINC_FAST || quality == VSE_RESAMPLE_SINC_BEST) {
+        resample_sinc_rate_range(quality, input, input_len, output, output_len, 1.0f, 0, output_len);
+    } else {
+        resample_linear(input, input_len, output, output_len);
+    }
+}
+
+// --- ファイルのメモリマップ ---
+typedef struct {
+    const unsigned char* data;
+    size_t size;
+#ifdef _WIN32
+    HANDLE file;
+    HANDLE mapping;
+#endif
+} MappedFile;
+
+static int map_file(const char* path, MappedFile* out) {
+    memset(out, 0, sizeof(MappedFile));
+#ifdef _WIN32
+    HANDLE file = CreateFileA(path, GENERIC_READ, FILE_SHARE_READ, NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (file == INVALID_HANDLE_VALUE) return -1;
+    LARGE_INTEGER size;
+    if (!GetFileSizeEx(file, &size) || size.QuadPart == 0) {
+        CloseHandle(file);
+        return -1;
+    }
+    HANDLE mapping = CreateFileMappingA(file, NULL, PAGE_READONLY, 0, 0, NULL);
+    const void* data = mapping ? MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0) : NULL;
+    if (!data) {
+        if (mapping) CloseHandle(mapping);
+        CloseHandle(file);
+        return -1;
+    }
+    out->file = file;
+    out->mapping = mapping;
+    out->data = (const unsigned char*)data;
+    out->size = (size_t)size.QuadPart;
+#else
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) return -1;
+    struct stat st;
+    if (fstat(fd, &st) != 0 || st.st_size == 0) {
+        close(fd);
+        return -1;
+    }
+    void* data = mmap(NULL, (size_t)st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd); // マップはファイルを閉じても残る
+    if (data == MAP_FAILED) return -1;
+    out->data = (const unsigned char*)data;
+    out->size = (size_t)st.st_size;
+#endif
+    return 0;
 }
 
+static void unmap_file(MappedFile* mf) {
+    if (!mf->data) return;
+#ifdef _WIN32
+    UnmapViewOfFile(mf->data);
+    CloseHandle(mf->mapping);
+    CloseHandle(mf->file);
+#else
+    munmap((void*)mf->data, mf->size);
+#endif
+    memset(mf, 0, sizeof(MappedFile));
+}
 
 // --- 音源ライブラリ管理 ---
 typedef struct {
     char name[256];   // ← ここを "name" ではなく "name[256]" に修正
     float* samples;
     uint64_t count;   // 先ほどの修正通り count に統一
+    MappedFile file;  // 遅延読み込みモードでマップしたWAVファイル
+    int owns_samples; // samples を drwav_free で解放する必要があるか
+    int loaded;       // samples / count が使えるか（アトミックに読む）
 } Phoneme;
 
+// 読み込みモード
+#define VSE_LOAD_EAGER 0  // 起動時にすべてのWAVをデコードする（従来通り）
+#define VSE_LOAD_MMAP  1  // WAVをマップするだけにして、初めて使うときにデコードする
 
+#define MAX_PHONEMES 128  // 1キャラクターあたりの音素数の上限
 
-static Phoneme g_lib[128];
-static int g_lib_cnt = 0;
+static int g_load_mode = VSE_LOAD_EAGER;
+static pthread_mutex_t g_decode_lock = PTHREAD_MUTEX_INITIALIZER;
 
-EXPORT int init_engine(const char* char_id, const char* audio_dir) {
-    g_lib_cnt = 0;
-    DIR *dir = opendir(audio_dir);
-    if (!dir) return -1;
-    struct dirent *ent;
-    while ((ent = readdir(dir)) != NULL) {
-        if (strstr(ent->d_name, ".wav")) {
-            char path[512];
-            snprintf(path, sizeof(path), "%s/%s", audio_dir, ent->d_name);
-            unsigned int c, sr;
-            drwav_uint64 frame_cnt;
-            float* data = drwav_open_file_and_read_pcm_frames_f32(path, &c, &sr, &frame_cnt, NULL);
-            if (data) {
-                strncpy(g_lib[g_lib_cnt].name, ent->d_name, strlen(ent->d_name) - 4);
-                g_lib[g_lib_cnt].samples = data;
-                g_lib[g_lib_cnt].count = frame_cnt;
-                g_lib_cnt++;
-            }
+/**
+ * WAV の全フレームを float32 にデコードし、モノラルにする（多チャンネルは全チャンネルの平均）
+ * 起動時の読み込み・遅延読み込み・パックの作成はすべてここを通すので、どの経路でも同じ波形になる
+ * 戻り値: malloc したバッファ（drwav_free でも解放できる）。失敗時は NULL
+ */
+static float* decode_wav_mono(drwav* wav, drwav_uint64* out_frames) {
+    unsigned int channels = wav->channels;
+    float* data = (float*)malloc((size_t)(wav->totalPCMFrameCount * channels * sizeof(float)));
+    if (!data) return NULL;
+    drwav_uint64 frames = drwav_read_pcm_frames_f32(wav, wav->totalPCMFrameCount, data);
+    if (channels > 1) {
+        for (drwav_uint64 f = 0; f < frames; f++) {
+            float sum = 0.0f;
+            for (unsigned int ch = 0; ch < channels; ch++) sum += data[f * channels + ch];
+            data[f] = sum / channels;
         }
     }
-    closedir(dir);
-    return 0;
+    *out_frames = frames;
+    return data;
 }
 
-// --- 合成核心部 ---
-float* vse_synthesize_track(CNoteEvent* notes, int note_cnt, CPitchEvent* p_events, int p_cnt, float start, float end, int* out_len) {
-    int sr = 44100;
-    *out_len = (int)((end - start) * sr);
-    float* buffer = (float*)calloc(*out_len, sizeof(float));
-    int fade_s = (int)(sr * 0.005); // 5ms
-
-    for (int i = 0; i < note_cnt; i++) {
-        int n_start = (int)((notes[i].start_time - start) * sr);
-        int n_len = (int)(notes[i].duration * sr);
-        if (n_start < 0 || n_start + n_len > *out_len || notes[i].phoneme_count == 0) continue;
+// ファイルを開いて decode_wav_mono する。sample_rate が NULL でなければサンプルレートも返す
+static float* decode_wav_file_mono(const char* path, drwav_uint64* out_frames, unsigned int* sample_rate) {
+    drwav wav;
+    if (!drwav_init_file(&wav, path, NULL)) return NULL;
+    float* data = decode_wav_mono(&wav, out_frames);
+    if (sample_rate) *sample_rate = wav.sampleRate;
+    drwav_uninit(&wav);
+    return data;
+}
 
-        int ph_len = n_len / notes[i].phoneme_count;
-        for (int p = 0; p < notes[i].phoneme_count; p++) {
-            Phoneme* target = NULL;
-            for (int k = 0; k < g_lib_cnt; k++) {
-                if (strcmp(g_lib[k].name, notes[i].phonemes[p]) == 0) { target = &g_lib[k]; break; }
+/**
+ * 遅延読み込みの音素を使える状態にする（初回だけデコード）
+ * 32bit float モノラルのWAVはデコードせず、マップした領域をそのまま参照する。
+ * 戻り値: 使える場合は 1
+ */
+static int phoneme_ensure_loaded(Phoneme* ph) {
+    if (__atomic_load_n(&ph->loaded, __ATOMIC_ACQUIRE)) return 1;
+
+    pthread_mutex_lock(&g_decode_lock);
+    if (!ph->loaded && ph->file.data) {
+        drwav wav;
+        if (drwav_init_memory(&wav, ph->file.data, ph->file.size, NULL)) {
+            size_t data_pos = (size_t)wav.dataChunkDataPos;
+            if (wav.translatedFormatTag == DR_WAVE_FORMAT_IEEE_FLOAT && wav.bitsPerSample == 32 &&
+                wav.channels == 1 && data_pos % sizeof(float) == 0 &&
+                data_pos + wav.totalPCMFrameCount * sizeof(float) <= ph->file.size) {
+                // そのまま読める形式なのでコピーしない
+                ph->samples = (float*)(ph->file.data + data_pos);
+                ph->count = wav.totalPCMFrameCount;
+                ph->owns_samples = 0;
+            } else {
+                drwav_uint64 frames;
+                float* data = decode_wav_mono(&wav, &frames);
+                if (data) {
+                    ph->count = frames;
+                    ph->samples = data;
+                    ph->owns_samples = 1;
+                }
             }
-            if (!target) continue;
+            drwav_uninit(&wav);
+        }
+        if (ph->samples) {
+            if (ph->owns_samples) unmap_file(&ph->file); // デコード済みならファイルは不要
+            __atomic_store_n(&ph->loaded, 1, __ATOMIC_RELEASE);
+        }
+    }
+    pthread_mutex_unlock(&g_decode_lock);
+    return ph->loaded;
+}
 
-            float* tmp = (float*)malloc(sizeof(float) * ph_len);
-            resample_linear(target->samples, (int)target->count, tmp, ph_len);
-            
-            float amp = notes[i].velocity / 127.0f;
-            for (int j = 0; j < ph_len; j++) tmp[j] *= amp;
+static void release_phoneme(Phoneme* ph) {
+    if (ph->samples && ph->owns_samples) drwav_free(ph->samples, NULL); // 既定のアロケータなので malloc したものも解放できる
+    unmap_file(&ph->file);
+    ph->samples = NULL;
+    ph->count = 0;
+    ph->owns_samples = 0;
+    ph->loaded = 0;
+}
 
-            int current_p = n_start + (p * ph_len);
-            if (p > 0) apply_crossfade(buffer, current_p, tmp, ph_len, fade_s);
-            else memcpy(&buffer[current_p], tmp, sizeof(float) * ph_len);
-            free(tmp);
+// --- 音素インデックス（名前 -> lib の添字） ---
+// init_engine のスキャン時に作り直すので、合成中の検索は strcmp の総当たりではなく O(1) になる。
+// 合成中の検索はロックを取らない。読み込み後の登録（別名・代用音素）は g_bank_lock を取って1つずつ行い、
+// スロットは名前と値を書いてから used を立てて公開する（削除はしないので、検索中のスロットが書き換わるのは値だけ）。
+#define MAX_PHONEME_NAME 64    // インデックスに載せる音素名の最大長（終端込み）
+#define NAME_MAP_SIZE 512      // 2の累乗。登録数の2倍以上を確保しておく
+#define MAX_MISS_NAMES 128     // 見つからなかった音素名を記録する最大数
+
+typedef struct {
+    char name[MAX_PHONEME_NAME];
+    int value;
+    int used;
+} NameSlot;
+
+typedef struct {
+    NameSlot slots[NAME_MAP_SIZE];
+    int count;
+} NameMap;
+
+// --- 常駐音源プール ---
+// 読み込んだキャラクターをメモリ上限の範囲で保持しておき、切り替え時はポインタを差し替えるだけにする。
+// 上限を超えたら最後に使ったのが古いものから捨てる（アクティブなもの・合成中のものは捨てない）。
+#define MAX_RESIDENT_BANKS 8
+#define VOICEBANK_DEFAULT_BUDGET ((size_t)512 * 1024 * 1024)
+
+typedef struct {
+    char char_id[128];
+    char audio_dir[512];
+    int load_mode;              // 読み込んだときのモード（違うモードで読み込み直せるように区別する）
+    int state;                  // BANK_FREE / BANK_LOADING / BANK_READY
+    int users;                  // 合成中の数（0 のものだけ捨てられる。g_bank_lock で守る）
+    unsigned long long last_used;
+    Phoneme lib[MAX_PHONEMES];
+    int lib_cnt;
+    NameMap index;              // 音素名 -> lib の添字
+    NameMap alias;              // 別名 -> lib の添字（alias.txt）
+    NameMap fallback;           // 音素名 -> 代用する lib の添字（fallback.txt）
+    MappedFile pack;            // 音源パックから読んだ場合のマップ（音素は直接この領域を参照する）
+} Voicebank;
+
+#define BANK_FREE    0
+#define BANK_LOADING 1
+#define BANK_READY   2
+
+static Voicebank g_banks[MAX_RESIDENT_BANKS];
+static Voicebank* g_active = NULL;           // 合成に使うキャラクター
+static unsigned long long g_bank_clock = 0;  // LRU 用の使用順カウンタ
+static size_t g_bank_budget = VOICEBANK_DEFAULT_BUDGET;
+static VsePoolStats g_pool_stats;
+static pthread_mutex_t g_bank_lock = PTHREAD_MUTEX_INITIALIZER;
+
+static NameMap g_ph_missing;   // 見つからなかった音素名 -> g_miss_counts の添字
+
+static VseLookupStats g_lookup_stats;
+static long long g_miss_counts[MAX_MISS_NAMES];
+
+// FNV-1a
+static uint32_t hash_name(const char* name) {
+    uint32_t h = 2166136261u;
+    for (const unsigned char* p = (const unsigned char*)name; *p; p++) {
+        h ^= *p;
+        h *= 16777619u;
+    }
+    return h;
+}
+
+static void name_map_clear(NameMap* map) {
+    memset(map, 0, sizeof(NameMap));
+}
+
+// 見つかればスロット、なければ NULL
+static NameSlot* name_map_find(NameMap* map, const char* name) {
+    if (strlen(name) >= MAX_PHONEME_NAME) return NULL;
+    uint32_t i = hash_name(name) & (NAME_MAP_SIZE - 1);
+    while (__atomic_load_n(&map->slots[i].used, __ATOMIC_ACQUIRE)) {
+        if (strcmp(map->slots[i].name, name) == 0) return &map->slots[i];
+        i = (i + 1) & (NAME_MAP_SIZE - 1);
+    }
+    return NULL;
+}
+
+// スロットの値（登録と同時に読まれてもよい）
+static inline int name_slot_value(const NameSlot* slot) {
+    return __atomic_load_n(&slot->value, __ATOMIC_RELAXED);
+}
+
+// 登録（既にあれば上書き）。満杯・名前が長すぎる場合は -1
+// 登録どうしは同時に呼ばないこと（検索とは同時でもよい）
+static int name_map_put(NameMap* map, const char* name, int value) {
+    if (strlen(name) >= MAX_PHONEME_NAME) return -1;
+    NameSlot* slot = name_map_find(map, name);
+    if (slot) {
+        __atomic_store_n(&slot->value, value, __ATOMIC_RELAXED);
+        return 0;
+    }
+    if (map->count >= NAME_MAP_SIZE / 2) return -1;
+    uint32_t i = hash_name(name) & (NAME_MAP_SIZE - 1);
+    while (map->slots[i].used) i = (i + 1) & (NAME_MAP_SIZE - 1);
+    strcpy(map->slots[i].name, name);
+    map->slots[i].value = value;
+    __atomic_store_n(&map->slots[i].used, 1, __ATOMIC_RELEASE); // 名前と値を書き終えてから検索に見せる
+    map->count++;
+    return 0;
+}
+
+// 音素名（別名も可）を lib の添字に解決する。なければ -1
+static int resolve_phoneme_index(Voicebank* vb, const char* name) {
+    NameSlot* slot = name_map_find(&vb->index, name);
+    if (!slot) slot = name_map_find(&vb->alias, name);
+    return slot ? name_slot_value(slot) : -1;
+}
+
+// "名前=対象" 形式の行を読み込んでテーブルに登録する（# で始まる行はコメント）
+static void load_name_table(Voicebank* vb, NameMap* map, const char* audio_dir, const char* filename) {
+    char path[512];
+    snprintf(path, sizeof(path), "%s/%s", audio_dir, filename);
+    FILE* fp = fopen(path, "r");
+    if (!fp) return;
+
+    char line[256];
+    while (fgets(line, sizeof(line), fp)) {
+        line[strcspn(line, "\r\n")] = '\0';
+        char* eq = strchr(line, '=');
+        if (line[0] == '#' || !eq) continue;
+        *eq = '\0';
+        int target = resolve_phoneme_index(vb, eq + 1);
+        if (target < 0 || name_map_put(map, line, target) != 0) {
+            printf("C-Engine: %s の [%s] を登録できません\n", filename, line);
         }
     }
-    return buffer;
+    fclose(fp);
 }
 
-// --- Pythonからのメイン窓口 ---
-EXPORT float* request_synthesis_full(SynthesisRequest request, int* out_sample_count) {
-    float max_time = 0.0f;
+// 統計は複数スレッドから更新されるのでアトミックに加算する
+#define STAT_ADD(counter, n) __atomic_fetch_add(&(counter), (n), __ATOMIC_RELAXED)
 
-    // 終了時間を計算
-    for (int i = 0; i < request.note_count; i++) {
-        float end = request.notes[i].start_time + request.notes[i].duration;
-        if (end > max_time) {
-            max_time = end;
+static pthread_mutex_t g_missing_lock = PTHREAD_MUTEX_INITIALIZER;
+
+// 合成時の音素検索（インデックス -> 別名 -> 代用音素 の順）
+// vb が NULL（キャラクター未読み込み）の場合は見つからなかったものとして扱う
+static Phoneme* find_phoneme(Voicebank* vb, const char* name) {
+    STAT_ADD(g_lookup_stats.lookups, 1);
+
+    NameSlot* slot = vb ? name_map_find(&vb->index, name) : NULL;
+    if (slot) {
+        STAT_ADD(g_lookup_stats.hits, 1);
+        return &vb->lib[name_slot_value(slot)];
+    }
+    slot = vb ? name_map_find(&vb->alias, name) : NULL;
+    if (slot) {
+        STAT_ADD(g_lookup_stats.alias_hits, 1);
+        return &vb->lib[name_slot_value(slot)];
+    }
+
+    // キャラクターが持っていない音素として記録する
+    STAT_ADD(g_lookup_stats.misses, 1);
+    pthread_mutex_lock(&g_missing_lock);
+    NameSlot* miss = name_map_find(&g_ph_missing, name);
+    if (miss) {
+        g_miss_counts[miss->value]++;
+    } else if (g_ph_missing.count < MAX_MISS_NAMES &&
+               name_map_put(&g_ph_missing, name, g_ph_missing.count) == 0) {
+        g_miss_counts[g_ph_missing.count - 1] = 1;
+    }
+    pthread_mutex_unlock(&g_missing_lock);
+
+    slot = vb ? name_map_find(&vb->fallback, name) : NULL;
+    if (slot) {
+        STAT_ADD(g_lookup_stats.fallback_hits, 1);
+        return &vb->lib[name_slot_value(slot)];
+    }
+    return NULL;
+}
+
+// 音素の波形を品質に応じた方法でリサンプルする（出力の [from, from + count) だけ）
+static void resample_phoneme_range(int quality, const Phoneme* phoneme, float* output, int output_len,
+                                   float rate, int from, int count) {
+    if (quality == VSE_RESAMPLE_LINEAR) {
+        resample_linear_rate_range(phoneme->samples, (int)phoneme->count, output, output_len, rate, from, count);
+    } else {
+        resample_sinc_rate_range(quality, phoneme->samples, (int)phoneme->count, output, output_len, rate, from, count);
+    }
+}
+
+// --- リサンプル結果のキャッシュ（LRU） ---
+// 同じ音素を同じ長さ・ピッチで鳴らすことが多いので、リサンプル済みの波形を保持して使い回す。
+// キーは (音素, 長さ, ピッチ, リサンプル品質)。ピッチは再生速度の比率で、ピッチベンドが一定の音素ではその倍率になる。
+// 複数スレッドから使うので g_cache_lock で守り、使用中の波形は refs で追い出しから守る。
+#define RESAMPLE_CACHE_BUCKETS 4096
+#define RESAMPLE_CACHE_DEFAULT_LIMIT (64u * 1024u * 1024u)
+
+typedef struct CacheEntry {
+    const Phoneme* phoneme;
+    int length;
+    float pitch;
+    int quality;                    // VSE_RESAMPLE_*
+    uint32_t hash;
+    int refs;                       // 使用中のスレッド数（0 のものだけ追い出せる）
+    struct CacheEntry* hash_next;   // 同じバケットの次
+    struct CacheEntry* lru_prev;    // より最近使われた側
+    struct CacheEntry* lru_next;    // より古い側
+    float samples[];                // length サンプル（音量は未適用）
+} CacheEntry;
+
+static CacheEntry* g_cache_buckets[RESAMPLE_CACHE_BUCKETS];
+static CacheEntry* g_cache_lru_head = NULL;  // 最近使ったもの
+static CacheEntry* g_cache_lru_tail = NULL;  // 最も古いもの
+static size_t g_cache_limit = RESAMPLE_CACHE_DEFAULT_LIMIT;
+static VseCacheStats g_cache_stats;
+static pthread_mutex_t g_cache_lock = PTHREAD_MUTEX_INITIALIZER;
+
+static uint32_t cache_hash(const Phoneme* phoneme, int length, float pitch, int quality) {
+    uint32_t pitch_bits;
+    memcpy(&pitch_bits, &pitch, sizeof(pitch_bits));
+    uint64_t h = (uint64_t)(uintptr_t)phoneme * 0x9E3779B97F4A7C15ull;
+    h ^= (uint64_t)(uint32_t)(length ^ (quality << 28)) * 0xC2B2AE3D27D4EB4Full;
+    h ^= (uint64_t)pitch_bits * 0x165667B19E3779F9ull;
+    return (uint32_t)(h ^ (h >> 32));
+}
+
+static void cache_lru_unlink(CacheEntry* e) {
+    if (e->lru_prev) e->lru_prev->lru_next = e->lru_next; else g_cache_lru_head = e->lru_next;
+    if (e->lru_next) e->lru_next->lru_prev = e->lru_prev; else g_cache_lru_tail = e->lru_prev;
+    e->lru_prev = e->lru_next = NULL;
+}
+
+static void cache_lru_push_front(CacheEntry* e) {
+    e->lru_prev = NULL;
+    e->lru_next = g_cache_lru_head;
+    if (g_cache_lru_head) g_cache_lru_head->lru_prev = e; else g_cache_lru_tail = e;
+    g_cache_lru_head = e;
+}
+
+static void cache_remove(CacheEntry* e) {
+    CacheEntry** link = &g_cache_buckets[e->hash & (RESAMPLE_CACHE_BUCKETS - 1)];
+    while (*link && *link != e) link = &(*link)->hash_next;
+    if (*link) *link = e->hash_next;
+    cache_lru_unlink(e);
+    g_cache_stats.bytes -= sizeof(float) * (size_t)e->length;
+    g_cache_stats.entries--;
+    free(e);
+}
+
+// 上限を超えている間、使用中でない古いものから捨てる（g_cache_lock を持って呼ぶ）
+static void cache_evict_to(size_t limit) {
+    CacheEntry* e = g_cache_lru_tail;
+    while (e && g_cache_stats.bytes > limit) {
+        CacheEntry* prev = e->lru_prev;
+        if (e->refs == 0) {
+            cache_remove(e);
+            g_cache_stats.evictions++;
         }
+        e = prev;
     }
-    max_time += 1.0f; // バッファに余裕を持たせる
+}
 
-    return vse_synthesize_track(
-        request.notes, 
-        request.note_count,
-        request.pitch_events, 
-        request.pitch_event_count,
-        0.0f, 
-        max_time,
-        out_sample_count
-    );
+static void cache_clear(void) {
+    pthread_mutex_lock(&g_cache_lock);
+    CacheEntry* e = g_cache_lru_tail;
+    while (e) {
+        CacheEntry* prev = e->lru_prev;
+        if (e->refs == 0) cache_remove(e);
+        e = prev;
+    }
+    pthread_mutex_unlock(&g_cache_lock);
 }
 
+// 指定したキャラクターの音素のエントリを捨てる（音源を解放する前に呼ぶ）
+static void cache_purge_bank(const Voicebank* vb) {
+    pthread_mutex_lock(&g_cache_lock);
+    CacheEntry* e = g_cache_lru_tail;
+    while (e) {
+        CacheEntry* prev = e->lru_prev;
+        if (e->phoneme >= vb->lib && e->phoneme < vb->lib + MAX_PHONEMES && e->refs == 0) cache_remove(e);
+        e = prev;
+    }
+    pthread_mutex_unlock(&g_cache_lock);
+}
 
-// --- 合成結果の解放 ---       
-EXPORT void free_synthesized_audio(float* audio_data) {
-    if (audio_data) {
-        free(audio_data);
+static CacheEntry* cache_find(const Phoneme* phoneme, int length, float pitch, int quality, uint32_t h) {
+    CacheEntry* e = g_cache_buckets[h & (RESAMPLE_CACHE_BUCKETS - 1)];
+    for (; e; e = e->hash_next) {
+        if (e->phoneme == phoneme && e->length == length && e->pitch == pitch && e->quality == quality) return e;
     }
+    return NULL;
 }
-// --- エンジン終了処理 ---
-EXPORT void shutdown_engine() {
-    for (int i = 0; i < g_lib_cnt; i++) {
-        if (g_lib[i].samples) {
-            free(g_lib[i].samples);
-            g_lib[i].samples = NULL;
+
+/**
+ * リサンプル済みの音素波形を借りる（音量は未適用）
+ * キャッシュになければ全体をリサンプルして登録する。
+ * 上限より大きくて登録できない場合は NULL（呼び出し側で直接リサンプルする）
+ * 使い終わったら cache_release で返すこと。それまでは追い出されない。
+ * allocs: 登録のためにヒープを確保したら 1 増やす（合成ごとの確保回数の集計用）
+ */
+static CacheEntry* cache_acquire(const Phoneme* phoneme, int length, float pitch, int quality, long long* allocs) {
+    uint32_t h = cache_hash(phoneme, length, pitch, quality);
+    size_t bytes = sizeof(float) * (size_t)length;
+
+    pthread_mutex_lock(&g_cache_lock);
+    CacheEntry* e = cache_find(phoneme, length, pitch, quality, h);
+    if (e) {
+        g_cache_stats.hits++;
+        e->refs++;
+        cache_lru_unlink(e);
+        cache_lru_push_front(e);
+        pthread_mutex_unlock(&g_cache_lock);
+        return e;
+    }
+    g_cache_stats.misses++;
+    size_t limit = g_cache_limit;
+    pthread_mutex_unlock(&g_cache_lock);
+    if (bytes > limit) return NULL;
+
+    // リサンプルはロックの外で行う
+    CacheEntry* fresh = (CacheEntry*)malloc(sizeof(CacheEntry) + bytes);
+    if (!fresh) return NULL;
+    (*allocs)++;
+    fresh->phoneme = phoneme;
+    fresh->length = length;
+    fresh->pitch = pitch;
+    fresh->quality = quality;
+    fresh->hash = h;
+    fresh->refs = 1;
+    resample_phoneme_range(quality, phoneme, fresh->samples, length, pitch, 0, length);
+
+    pthread_mutex_lock(&g_cache_lock);
+    e = cache_find(phoneme, length, pitch, quality, h);
+    if (e) {
+        // 他のスレッドが先に登録していた
+        e->refs++;
+        pthread_mutex_unlock(&g_cache_lock);
+        free(fresh);
+        return e;
+    }
+    cache_evict_to(g_cache_limit > bytes ? g_cache_limit - bytes : 0);
+    CacheEntry** bucket = &g_cache_buckets[h & (RESAMPLE_CACHE_BUCKETS - 1)];
+    fresh->hash_next = *bucket;
+    *bucket = fresh;
+    cache_lru_push_front(fresh);
+    g_cache_stats.bytes += bytes;
+    g_cache_stats.entries++;
+    pthread_mutex_unlock(&g_cache_lock);
+    return fresh;
+}
+
+static void cache_release(CacheEntry* e) {
+    if (!e) return;
+    pthread_mutex_lock(&g_cache_lock);
+    e->refs--;
+    pthread_mutex_unlock(&g_cache_lock);
+}
+
+EXPORT void vse_set_resample_cache_limit(size_t bytes) {
+    pthread_mutex_lock(&g_cache_lock);
+    g_cache_limit = bytes;
+    cache_evict_to(g_cache_limit);
+    pthread_mutex_unlock(&g_cache_lock);
+}
+
+EXPORT void vse_get_resample_cache_stats(VseCacheStats* out) {
+    if (!out) return;
+    pthread_mutex_lock(&g_cache_lock);
+    *out = g_cache_stats;
+    out->limit = g_cache_limit;
+    pthread_mutex_unlock(&g_cache_lock);
+}
+
+EXPORT void vse_clear_resample_cache(void) {
+    cache_clear();
+    pthread_mutex_lock(&g_cache_lock);
+    g_cache_stats.hits = 0;
+    g_cache_stats.misses = 0;
+    g_cache_stats.evictions = 0;
+    pthread_mutex_unlock(&g_cache_lock);
+}
+
+// --- 音源パック（1ファイルにまとめた音源） ---
+// 音素ごとのWAVを開いて解析する代わりに、コンパイル済みのパックを1回のマップで読み込む。
+// レイアウト（リトルエンディアン）:
+//   VsePackHeader | VsePackEntry × entry_count | 各音素の float32 モノラルデータ（VSE_PACK_ALIGN 境界）
+#define VOICEBANK_PACK_NAME "voicebank.vsepack"
+#define VSE_PACK_MAGIC "VSEPACK1"
+#define VSE_PACK_VERSION 1
+#define VSE_PACK_ALIGN 64
+
+typedef struct {
+    char magic[8];
+    uint32_t version;
+    uint32_t entry_count;
+    uint64_t index_offset;   // VsePackEntry 配列の位置
+    uint64_t data_offset;    // 最初の音素データの位置
+    uint32_t alignment;
+    uint32_t reserved[7];
+} VsePackHeader;             // 64 バイト
+
+typedef struct {
+    char name[MAX_PHONEME_NAME];
+    uint64_t offset;         // ファイル先頭からの位置
+    uint64_t frames;
+    uint32_t sample_rate;
+    uint32_t reserved;
+} VsePackEntry;              // 88 バイト
+
+// --- 読み込みの進捗とキャンセル ---
+// vse_cancel_load は世代を進めるだけで、読み込み側はファイルごとに開始時の世代と比べる。
+typedef struct {
+    VseLoadProgressCallback callback;
+    void* user_data;
+    int stage;
+    int files_done;
+    int files_total;
+    long long bytes_done;
+    long long bytes_total;
+    int generation;    // 読み込み開始時の g_load_generation
+} LoadContext;
+
+static int g_load_generation = 0;
+
+static int load_cancelled(const LoadContext* ctx) {
+    return __atomic_load_n(&g_load_generation, __ATOMIC_ACQUIRE) != ctx->generation;
+}
+
+static void report_progress(const LoadContext* ctx) {
+    if (ctx->callback) {
+        ctx->callback(ctx->stage, ctx->files_done, ctx->files_total, ctx->bytes_done, ctx->bytes_total, ctx->user_data);
+    }
+}
+
+static long long file_size(const char* path) {
+    struct stat st;
+    return stat(path, &st) == 0 ? (long long)st.st_size : 0;
+}
+
+static void render_pool_warm_up(void);
+
+static Phoneme* register_phoneme(Voicebank* vb, const char* name, size_t name_len) {
+    if (vb->lib_cnt >= MAX_PHONEMES) return NULL;
+    Phoneme* ph = &vb->lib[vb->lib_cnt];
+    if (name_len >= sizeof(ph->name)) name_len = sizeof(ph->name) - 1;
+    memcpy(ph->name, name, name_len);
+    ph->name[name_len] = '\0';
+    if (name_map_put(&vb->index, ph->name, vb->lib_cnt) != 0) {
+        printf("C-Engine: [%s] をインデックスに登録できません\n", ph->name);
+    }
+    vb->lib_cnt++;
+    return ph;
+}
+
+static int scan_wav_directory(Voicebank* vb, const char* audio_dir, LoadContext* ctx) {
+    DIR *dir = opendir(audio_dir);
+    if (!dir) return -1;
+    struct dirent *ent;
+    char path[512];
+
+    // 進捗の分母（ファイル数と合計サイズ）を先に数えておく
+    while ((ent = readdir(dir)) != NULL) {
+        if (!strstr(ent->d_name, ".wav")) continue;
+        snprintf(path, sizeof(path), "%s/%s", audio_dir, ent->d_name);
+        ctx->files_total++;
+        ctx->bytes_total += file_size(path);
+    }
+    rewinddir(dir);
+    report_progress(ctx);
+
+    while ((ent = readdir(dir)) != NULL) {
+        if (strstr(ent->d_name, ".wav")) {
+            if (vb->lib_cnt >= MAX_PHONEMES) break;
+            if (load_cancelled(ctx)) {
+                closedir(dir);
+                return VSE_LOAD_CANCELLED;
+            }
+
+            snprintf(path, sizeof(path), "%s/%s", audio_dir, ent->d_name);
+            ctx->files_done++;
+            ctx->bytes_done += file_size(path);
+            Phoneme* ph = &vb->lib[vb->lib_cnt];
+            if (g_load_mode == VSE_LOAD_MMAP) {
+                // マップだけして、デコードは初めて使うときに行う
+                if (map_file(path, &ph->file) != 0) continue;
+            } else {
+                drwav_uint64 frame_cnt;
+                float* data = decode_wav_file_mono(path, &frame_cnt, NULL);
+                if (!data) continue;
+                ph->samples = data;
+                ph->count = frame_cnt;
+                ph->owns_samples = 1;
+                ph->loaded = 1;
+            }
+            register_phoneme(vb, ent->d_name, strlen(ent->d_name) - 4);
+            report_progress(ctx);
         }
     }
-    g_lib_cnt = 0;
+    closedir(dir);
+    return 0;
+}
+
+// パックをマップして音素を登録する。パックとして読めなければ -1
+static int load_voicebank_pack(Voicebank* vb, const char* pack_path, LoadContext* ctx) {
+    MappedFile* pack = &vb->pack;
+    if (map_file(pack_path, pack) != 0) return -1;
+
+    const VsePackHeader* header = (const VsePackHeader*)pack->data;
+    if (pack->size < sizeof(VsePackHeader) || memcmp(header->magic, VSE_PACK_MAGIC, 8) != 0 ||
+        header->version != VSE_PACK_VERSION ||
+        header->index_offset + (uint64_t)header->entry_count * sizeof(VsePackEntry) > pack->size) {
+        printf("C-Engine: %s は音源パックとして読み込めません\n", pack_path);
+        unmap_file(pack);
+        return -1;
+    }
+
+    const VsePackEntry* entries = (const VsePackEntry*)(pack->data + header->index_offset);
+    ctx->files_total = (int)header->entry_count;
+    ctx->bytes_total = (long long)pack->size;
+    ctx->bytes_done = (long long)header->data_offset;
+    report_progress(ctx);
+    for (uint32_t i = 0; i < header->entry_count; i++) {
+        const VsePackEntry* e = &entries[i];
+        if (load_cancelled(ctx)) return VSE_LOAD_CANCELLED;
+        ctx->files_done++;
+        ctx->bytes_done += (long long)(e->frames * sizeof(float));
+        report_progress(ctx);
+        if (e->offset % sizeof(float) != 0 || e->offset + e->frames * sizeof(float) > pack->size) continue;
+        Phoneme* ph = register_phoneme(vb, e->name, strnlen(e->name, MAX_PHONEME_NAME - 1));
+        if (!ph) break;
+        ph->samples = (float*)(pack->data + e->offset);
+        ph->count = e->frames;
+        ph->owns_samples = 0;
+        ph->loaded = 1;
+    }
+    return 0;
+}
+
+static int ends_with(const char* s, const char* suffix) {
+    size_t n = strlen(s), m = strlen(suffix);
+    return n >= m && strcmp(s + n - m, suffix) == 0;
+}
+
+// キャラクターの音源を vb に読み込む（g_bank_lock の外で呼ぶ）
+static int load_voicebank(Voicebank* vb, const char* audio_dir, LoadContext* ctx) {
+    int result;
+    // alias.txt などはパックと同じフォルダから読む
+    char base_dir[512];
+    snprintf(base_dir, sizeof(base_dir), "%s", audio_dir);
+
+    if (ends_with(audio_dir, ".vsepack")) {
+        char* slash = strrchr(base_dir, '/');
+        char* backslash = strrchr(base_dir, '\\');
+        if (backslash && (!slash || backslash > slash)) slash = backslash;
+        if (slash) *slash = '\0'; else snprintf(base_dir, sizeof(base_dir), ".");
+        result = load_voicebank_pack(vb, audio_dir, ctx);
+    } else {
+        char pack_path[512];
+        snprintf(pack_path, sizeof(pack_path), "%s/%s", audio_dir, VOICEBANK_PACK_NAME);
+        result = load_voicebank_pack(vb, pack_path, ctx);
+        if (result == -1) result = scan_wav_directory(vb, audio_dir, ctx);
+    }
+    if (result != 0) return result;
+
+    // 別名・代用音素のテーブル（任意）
+    load_name_table(vb, &vb->alias, base_dir, "alias.txt");
+    load_name_table(vb, &vb->fallback, base_dir, "fallback.txt");
+    return 0;
+}
+
+// 音源を解放してスロットを空ける（g_bank_lock を持ち、users == 0 のときに呼ぶ）
+static void unload_voicebank(Voicebank* vb) {
+    cache_purge_bank(vb); // 音素のポインタがキャッシュのキーなので、先に捨てておく
+    for (int i = 0; i < MAX_PHONEMES; i++) release_phoneme(&vb->lib[i]);
+    unmap_file(&vb->pack);
+    if (g_active == vb) g_active = NULL;
+    memset(vb, 0, sizeof(Voicebank));
+}
+
+// 音源が使っているメモリ量（デコードした波形 + マップしたファイル）
+static size_t voicebank_bytes(const Voicebank* vb) {
+    size_t bytes = vb->pack.size;
+    pthread_mutex_lock(&g_decode_lock);
+    for (int i = 0; i < vb->lib_cnt; i++) {
+        const Phoneme* ph = &vb->lib[i];
+        bytes += ph->file.size;
+        if (ph->owns_samples) bytes += sizeof(float) * (size_t)ph->count;
+    }
+    pthread_mutex_unlock(&g_decode_lock);
+    return bytes;
+}
+
+// 使っていない中で最も古いキャラクター。なければ NULL（g_bank_lock を持って呼ぶ）
+static Voicebank* least_recent_idle_bank(void) {
+    Voicebank* victim = NULL;
+    for (int i = 0; i < MAX_RESIDENT_BANKS; i++) {
+        Voicebank* vb = &g_banks[i];
+        if (vb->state != BANK_READY || vb->users > 0 || vb == g_active) continue;
+        if (!victim || vb->last_used < victim->last_used) victim = vb;
+    }
+    return victim;
+}
+
+// 上限を超えている間、古いキャラクターから捨てる（g_bank_lock を持って呼ぶ）
+static void enforce_voicebank_budget(void) {
+    for (;;) {
+        size_t total = 0;
+        for (int i = 0; i < MAX_RESIDENT_BANKS; i++) {
+            if (g_banks[i].state == BANK_READY) total += voicebank_bytes(&g_banks[i]);
+        }
+        Voicebank* victim = total > g_bank_budget ? least_recent_idle_bank() : NULL;
+        if (!victim) return;
+        printf("C-Engine: [%s] の音源をメモリから外します\n", victim->char_id);
+        unload_voicebank(victim);
+        g_pool_stats.evictions++;
+    }
+}
+
+// 常駐しているキャラクターを探す（g_bank_lock を持って呼ぶ）
+// audio_dir を指定した場合は、同じフォルダを同じ読み込みモードで読んだものだけを返す
+static Voicebank* find_resident_bank(const char* char_id, const char* audio_dir) {
+    for (int i = 0; i < MAX_RESIDENT_BANKS; i++) {
+        Voicebank* vb = &g_banks[i];
+        if (vb->state == BANK_READY && strcmp(vb->char_id, char_id) == 0 &&
+            (!audio_dir || (strcmp(vb->audio_dir, audio_dir) == 0 && vb->load_mode == g_load_mode))) {
+            return vb;
+        }
+    }
+    return NULL;
+}
+
+// 合成の間、アクティブなキャラクターを捨てられないようにする
+static Voicebank* bank_acquire_active(void) {
+    pthread_mutex_lock(&g_bank_lock);
+    Voicebank* vb = g_active;
+    if (vb) vb->users++;
+    pthread_mutex_unlock(&g_bank_lock);
+    return vb;
+}
+
+static void bank_release(Voicebank* vb) {
+    if (!vb) return;
+    pthread_mutex_lock(&g_bank_lock);
+    vb->users--;
+    pthread_mutex_unlock(&g_bank_lock);
+}
+
+// ウォームアップの進捗に数えるバイト数（未デコードの音素はファイルサイズ）
+static long long phoneme_warm_up_bytes(const Phoneme* ph) {
+    if (__atomic_load_n(&ph->loaded, __ATOMIC_ACQUIRE)) return (long long)(ph->count * sizeof(float));
+    return (long long)ph->file.size;
+}
+
+/**
+ * 切り替え直後の合成が遅くならないよう、前もって音源に触れておく
+ * 遅延読み込みの音素をデコードし、波形のページをすべて読み込ませ、合成スレッドを起こしておく
+ */
+static int warm_up_voicebank(Voicebank* vb, LoadContext* ctx) {
+    ctx->stage = VSE_LOAD_STAGE_WARM_UP;
+    ctx->files_done = 0;
+    ctx->files_total = vb->lib_cnt;
+    ctx->bytes_done = 0;
+    ctx->bytes_total = 0;
+    for (int i = 0; i < vb->lib_cnt; i++) ctx->bytes_total += phoneme_warm_up_bytes(&vb->lib[i]);
+    report_progress(ctx);
+
+    size_t page_floats = 4096 / sizeof(float);
+    volatile float sink = 0.0f;
+    for (int i = 0; i < vb->lib_cnt; i++) {
+        if (load_cancelled(ctx)) return VSE_LOAD_CANCELLED;
+        Phoneme* ph = &vb->lib[i];
+        ctx->bytes_done += phoneme_warm_up_bytes(ph);
+        if (phoneme_ensure_loaded(ph)) {
+            for (size_t j = 0; j < ph->count; j += page_floats) sink += ph->samples[j];
+        }
+        ctx->files_done++;
+        report_progress(ctx);
+    }
+    (void)sink;
+    render_pool_warm_up();
+    return 0;
+}
+
+/**
+ * audio_dir: WAV が入ったフォルダ、または .vsepack ファイル
+ * フォルダに voicebank.vsepack があれば、WAV をスキャンせずにそれを読み込む
+ * 既に常駐しているキャラクターなら読み込まずに切り替えるだけ
+ */
+EXPORT int init_engine(const char* char_id, const char* audio_dir) {
+    return vse_load_character(char_id, audio_dir, NULL, NULL, 0);
+}
+
+/**
+ * init_engine の進捗・キャンセル・ウォームアップ付き版（呼び出したスレッドで読み込む）
+ * 読み込みが終わるまでは、アクティブなキャラクターは切り替わらない
+ */
+EXPORT int vse_load_character(const char* char_id, const char* audio_dir,
+                              VseLoadProgressCallback callback, void* user_data, int warm_up) {
+    LoadContext ctx;
+    memset(&ctx, 0, sizeof(ctx));
+    ctx.callback = callback;
+    ctx.user_data = user_data;
+    ctx.stage = VSE_LOAD_STAGE_READ;
+    ctx.generation = __atomic_load_n(&g_load_generation, __ATOMIC_ACQUIRE);
+
+    vse_reset_lookup_stats();
+    if (vse_activate_character(char_id, audio_dir) == 0) {
+        int result = 0;
+        if (warm_up) {
+            Voicebank* active = bank_acquire_active();
+            if (active) result = warm_up_voicebank(active, &ctx);
+            bank_release(active);
+        }
+        return result;
+    }
+
+    // 空いているスロットを確保する。なければ使っていない最も古いものを捨てる
+    pthread_mutex_lock(&g_bank_lock);
+    Voicebank* vb = NULL;
+    for (int i = 0; i < MAX_RESIDENT_BANKS && !vb; i++) {
+        if (g_banks[i].state == BANK_FREE) vb = &g_banks[i];
+    }
+    if (!vb && (vb = least_recent_idle_bank()) != NULL) {
+        unload_voicebank(vb);
+        g_pool_stats.evictions++;
+    }
+    if (!vb) {
+        pthread_mutex_unlock(&g_bank_lock);
+        printf("C-Engine: 音源を読み込む空きがありません\n");
+        return -1;
+    }
+    vb->state = BANK_LOADING;
+    snprintf(vb->char_id, sizeof(vb->char_id), "%s", char_id);
+    snprintf(vb->audio_dir, sizeof(vb->audio_dir), "%s", audio_dir);
+    vb->load_mode = g_load_mode;
+    pthread_mutex_unlock(&g_bank_lock);
+
+    // 読み込みはロックの外で行う（その間も他のキャラクターで合成できる）
+    uint64_t t0 = monotonic_ns();
+    int result = load_voicebank(vb, audio_dir, &ctx);
+    if (result == 0 && warm_up) result = warm_up_voicebank(vb, &ctx);
+    if (result == 0) {
+        perf_count(&g_perf.voicebank_load_ns, (long long)(monotonic_ns() - t0));
+        perf_count(&g_perf.voicebank_loads, 1);
+        perf_count(&g_perf.voicebank_bytes, (long long)voicebank_bytes(vb));
+    }
+
+    pthread_mutex_lock(&g_bank_lock);
+    if (result == 0) {
+        vb->state = BANK_READY;
+        vb->last_used = ++g_bank_clock;
+        g_active = vb;
+        g_pool_stats.loads++;
+        enforce_voicebank_budget();
+    } else {
+        unload_voicebank(vb);
+        if (result == VSE_LOAD_CANCELLED) printf("C-Engine: [%s] の読み込みを中止しました\n", char_id);
+    }
+    pthread_mutex_unlock(&g_bank_lock);
+    return result;
+}
+
+// 実行中の読み込みをすべて中止させる（どのスレッドから呼んでもよい）
+EXPORT void vse_cancel_load(void) {
+    __atomic_fetch_add(&g_load_generation, 1, __ATOMIC_ACQ_REL);
+}
+
+/**
+ * 常駐しているキャラクターをアクティブにする（読み込みはしない）
+ * audio_dir が NULL の場合は char_id だけで探す
+ */
+EXPORT int vse_activate_character(const char* char_id, const char* audio_dir) {
+    if (!char_id) return -1;
+    pthread_mutex_lock(&g_bank_lock);
+    Voicebank* vb = find_resident_bank(char_id, audio_dir);
+    if (vb) {
+        vb->last_used = ++g_bank_clock;
+        g_active = vb;
+        g_pool_stats.switches++;
+    }
+    pthread_mutex_unlock(&g_bank_lock);
+    return vb ? 0 : -1;
+}
+
+/**
+ * キャラクターの音源をメモリから外す（次の init_engine で読み込み直す）
+ * 合成中のものは外さない。戻り値: 外した数
+ */
+EXPORT int vse_unload_character(const char* char_id) {
+    int unloaded = 0;
+    if (!char_id) return 0;
+    pthread_mutex_lock(&g_bank_lock);
+    for (int i = 0; i < MAX_RESIDENT_BANKS; i++) {
+        Voicebank* vb = &g_banks[i];
+        if (vb->state == BANK_READY && vb->users == 0 && strcmp(vb->char_id, char_id) == 0) {
+            unload_voicebank(vb);
+            unloaded++;
+        }
+    }
+    pthread_mutex_unlock(&g_bank_lock);
+    return unloaded;
+}
+
+/**
+ * 常駐させる音源のメモリ上限（バイト）。超えた分は古いものから外す
+ */
+EXPORT void vse_set_voicebank_budget(size_t bytes) {
+    pthread_mutex_lock(&g_bank_lock);
+    g_bank_budget = bytes;
+    enforce_voicebank_budget();
+    pthread_mutex_unlock(&g_bank_lock);
+}
+
+EXPORT void vse_get_voicebank_pool_stats(VsePoolStats* out) {
+    if (!out) return;
+    pthread_mutex_lock(&g_bank_lock);
+    *out = g_pool_stats;
+    out->resident = 0;
+    out->bytes = 0;
+    for (int i = 0; i < MAX_RESIDENT_BANKS; i++) {
+        if (g_banks[i].state != BANK_READY) continue;
+        out->resident++;
+        out->bytes += voicebank_bytes(&g_banks[i]);
+    }
+    out->budget = g_bank_budget;
+    pthread_mutex_unlock(&g_bank_lock);
+}
+
+/**
+ * audio_dir の WAV をすべてデコードし、1つの音源パック out_path にまとめる
+ * 多チャンネルのWAVはモノラルにまとめる
+ * 戻り値: 書き込んだ音素数。失敗時は -1
+ */
+EXPORT int vse_compile_voicebank(const char* audio_dir, const char* out_path) {
+    DIR *dir = opendir(audio_dir);
+    if (!dir) return -1;
+
+    int cap = 64, cnt = 0;
+    VsePackEntry* entries = (VsePackEntry*)calloc(cap, sizeof(VsePackEntry));
+    float** datas = (float**)calloc(cap, sizeof(float*));
+    int result = -1;
+    FILE* fp = NULL;
+    struct dirent *ent;
+
+    while (entries && datas && (ent = readdir(dir)) != NULL) {
+        size_t name_len = strlen(ent->d_name);
+        if (!ends_with(ent->d_name, ".wav") || name_len - 4 >= MAX_PHONEME_NAME) continue;
+
+        char path[512];
+        snprintf(path, sizeof(path), "%s/%s", audio_dir, ent->d_name);
+        unsigned int sr;
+        drwav_uint64 frames;
+        float* data = decode_wav_file_mono(path, &frames, &sr);
+        if (!data) continue;
+
+        if (cnt == cap) {
+            cap *= 2;
+            VsePackEntry* grown_e = (VsePackEntry*)realloc(entries, sizeof(VsePackEntry) * cap);
+            float** grown_d = (float**)realloc(datas, sizeof(float*) * cap);
+            if (grown_e) entries = grown_e;
+            if (grown_d) datas = grown_d;
+            if (!grown_e || !grown_d) {
+                drwav_free(data, NULL);
+                goto cleanup;
+            }
+        }
+        memset(&entries[cnt], 0, sizeof(VsePackEntry));
+        memcpy(entries[cnt].name, ent->d_name, name_len - 4);
+        entries[cnt].frames = frames;
+        entries[cnt].sample_rate = sr;
+        datas[cnt] = data;
+        cnt++;
+    }
+    if (!entries || !datas) goto cleanup;
+
+    // 音素データの配置を決める
+    VsePackHeader header;
+    memset(&header, 0, sizeof(header));
+    memcpy(header.magic, VSE_PACK_MAGIC, 8);
+    header.version = VSE_PACK_VERSION;
+    header.entry_count = (uint32_t)cnt;
+    header.index_offset = sizeof(VsePackHeader);
+    header.alignment = VSE_PACK_ALIGN;
+    uint64_t pos = header.index_offset + sizeof(VsePackEntry) * (uint64_t)cnt;
+    pos = (pos + VSE_PACK_ALIGN - 1) / VSE_PACK_ALIGN * VSE_PACK_ALIGN;
+    header.data_offset = pos;
+    for (int i = 0; i < cnt; i++) {
+        entries[i].offset = pos;
+        pos += entries[i].frames * sizeof(float);
+        pos = (pos + VSE_PACK_ALIGN - 1) / VSE_PACK_ALIGN * VSE_PACK_ALIGN;
+    }
+
+    fp = fopen(out_path, "wb");
+    if (!fp) goto cleanup;
+    static const char zeros[VSE_PACK_ALIGN] = {0};
+    uint64_t written = 0;
+    written += fwrite(&header, 1, sizeof(header), fp);
+    written += fwrite(entries, 1, sizeof(VsePackEntry) * cnt, fp);
+    for (int i = 0; i < cnt; i++) {
+        written += fwrite(zeros, 1, (size_t)(entries[i].offset - written), fp);
+        written += fwrite(datas[i], 1, (size_t)(entries[i].frames * sizeof(float)), fp);
+    }
+    int write_failed = ferror(fp);
+    if (fclose(fp) == 0 && !write_failed) {
+        result = cnt;
+        printf("C-Engine: %d 音素を %s にまとめました\n", cnt, out_path);
+    }
+    fp = NULL;
+
+cleanup:
+    if (fp) fclose(fp);
+    for (int i = 0; i < cnt; i++) drwav_free(datas[i], NULL);
+    free(entries);
+    free(datas);
+    closedir(dir);
+    return result;
+}
+
+/**
+ * 次の init_engine からの読み込みモード（VSE_LOAD_EAGER / VSE_LOAD_MMAP）
+ */
+EXPORT void vse_set_load_mode(int mode) {
+    g_load_mode = mode == VSE_LOAD_MMAP ? VSE_LOAD_MMAP : VSE_LOAD_EAGER;
+}
+
+// アクティブなキャラクターの読み込み済みの音素数 / 登録されている音素数
+EXPORT int vse_get_loaded_phoneme_count(int* total) {
+    int loaded = 0;
+    Voicebank* vb = bank_acquire_active();
+    if (total) *total = vb ? vb->lib_cnt : 0;
+    for (int i = 0; vb && i < vb->lib_cnt; i++) {
+        loaded += __atomic_load_n(&vb->lib[i].loaded, __ATOMIC_RELAXED);
+    }
+    bank_release(vb);
+    return loaded;
+}
+
+// 別名・代用音素はアクティブなキャラクターに登録する
+// 合成スレッドはロックなしで同じテーブルを引くので、登録は g_bank_lock の中で1つずつ行う（name_map_put を参照）
+static int add_phoneme_name(int fallback, const char* name, const char* target) {
+    Voicebank* vb = bank_acquire_active();
+    int result = -1;
+    if (vb) {
+        pthread_mutex_lock(&g_bank_lock);
+        int idx = resolve_phoneme_index(vb, target);
+        if (idx >= 0) result = name_map_put(fallback ? &vb->fallback : &vb->alias, name, idx);
+        pthread_mutex_unlock(&g_bank_lock);
+    }
+    bank_release(vb);
+    return result;
+}
+
+EXPORT int vse_add_phoneme_alias(const char* alias, const char* target) {
+    return add_phoneme_name(0, alias, target);
+}
+
+EXPORT int vse_add_phoneme_fallback(const char* name, const char* fallback) {
+    return add_phoneme_name(1, name, fallback);
+}
+
+EXPORT void vse_get_lookup_stats(VseLookupStats* out) {
+    if (out) *out = g_lookup_stats;
+}
+
+EXPORT int vse_get_missing_phoneme_count(void) {
+    return g_ph_missing.count;
+}
+
+EXPORT long long vse_get_missing_phoneme(int index, char* name_buf, int buf_len) {
+    long long count = 0;
+    if (!name_buf || buf_len <= 0) return 0;
+    pthread_mutex_lock(&g_missing_lock);
+    for (int i = 0; index >= 0 && index < g_ph_missing.count && i < NAME_MAP_SIZE; i++) {
+        NameSlot* slot = &g_ph_missing.slots[i];
+        if (slot->used && slot->value == index) {
+            snprintf(name_buf, buf_len, "%s", slot->name);
+            count = g_miss_counts[index];
+            break;
+        }
+    }
+    pthread_mutex_unlock(&g_missing_lock);
+    return count;
+}
+
+EXPORT void vse_reset_lookup_stats(void) {
+    pthread_mutex_lock(&g_missing_lock);
+    memset(&g_lookup_stats, 0, sizeof(g_lookup_stats));
+    memset(g_miss_counts, 0, sizeof(g_miss_counts));
+    name_map_clear(&g_ph_missing);
+    pthread_mutex_unlock(&g_missing_lock);
+}
+
+// --- 合成核心部 ---
+#define ENGINE_SAMPLE_RATE 44100
+
+// --- 合成用の作業領域（スクラッチアリーナ） ---
+// 合成中の一時バッファ（リサンプル結果・ノートの検索結果・区間のピッチカーブなど）は malloc せず、
+// 合成ごとに使い回すアリーナから切り出す。足りなければその場で確保し、次のリセットで
+// 最大使用量が入る大きさに広げるので、同じくらいの合成を続けるとヒープ確保は 0 回になる。
+// アリーナはスレッドをまたいで共有しない（合成の呼び出し元と、ワーカーごとに1つずつ）。
+#define SCRATCH_ALIGN 64                        // 切り出す大きさの単位（キャッシュライン）
+#define SCRATCH_MIN_BYTES (256 * 1024)          // 最初に確保する大きさ
+#define SCRATCH_RETAIN_BYTES (16 * 1024 * 1024) // プールに戻すときにこれより大きければ手放す
+#define SCRATCH_POOL_SIZE 8                     // 使い回すために取っておくアリーナの数
+
+typedef struct ScratchBlock {
+    struct ScratchBlock* next;   // 先に確保したもの
+    size_t mark;                 // 確保したときの使用量（これより前まで巻き戻したら解放する）
+    size_t bytes;                // ブロック全体の大きさ
+} ScratchBlock;
+
+typedef struct {
+    char* base;             // 普段使う領域
+    size_t cap;
+    size_t used;            // 使用量（base からあふれた分も含む）
+    size_t high;            // 前回のリセットからの最大使用量
+    ScratchBlock* overflow; // base に入らなかった分（新しい順）
+    long long allocs;       // このアリーナを使った合成でのヒープ確保回数（ワーカーの分も足す）
+    long long counted;      // allocs のうち統計に入れた分
+} ScratchArena;
+
+static VseScratchStats g_scratch_stats;
+static ScratchArena* g_scratch_pool[SCRATCH_POOL_SIZE];
+static int g_scratch_pool_cnt = 0;
+static pthread_mutex_t g_scratch_lock = PTHREAD_MUTEX_INITIALIZER;  // 統計（reserved_bytes 以外）とプールを守る
+
+static void scratch_reserved_add(long long bytes) {
+    __atomic_fetch_add(&g_scratch_stats.reserved_bytes, bytes, __ATOMIC_RELAXED);
+}
+
+// bytes を切り出す。中身は不定。失敗時 NULL
+static void* scratch_alloc(ScratchArena* a, size_t bytes) {
+    bytes = (bytes + SCRATCH_ALIGN - 1) & ~(size_t)(SCRATCH_ALIGN - 1);
+    void* p;
+    if (!a->overflow && a->used + bytes <= a->cap) {
+        p = a->base + a->used;
+    } else {
+        uint64_t t0 = monotonic_ns();
+        ScratchBlock* b = (ScratchBlock*)malloc(SCRATCH_ALIGN + bytes);
+        perf_add(VSE_STAGE_ALLOC, t0);
+        if (!b) return NULL;
+        b->next = a->overflow;
+        b->mark = a->used;
+        b->bytes = SCRATCH_ALIGN + bytes;
+        a->overflow = b;
+        a->allocs++;
+        scratch_reserved_add((long long)b->bytes);
+        p = (char*)b + SCRATCH_ALIGN;
+    }
+    a->used += bytes;
+    if (a->used > a->high) a->high = a->used;
+    return p;
+}
+
+// アリーナがあればそこから、なければ malloc で確保する（合成以外からも呼ばれる処理用）
+static void* scratch_or_malloc(ScratchArena* a, size_t bytes) {
+    return a ? scratch_alloc(a, bytes) : malloc(bytes);
+}
+
+// 使用量を mark（切り出す前の used）まで巻き戻す。それ以降に切り出した領域は使えなくなる
+static void scratch_rewind(ScratchArena* a, size_t mark) {
+    while (a->overflow && a->overflow->mark >= mark) {
+        ScratchBlock* b = a->overflow;
+        a->overflow = b->next;
+        scratch_reserved_add(-(long long)b->bytes);
+        free(b);
+    }
+    a->used = mark;
+}
+
+/**
+ * 次の合成のために空にする
+ * 前回 base からあふれていれば、最大使用量が入る大きさに広げ直す（次からはあふれない）
+ */
+static void scratch_reset(ScratchArena* a) {
+    scratch_rewind(a, 0);
+    if (a->high > a->cap) {
+        size_t cap = a->cap > 0 ? a->cap : SCRATCH_MIN_BYTES;
+        while (cap < a->high) cap *= 2;
+        uint64_t t0 = monotonic_ns();
+        char* grown = (char*)malloc(cap);
+        perf_add(VSE_STAGE_ALLOC, t0);
+        if (grown) {
+            free(a->base);
+            scratch_reserved_add((long long)cap - (long long)a->cap);
+            a->base = grown;
+            a->cap = cap;
+            a->allocs++;
+        }
+    }
+    a->high = 0;
+}
+
+// 前回のリセットからの最大使用量を統計の peak_bytes に反映する
+static void scratch_note_peak(const ScratchArena* a) {
+    long long high = (long long)a->high;
+    long long peak = __atomic_load_n(&g_scratch_stats.peak_bytes, __ATOMIC_RELAXED);
+    while (high > peak && !__atomic_compare_exchange_n(&g_scratch_stats.peak_bytes, &peak, high, 1,
+                                                       __ATOMIC_RELAXED, __ATOMIC_RELAXED)) {
+    }
+}
+
+static void scratch_free(ScratchArena* a) {
+    scratch_rewind(a, 0);
+    free(a->base);
+    scratch_reserved_add(-(long long)a->cap);
+    a->base = NULL;
+    a->cap = 0;
+    a->high = 0;
+}
+
+// 合成1回分が終わったときに呼ぶ。その間のヒープ確保回数を統計に入れる
+static void scratch_finish_render(ScratchArena* a) {
+    long long allocs = a->allocs - a->counted;
+    a->counted = a->allocs;
+    scratch_note_peak(a);
+    pthread_mutex_lock(&g_scratch_lock);
+    g_scratch_stats.renders++;
+    g_scratch_stats.heap_allocs += allocs;
+    g_scratch_stats.last_render_allocs = allocs;
+    if (allocs > g_scratch_stats.max_render_allocs) g_scratch_stats.max_render_allocs = allocs;
+    if (allocs == 0) g_scratch_stats.zero_alloc_renders++;
+    pthread_mutex_unlock(&g_scratch_lock);
+}
+
+// 合成1回分のアリーナをプールから借りる（なければ作る）。失敗時 NULL
+static ScratchArena* scratch_acquire(void) {
+    ScratchArena* a = NULL;
+    pthread_mutex_lock(&g_scratch_lock);
+    if (g_scratch_pool_cnt > 0) a = g_scratch_pool[--g_scratch_pool_cnt];
+    pthread_mutex_unlock(&g_scratch_lock);
+    if (!a) {
+        a = (ScratchArena*)calloc(1, sizeof(ScratchArena));
+        if (!a) return NULL;
+        a->allocs = 1;
+    }
+    scratch_reset(a);
+    return a;
+}
+
+// 借りたアリーナを返す。大きくなりすぎたものは領域を手放してから戻す
+static void scratch_release(ScratchArena* a) {
+    if (!a) return;
+    scratch_rewind(a, 0);
+    if (a->cap > SCRATCH_RETAIN_BYTES) scratch_free(a);
+    pthread_mutex_lock(&g_scratch_lock);
+    if (g_scratch_pool_cnt < SCRATCH_POOL_SIZE) {
+        g_scratch_pool[g_scratch_pool_cnt++] = a;
+        a = NULL;
+    }
+    pthread_mutex_unlock(&g_scratch_lock);
+    if (a) {
+        scratch_free(a);
+        free(a);
+    }
+}
+
+static void scratch_pool_free(void) {
+    pthread_mutex_lock(&g_scratch_lock);
+    for (int i = 0; i < g_scratch_pool_cnt; i++) {
+        scratch_free(g_scratch_pool[i]);
+        free(g_scratch_pool[i]);
+    }
+    g_scratch_pool_cnt = 0;
+    pthread_mutex_unlock(&g_scratch_lock);
+}
+
+/**
+ * 作業領域の統計（合成ごとのヒープ確保回数など）
+ */
+EXPORT void vse_get_scratch_stats(VseScratchStats* out) {
+    if (!out) return;
+    pthread_mutex_lock(&g_scratch_lock);
+    *out = g_scratch_stats;
+    pthread_mutex_unlock(&g_scratch_lock);
+    out->reserved_bytes = __atomic_load_n(&g_scratch_stats.reserved_bytes, __ATOMIC_RELAXED);
+    out->peak_bytes = __atomic_load_n(&g_scratch_stats.peak_bytes, __ATOMIC_RELAXED);
+}
+
+// 回数と最大値をリセットする（確保中の量 reserved_bytes はそのまま）
+EXPORT void vse_reset_scratch_stats(void) {
+    pthread_mutex_lock(&g_scratch_lock);
+    g_scratch_stats.renders = 0;
+    g_scratch_stats.heap_allocs = 0;
+    g_scratch_stats.last_render_allocs = 0;
+    g_scratch_stats.max_render_allocs = 0;
+    g_scratch_stats.zero_alloc_renders = 0;
+    __atomic_store_n(&g_scratch_stats.peak_bytes, 0, __ATOMIC_RELAXED);
+    pthread_mutex_unlock(&g_scratch_lock);
+}
+
+// --- ピッチカーブ（制御レート） ---
+// ピッチベンドのイベント列を、PITCH_CONTROL_BLOCK サンプルごとの再生速度の倍率に一度だけ展開しておく。
+// 音素ごとの処理はイベント列を探さず、自分の区間のブロックを添字で参照するだけになる。
+#define PITCH_CONTROL_BLOCK 64       // 44100Hz で約 1.45ms ごと
+#define PITCH_BEND_RANGE 2.0f        // ±8192 で ±2 半音（MIDI の標準）
+
+typedef struct {
+    int first_block;   // 最初のブロックのタイムライン上の番号（区間だけ合成するときは 0 とは限らない）
+    int block_cnt;
+    float* ratio;      // ブロックごとの倍率 2^(半音/12)（ratio[k] がブロック first_block + k）
+    double* prefix;    // prefix[k] = ブロック first_block + k の先頭までの倍率の累積（block_cnt + 1 個）
+    int* changes;      // changes[b] = ブロック 1..b のうち直前と倍率が変わった数（区間が一定かの判定用）
+    int in_scratch;    // 作業領域から切り出した（pitch_contour_free では解放しない）
+} PitchContour;
+
+static int compare_pitch_time(const void* a, const void* b) {
+    float ta = ((const CPitchEvent*)a)->time, tb = ((const CPitchEvent*)b)->time;
+    return ta < tb ? -1 : (ta > tb ? 1 : 0);
+}
+
+static void pitch_contour_free(PitchContour* pc) {
+    if (!pc->in_scratch) {
+        free(pc->ratio);
+        free(pc->prefix);
+        free(pc->changes);
+    }
+    memset(pc, 0, sizeof(PitchContour));
+}
+
+/**
+ * タイムラインのサンプル [from, from + len) にかかるブロックのピッチカーブを作る
+ * ブロックの区切りと値はタイムラインの先頭から決まるので、どの区間で作っても重なる部分は同じ値になる
+ * イベントの間は線形補間し、最初のイベントより前・最後のイベントより後は値を保持する
+ * イベントがなければ何も確保せず、すべて倍率 1.0 として扱う。戻り値: 失敗時 -1
+ * scratch: 合成1回分だけ使う場合の作業領域（NULL なら malloc。pitch_contour_free で解放する）
+ */
+static int pitch_contour_build(PitchContour* pc, const CPitchEvent* events, int event_cnt, int from, int len,
+                               ScratchArena* scratch) {
+    memset(pc, 0, sizeof(PitchContour));
+    if (!events || event_cnt <= 0 || len <= 0) return 0;
+    if (from < 0) from = 0;
+    pc->in_scratch = scratch != NULL;
+    uint64_t perf_t0 = monotonic_ns();
+
+    // 時刻順に並んでいなければ並べ替えたコピーを使う
+    CPitchEvent* sorted = NULL;
+    for (int e = 1; e < event_cnt; e++) {
+        if (events[e].time < events[e - 1].time) {
+            sorted = (CPitchEvent*)scratch_or_malloc(scratch, sizeof(CPitchEvent) * event_cnt);
+            if (!sorted) return -1;
+            memcpy(sorted, events, sizeof(CPitchEvent) * event_cnt);
+            qsort(sorted, event_cnt, sizeof(CPitchEvent), compare_pitch_time);
+            events = sorted;
+            break;
+        }
+    }
+
+    int first = from / PITCH_CONTROL_BLOCK;
+    int blocks = (from + len + PITCH_CONTROL_BLOCK - 1) / PITCH_CONTROL_BLOCK - first;
+    pc->first_block = first;
+    pc->block_cnt = blocks;
+    pc->ratio = (float*)scratch_or_malloc(scratch, sizeof(float) * blocks);
+    pc->prefix = (double*)scratch_or_malloc(scratch, sizeof(double) * (blocks + 1));
+    pc->changes = (int*)scratch_or_malloc(scratch, sizeof(int) * blocks);
+    if (!pc->ratio || !pc->prefix || !pc->changes) {
+        if (!scratch) free(sorted);
+        pitch_contour_free(pc);
+        return -1;
+    }
+
+    // 最初のブロックの時刻までのイベントは二分探索で飛ばす（曲の後ろの区間でも先頭から数えない）
+    // そこからはブロックの時刻が単調に進むので、イベント側のカーソルも戻らない
+    float t0 = (float)((double)first * PITCH_CONTROL_BLOCK / ENGINE_SAMPLE_RATE);
+    int lo = 0, hi = event_cnt;
+    while (lo < hi) {
+        int mid = (lo + hi) / 2;
+        if (events[mid].time <= t0) lo = mid + 1;
+        else hi = mid;
+    }
+    int cursor = lo;
+    pc->prefix[0] = 0.0;
+    for (int b = 0; b < blocks; b++) {
+        float t = (float)((double)(first + b) * PITCH_CONTROL_BLOCK / ENGINE_SAMPLE_RATE);
+        while (cursor < event_cnt && events[cursor].time <= t) cursor++;
+
+        float value;
+        if (cursor == 0) {
+            value = (float)events[0].value;
+        } else if (cursor == event_cnt) {
+            value = (float)events[event_cnt - 1].value;
+        } else {
+            const CPitchEvent* e0 = &events[cursor - 1];
+            const CPitchEvent* e1 = &events[cursor];
+            float span = e1->time - e0->time;
+            float w = span > 0.0f ? (t - e0->time) / span : 0.0f;
+            value = e0->value + (e1->value - e0->value) * w;
+        }
+        float semitones = value / 8192.0f * PITCH_BEND_RANGE;
+        pc->ratio[b] = value == 0.0f ? 1.0f : powf(2.0f, semitones / 12.0f);
+        pc->prefix[b + 1] = pc->prefix[b] + (double)pc->ratio[b] * PITCH_CONTROL_BLOCK;
+        pc->changes[b] = b > 0 ? pc->changes[b - 1] + (pc->ratio[b] != pc->ratio[b - 1]) : 0;
+    }
+    if (!scratch) free(sorted);
+    perf_add(VSE_STAGE_PITCH, perf_t0);
+    return 0;
+}
+
+// タイムライン上のサンプル位置 t までの倍率の累積（= 倍率を掛けた経過サンプル数）
+// 原点はカーブの最初のブロックだが、使うのは2点の差だけなので作った区間によらず同じ値になる
+static inline double pitch_contour_position(const PitchContour* pc, int t) {
+    int b = t / PITCH_CONTROL_BLOCK;
+    int k = b - pc->first_block;
+    return pc->prefix[k] + (double)(t - b * PITCH_CONTROL_BLOCK) * pc->ratio[k];
+}
+
+/**
+ * [start, start + len) の倍率が一定なら 1 を返し、*rate にその倍率を入れる
+ * ピッチカーブがない場合は常に 1.0 で一定
+ */
+static int pitch_contour_constant(const PitchContour* pc, int start, int len, float* rate) {
+    if (!pc || pc->block_cnt == 0) {
+        *rate = 1.0f;
+        return 1;
+    }
+    int b0 = start / PITCH_CONTROL_BLOCK - pc->first_block;
+    int b1 = (start + len - 1) / PITCH_CONTROL_BLOCK - pc->first_block;
+    *rate = pc->ratio[b0];
+    return pc->changes[b1] == pc->changes[b0];
+}
+
+/**
+ * ピッチカーブに沿って読み取り速度を変えながらリサンプルする（出力の [from, from + count) だけ）
+ * note_start: 音素の先頭のタイムライン上の位置。読み取り位置は先頭からの倍率の累積で決まるので、
+ * どの区間から計算しても同じ値になる。元の波形を読み切ったあとは無音
+ */
+static void resample_contour_range(int quality, const float* input, int input_len, float* output, int output_len,
+                                   const PitchContour* pc, int note_start, int from, int count) {
+    double step = output_len > 1 ? (double)(input_len - 1) / (output_len - 1) : 0.0;
+    double base = pitch_contour_position(pc, note_start);
+
+    // sinc の場合は音素の中で最も速く読む箇所に合わせて遮断周波数を決める（区間の切り方によらず同じ）
+    const SincTable* table = NULL;
+    if (quality != VSE_RESAMPLE_LINEAR) {
+        float max_ratio = 0.0f;
+        int b1 = (note_start + output_len - 1) / PITCH_CONTROL_BLOCK - pc->first_block;
+        for (int b = note_start / PITCH_CONTROL_BLOCK - pc->first_block; b <= b1; b++) {
+            if (pc->ratio[b] > max_ratio) max_ratio = pc->ratio[b];
+        }
+        table = sinc_table_get(quality, step * max_ratio);
+    }
+
+    for (int k = 0; k < count; k++) {
+        double t = step * (pitch_contour_position(pc, note_start + from + k) - base);
+        if (table) {
+            output[k] = t < input_len ? sinc_sample(table, input, input_len, t) : 0.0f;
+            continue;
+        }
+        int t_int = (int)t;
+        float t_frac = (float)(t - t_int);
+        if (t_int + 1 < input_len) {
+            output[k] = input[t_int] * (1.0f - t_frac) + input[t_int + 1] * t_frac;
+        } else if (t_int < input_len) {
+            output[k] = input[t_int];
+        } else {
+            output[k] = 0.0f;
+        }
+    }
+}
+
+// 1回の合成で共通の設定
+typedef struct {
+    Voicebank* vb;             // 音素を探すキャラクター（呼び出し側で bank_acquire_active しておく）
+    const PitchContour* pc;    // 合成するノートにかかる区間のピッチカーブ。NULL ならピッチベンドなし
+    int quality;               // VSE_RESAMPLE_*
+    const int* latest;         // 中止の判定用。*latest が generation と違ったら途中でやめる（NULL なら最後まで合成する）
+    int generation;
+} RenderContext;
+
+// 新しい世代の合成に置き換えられたか（ノート・音素ごとに確認する）
+static inline int render_cancelled(const RenderContext* rc) {
+    return rc->latest && __atomic_load_n(rc->latest, __ATOMIC_ACQUIRE) != rc->generation;
+}
+
+// 音素のつなぎ目の等パワークロスフェード（5ms）の係数表。最初に使うときに1回だけ作る
+#define PHONEME_FADE_LEN (ENGINE_SAMPLE_RATE * 5 / 1000)
+
+static FadeTable g_phoneme_fade;
+static pthread_once_t g_phoneme_fade_once = PTHREAD_ONCE_INIT;
+
+static void phoneme_fade_init(void) {
+    if (fade_table_init(&g_phoneme_fade, PHONEME_FADE_LEN) != 0) {
+        printf("C-Engine: クロスフェードの係数表を確保できません\n");
+    }
+}
+
+static const FadeTable* phoneme_fade_table(void) {
+    pthread_once(&g_phoneme_fade_once, phoneme_fade_init);
+    return &g_phoneme_fade;
+}
+
+static int clamp_quality(int quality) {
+    return quality == VSE_RESAMPLE_SINC_FAST || quality == VSE_RESAMPLE_SINC_BEST ? quality : VSE_RESAMPLE_LINEAR;
+}
+
+// キャッシュを使わずにリサンプルするときの作業バッファの長さ（長い音素はこの長さずつ処理する）
+#define RENDER_SCRATCH_FRAMES 4096
+
+/**
+ * タイムライン上の [region_start, region_start + region_len) の区間だけを合成する
+ * rc: キャラクター・ピッチカーブ・リサンプル品質
+ * scratch: 作業バッファを切り出すアリーナ（このスレッド専用のもの）
+ * idx: 対象にするノートの添字（昇順）。NULL の場合は全ノート
+ * origin: タイムラインの原点（秒）。ノート位置はここからの相対で計算する
+ * total_len: タイムライン全体の長さ。はみ出すノートは従来通りスキップする
+ * out: 区間の先頭を指す出力バッファ（呼び出し側で 0 クリアしておく）
+ *
+ * ノートは添字順、音素は先頭から順にサンプル単位で重ねていくので、
+ * 区間をどう分割して呼び出しても全体を一度に合成した結果と一致する。
+ */
+static void render_notes_region(const RenderContext* rc, ScratchArena* scratch, const CNoteEvent* notes,
+                                const int* idx, int idx_cnt, float origin,
+                                int region_start, int region_len, int total_len, float* out) {
+    int sr = ENGINE_SAMPLE_RATE;
+    const FadeTable* fade = phoneme_fade_table();
+    int region_end = region_start + region_len;
+    float* tmp = NULL;
+    VseStageStat perf[VSE_STAGE_COUNT] = {{0}};  // 終わったときにまとめて g_perf に足す
+
+    for (int n = 0; n < idx_cnt; n++) {
+        if (render_cancelled(rc)) goto done;
+        int i = idx ? idx[n] : n;
+        int n_start = (int)((notes[i].start_time - origin) * sr);
+        int n_len = (int)(notes[i].duration * sr);
+        if (n_start < 0 || n_start + n_len > total_len || notes[i].phoneme_count == 0) continue;
+        if (n_start >= region_end || n_start + n_len <= region_start) continue;
+
+        int ph_len = n_len / notes[i].phoneme_count;
+        for (int p = 0; p < notes[i].phoneme_count; p++) {
+            int current_p = n_start + (p * ph_len);
+            // 区間と重なる部分だけを計算する
+            int from = region_start > current_p ? region_start - current_p : 0;
+            int to = region_end < current_p + ph_len ? region_end - current_p : ph_len;
+            if (from >= to) continue;
+            if (p > 0 && render_cancelled(rc)) goto done;
+
+            uint64_t t = monotonic_ns();
+            Phoneme* target = find_phoneme(rc->vb, notes[i].phonemes[p]);
+            int loaded = target && phoneme_ensure_loaded(target);
+            t = perf_lap(perf, VSE_STAGE_LOOKUP, t);
+            if (!loaded) continue;
+
+            // 2つ目以降の音素は前後をクロスフェードし、最初の音素は上書きする
+            int count = to - from;
+            int crossfade = p > 0;
+            float amp = notes[i].velocity / 127.0f;
+            float* dest = &out[current_p + from - region_start];
+            float rate;
+            int constant = pitch_contour_constant(rc->pc, current_p, ph_len, &rate);
+            if (constant) {
+                // 倍率が一定の音素はキャッシュを使う（ピッチベンドなしは倍率 1.0）
+                CacheEntry* cached = cache_acquire(target, ph_len, rate, rc->quality, &scratch->allocs);
+                t = perf_lap(perf, VSE_STAGE_CACHE, t);
+                if (cached) {
+                    mix_span(dest, cached->samples + from, amp, ph_len, from, count, fade, crossfade);
+                    cache_release(cached);
+                    perf_lap(perf, VSE_STAGE_MIX, t);
+                    continue;
+                }
+                if (rc->quality == VSE_RESAMPLE_LINEAR) {
+                    // 線形補間はリサンプルも同じループで行う
+                    mix_linear_rate(dest, target->samples, (int)target->count, rate, amp, ph_len, from, count,
+                                    fade, crossfade);
+                    perf_lap(perf, VSE_STAGE_MIX, t);
+                    continue;
+                }
+            }
+
+            if (!tmp) {
+                tmp = (float*)scratch_alloc(scratch, sizeof(float) * RENDER_SCRATCH_FRAMES);
+                if (!tmp) continue;
+            }
+            // リサンプルもミックスも位置ごとに決まるので、区切って処理しても結果は同じ
+            for (int k = 0; k < count; k += RENDER_SCRATCH_FRAMES) {
+                int len = count - k < RENDER_SCRATCH_FRAMES ? count - k : RENDER_SCRATCH_FRAMES;
+                if (constant) {
+                    resample_phoneme_range(rc->quality, target, tmp, ph_len, rate, from + k, len);
+                } else {
+                    resample_contour_range(rc->quality, target->samples, (int)target->count, tmp, ph_len,
+                                           rc->pc, current_p, from + k, len);
+                }
+                t = perf_lap(perf, VSE_STAGE_RESAMPLE, t);
+                mix_span(dest + k, tmp, amp, ph_len, from + k, len, fade, crossfade);
+                t = perf_lap(perf, VSE_STAGE_MIX, t);
+            }
+        }
+    }
+done:
+    perf_flush(perf);
+}
+
+// --- マルチスレッド合成 ---
+// 区間をチャンクに分け、ワーカースレッドと呼び出し元スレッドで並列に合成する。
+// 各チャンクは自分の範囲にかかるノートを（途中から始まるクロスフェードも含めて）すべて自分で合成するので、
+// つなぎ目も含めて、スレッド数に関係なく1スレッドで合成した結果とビット単位で一致する。
+#define MAX_RENDER_THREADS 64
+#define MIN_CHUNK_SAMPLES 8192   // これより細かくは分けない
+
+typedef struct {
+    const RenderContext* rc;
+    const CNoteEvent* notes;
+    const int* idx;
+    int idx_cnt;
+    float origin;
+    int region_start;
+    int region_len;
+    int total_len;
+    float* out;
+    int chunk_len;
+    int chunk_cnt;
+    int next_chunk;    // 次に取るチャンク（アトミックに進める）
+    int done_chunks;   // 終わったチャンク数（g_pool_lock で守る）
+    int active;        // このジョブを処理中のワーカー数（g_pool_lock で守る）
+    long long allocs;  // ワーカーのアリーナでのヒープ確保回数（g_pool_lock で守る）
+} RenderJob;
+
+static int g_thread_count = 0;   // 0 = 自動（CPUコア数）
+static pthread_t g_workers[MAX_RENDER_THREADS];
+static ScratchArena g_worker_scratch[MAX_RENDER_THREADS];  // ワーカーごとの作業領域
+static int g_worker_cnt = 0;
+static int g_pool_shutdown = 0;
+static RenderJob* g_pool_job = NULL;
+static unsigned g_pool_job_seq = 0;
+static pthread_mutex_t g_pool_lock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t g_pool_wake = PTHREAD_COND_INITIALIZER;
+static pthread_cond_t g_pool_done = PTHREAD_COND_INITIALIZER;
+static pthread_mutex_t g_render_lock = PTHREAD_MUTEX_INITIALIZER;  // プールを使う合成は同時に1つまで
+
+static int cpu_count(void) {
+#ifdef _WIN32
+    SYSTEM_INFO info;
+    GetSystemInfo(&info);
+    return (int)info.dwNumberOfProcessors;
+#else
+    long n = sysconf(_SC_NPROCESSORS_ONLN);
+    return n > 0 ? (int)n : 1;
+#endif
+}
+
+static int effective_thread_count(void) {
+    int n = g_thread_count > 0 ? g_thread_count : cpu_count();
+    return n > MAX_RENDER_THREADS ? MAX_RENDER_THREADS : n;
+}
+
+// チャンクごとに scratch を呼び出し時の使用量まで巻き戻す
+static void run_job_chunks(RenderJob* job, ScratchArena* scratch) {
+    size_t mark = scratch->used;
+    int done = 0;
+    for (;;) {
+        int c = __atomic_fetch_add(&job->next_chunk, 1, __ATOMIC_RELAXED);
+        if (c >= job->chunk_cnt) break;
+        int a = c * job->chunk_len;
+        int len = job->region_len - a < job->chunk_len ? job->region_len - a : job->chunk_len;
+        render_notes_region(job->rc, scratch, job->notes, job->idx, job->idx_cnt, job->origin,
+                            job->region_start + a, len, job->total_len, job->out + a);
+        scratch_rewind(scratch, mark);
+        done++;
+    }
+    pthread_mutex_lock(&g_pool_lock);
+    job->done_chunks += done;
+    if (job->done_chunks == job->chunk_cnt) pthread_cond_broadcast(&g_pool_done);
+    pthread_mutex_unlock(&g_pool_lock);
+}
+
+static void* render_worker(void* arg) {
+    ScratchArena* scratch = &g_worker_scratch[(intptr_t)arg];
+    unsigned seen = 0;
+    pthread_mutex_lock(&g_pool_lock);
+    for (;;) {
+        while (!g_pool_shutdown && (g_pool_job == NULL || g_pool_job_seq == seen)) {
+            pthread_cond_wait(&g_pool_wake, &g_pool_lock);
+        }
+        if (g_pool_shutdown) break;
+        seen = g_pool_job_seq;
+        RenderJob* job = g_pool_job;
+        job->active++;
+        pthread_mutex_unlock(&g_pool_lock);
+
+        long long allocs = scratch->allocs;
+        scratch_reset(scratch);
+        run_job_chunks(job, scratch);
+        scratch_note_peak(scratch);
+
+        pthread_mutex_lock(&g_pool_lock);
+        job->allocs += scratch->allocs - allocs;
+        job->active--;
+        if (job->active == 0) pthread_cond_broadcast(&g_pool_done);
+    }
+    pthread_mutex_unlock(&g_pool_lock);
+    return NULL;
+}
+
+static void pool_stop(void) {
+    pthread_mutex_lock(&g_pool_lock);
+    g_pool_shutdown = 1;
+    pthread_cond_broadcast(&g_pool_wake);
+    pthread_mutex_unlock(&g_pool_lock);
+    for (int i = 0; i < g_worker_cnt; i++) {
+        pthread_join(g_workers[i], NULL);
+        scratch_free(&g_worker_scratch[i]);
+    }
+    g_worker_cnt = 0;
+    g_pool_shutdown = 0;
+}
+
+// ワーカー数を合わせる（g_render_lock を持って呼ぶ）
+static void pool_ensure(int workers) {
+    if (workers == g_worker_cnt) return;
+    pool_stop();
+    for (int i = 0; i < workers; i++) {
+        if (pthread_create(&g_workers[g_worker_cnt], NULL, render_worker, (void*)(intptr_t)g_worker_cnt) != 0) break;
+        g_worker_cnt++;
+    }
+}
+
+// 最初の合成でスレッド生成を待たないよう、ワーカーを先に起こしておく
+static void render_pool_warm_up(void) {
+    int threads = effective_thread_count();
+    if (threads <= 1 || pthread_mutex_trylock(&g_render_lock) != 0) return; // 使用中なら起動済み
+    pool_ensure(threads - 1);
+    pthread_mutex_unlock(&g_render_lock);
+}
+
+// render_notes_region の並列版。短い区間や、他の合成がプールを使用中のときはこのスレッドだけで合成する
+// ワーカーのアリーナでのヒープ確保回数は scratch（呼び出し元の合成）の分として数える
+static void render_notes_parallel(const RenderContext* rc, ScratchArena* scratch, const CNoteEvent* notes,
+                                  const int* idx, int idx_cnt, float origin, int region_start, int region_len,
+                                  int total_len, float* out) {
+    int threads = effective_thread_count();
+    if (threads <= 1 || region_len < 2 * MIN_CHUNK_SAMPLES || pthread_mutex_trylock(&g_render_lock) != 0) {
+        size_t mark = scratch->used;
+        render_notes_region(rc, scratch, notes, idx, idx_cnt, origin, region_start, region_len, total_len, out);
+        scratch_rewind(scratch, mark);
+        return;
+    }
+    pool_ensure(threads - 1);  // 呼び出し元スレッドも合成に参加する
+
+    // 重いノートが偏っても均等になるよう、スレッド数より多めに分ける
+    int chunk_cnt = threads * 4;
+    if (chunk_cnt > region_len / MIN_CHUNK_SAMPLES) chunk_cnt = region_len / MIN_CHUNK_SAMPLES;
+    RenderJob job = {
+        .rc = rc, .notes = notes, .idx = idx, .idx_cnt = idx_cnt, .origin = origin,
+        .region_start = region_start, .region_len = region_len, .total_len = total_len, .out = out,
+        .chunk_len = (region_len + chunk_cnt - 1) / chunk_cnt, .chunk_cnt = chunk_cnt,
+    };
+    job.chunk_cnt = (region_len + job.chunk_len - 1) / job.chunk_len;
+
+    pthread_mutex_lock(&g_pool_lock);
+    g_pool_job = &job;
+    g_pool_job_seq++;
+    pthread_cond_broadcast(&g_pool_wake);
+    pthread_mutex_unlock(&g_pool_lock);
+
+    run_job_chunks(&job, scratch);
+
+    pthread_mutex_lock(&g_pool_lock);
+    while (job.done_chunks < job.chunk_cnt || job.active > 0) pthread_cond_wait(&g_pool_done, &g_pool_lock);
+    g_pool_job = NULL;
+    scratch->allocs += job.allocs;
+    pthread_mutex_unlock(&g_pool_lock);
+    pthread_mutex_unlock(&g_render_lock);
+}
+
+/**
+ * 合成に使うスレッド数（0 = CPUコア数）
+ */
+EXPORT void vse_set_thread_count(int count) {
+    g_thread_count = count < 0 ? 0 : count;
+}
+
+EXPORT int vse_get_thread_count(void) {
+    return effective_thread_count();
+}
+
+// --- ノートの区間インデックス ---
+// ノートを開始位置の順に並べ、先頭からの終了位置の最大値を持っておく。
+// [a, b) にかかるノートの候補は「開始 < b」と「それまでの終了の最大値 > a」の二分探索で決まるので、
+// 曲の後ろの区間を合成しても、曲の先頭から全ノートを調べ直さずに済む。
+typedef struct {
+    int count;
+    int* order;    // 開始位置の昇順に並べたノート添字
+    int* starts;   // order の順の開始サンプル
+    int* ends;     // order の順の終了サンプル
+    int* max_end;  // max_end[k] = ends[0..k] の最大値（単調増加）
+    int in_scratch;  // 作業領域から切り出した（note_index_free では解放しない）
+} NoteIndex;
+
+typedef struct {
+    int start;
+    int idx;
+} NoteStartKey;
+
+static int note_start_sample(const CNoteEvent* note) {
+    return (int)(note->start_time * ENGINE_SAMPLE_RATE);
+}
+
+static int note_end_sample(const CNoteEvent* note) {
+    return note_start_sample(note) + (int)(note->duration * ENGINE_SAMPLE_RATE);
+}
+
+static int compare_note_key(const void* a, const void* b) {
+    const NoteStartKey* ka = (const NoteStartKey*)a;
+    const NoteStartKey* kb = (const NoteStartKey*)b;
+    if (ka->start != kb->start) return ka->start < kb->start ? -1 : 1;
+    return ka->idx - kb->idx;
+}
+
+static int compare_int(const void* a, const void* b) {
+    int ia = *(const int*)a, ib = *(const int*)b;
+    return ia < ib ? -1 : (ia > ib ? 1 : 0);
+}
+
+static void note_index_free(NoteIndex* ix) {
+    if (!ix->in_scratch) free(ix->order);
+    memset(ix, 0, sizeof(NoteIndex));
+}
+
+// 戻り値: 失敗時 -1。ノートがすでに開始位置の順に並んでいれば並べ替えない（1回の走査で済む）
+// scratch: 合成1回分だけ使う場合の作業領域（NULL なら malloc。note_index_free で解放する）
+static int note_index_build(NoteIndex* ix, const CNoteEvent* notes, int cnt, ScratchArena* scratch) {
+    memset(ix, 0, sizeof(NoteIndex));
+    if (cnt <= 0) return 0;
+    ix->in_scratch = scratch != NULL;
+    uint64_t t0 = monotonic_ns();
+    ix->order = (int*)scratch_or_malloc(scratch, sizeof(int) * 4 * (size_t)cnt);
+    if (!ix->order) return -1;
+    ix->count = cnt;
+    ix->starts = ix->order + cnt;
+    ix->ends = ix->starts + cnt;
+    ix->max_end = ix->ends + cnt;
+
+    int sorted = 1;
+    for (int i = 0; i < cnt; i++) {
+        ix->order[i] = i;
+        ix->starts[i] = note_start_sample(&notes[i]);
+        if (i > 0 && ix->starts[i] < ix->starts[i - 1]) sorted = 0;
+    }
+    if (!sorted) {
+        NoteStartKey* keys = (NoteStartKey*)scratch_or_malloc(scratch, sizeof(NoteStartKey) * cnt);
+        if (!keys) {
+            note_index_free(ix);
+            return -1;
+        }
+        for (int i = 0; i < cnt; i++) keys[i] = (NoteStartKey){ix->starts[i], i};
+        qsort(keys, cnt, sizeof(NoteStartKey), compare_note_key);
+        for (int k = 0; k < cnt; k++) {
+            ix->order[k] = keys[k].idx;
+            ix->starts[k] = keys[k].start;
+        }
+        if (!scratch) free(keys);
+    }
+    for (int k = 0; k < cnt; k++) {
+        ix->ends[k] = note_end_sample(&notes[ix->order[k]]);
+        ix->max_end[k] = (k > 0 && ix->max_end[k - 1] > ix->ends[k]) ? ix->max_end[k - 1] : ix->ends[k];
+    }
+    perf_add(VSE_STAGE_INDEX, t0);
+    return 0;
+}
+
+/**
+ * [a, b) にかかるノートの添字を out に昇順で入れる（合成の順番を全体を合成したときと揃えるため）
+ * out: ix->count 個分の領域。span に、見つかったノートが占める区間 [最小の開始, 最大の終了) を返す
+ * 戻り値: 見つかったノートの数
+ */
+static int note_index_query(const NoteIndex* ix, int a, int b, int* out, int span[2]) {
+    // 開始が b 以上のノートは候補外（starts は昇順）
+    int lo = 0, hi = ix->count;
+    while (lo < hi) {
+        int mid = (lo + hi) / 2;
+        if (ix->starts[mid] < b) lo = mid + 1;
+        else hi = mid;
+    }
+    int k_end = lo;
+    // それまでの終了の最大値が a 以下のノートも候補外（max_end は単調増加）
+    lo = 0;
+    hi = k_end;
+    while (lo < hi) {
+        int mid = (lo + hi) / 2;
+        if (ix->max_end[mid] > a) hi = mid;
+        else lo = mid + 1;
+    }
+
+    int n = 0;
+    int ascending = 1;
+    span[0] = b;
+    span[1] = a;
+    for (int k = lo; k < k_end; k++) {
+        if (ix->ends[k] <= a) continue;
+        if (n > 0 && ix->order[k] < out[n - 1]) ascending = 0;
+        out[n++] = ix->order[k];
+        if (ix->starts[k] < span[0]) span[0] = ix->starts[k];
+        if (ix->ends[k] > span[1]) span[1] = ix->ends[k];
+    }
+    if (!ascending) qsort(out, n, sizeof(int), compare_int);
+    return n;
+}
+
+/**
+ * タイムラインの [a, b) サンプルを out（b - a 個）に合成する
+ * 区間にかかるノートだけを合成し、ピッチカーブもそのノートの範囲だけ作る。
+ * 曲全体を合成したときの同じ区間とビット単位で一致する。戻り値: 失敗時 -1
+ */
+static int render_window(const RenderContext* base, ScratchArena* scratch, const CNoteEvent* notes,
+                         const NoteIndex* ix, const CPitchEvent* p_events, int p_cnt, int a, int b, int total_len,
+                         float* out) {
+    if (a >= b || ix->count == 0) return 0;
+    size_t mark = scratch->used;
+    int* hits = (int*)scratch_alloc(scratch, sizeof(int) * ix->count);
+    if (!hits) return -1;
+    int span[2];
+    int hit_cnt = note_index_query(ix, a, b, hits, span);
+    PitchContour pc;
+    int failed = 0;
+    if (hit_cnt > 0) {
+        failed = pitch_contour_build(&pc, p_events, p_cnt, span[0], span[1] - span[0], scratch) != 0;
+        if (!failed) {
+            RenderContext rc = {base->vb, &pc, base->quality, base->latest, base->generation};
+            render_notes_parallel(&rc, scratch, notes, hits, hit_cnt, 0.0f, a, b - a, total_len, out);
+        }
+    }
+    scratch_rewind(scratch, mark);
+    return failed ? -1 : 0;
+}
+
+// ノートの終了時刻の最大値 + 1秒の余裕（曲全体の長さ）
+static float notes_end_time(const CNoteEvent* notes, int cnt) {
+    float max_time = 0.0f;
+    for (int i = 0; i < cnt; i++) {
+        float end = notes[i].start_time + notes[i].duration;
+        if (end > max_time) {
+            max_time = end;
+        }
+    }
+    return max_time + 1.0f; // バッファに余裕を持たせる
+}
+
+/**
+ * タイムラインの [start, end) 秒を合成し、その長さだけのバッファを返す
+ * 曲の途中の区間でも、かかるノートだけを合成するので区間の長さとノート数の分しかかからない
+ */
+float* vse_synthesize_track(CNoteEvent* notes, int note_cnt, CPitchEvent* p_events, int p_cnt, float start, float end,
+                            int quality, int* out_len) {
+    uint64_t t0 = monotonic_ns();
+    int sr = ENGINE_SAMPLE_RATE;
+    int a = (int)(start * sr);
+    if (a < 0) a = 0;
+    *out_len = (int)(end * sr) - a;
+    if (*out_len < 0) *out_len = 0;
+    float* buffer = (float*)calloc(*out_len > 0 ? *out_len : 1, sizeof(float));
+    if (!buffer) return NULL;
+
+    ScratchArena* scratch = scratch_acquire();
+    NoteIndex ix;
+    if (!scratch || note_index_build(&ix, notes, note_cnt, scratch) != 0) {
+        scratch_release(scratch);
+        free(buffer);
+        return NULL;
+    }
+    // 曲の終わりをはみ出すノートは合成しない決まりなので、曲全体の長さを渡す（区間の端のノートも途中まで鳴る）
+    int total_len = (int)(notes_end_time(notes, note_cnt) * sr);
+    RenderContext rc = {bank_acquire_active(), NULL, clamp_quality(quality), NULL, 0};
+    int failed = render_window(&rc, scratch, notes, &ix, p_events, p_cnt, a, a + *out_len, total_len, buffer);
+    bank_release(rc.vb);
+    note_index_free(&ix);
+    scratch_finish_render(scratch);
+    scratch_release(scratch);
+    if (failed) {
+        free(buffer);
+        return NULL;
+    }
+    perf_render_done(t0, *out_len);
+    return buffer;
+}
+
+// リクエストの終了時刻（最後のノートの終わり + 1秒の余裕）を返す
+static float request_end_time(const SynthesisRequest* request) {
+    return notes_end_time(request->notes, request->note_count);
+}
+
+// --- Pythonからのメイン窓口 ---
+EXPORT float* request_synthesis_full(SynthesisRequest request, int* out_sample_count) {
+    float max_time = request_end_time(&request);
+
+    return vse_synthesize_track(
+        request.notes, 
+        request.note_count,
+        request.pitch_events, 
+        request.pitch_event_count,
+        0.0f, 
+        max_time,
+        request.resample_quality,
+        out_sample_count
+    );
+}
+
+// タイムラインの [start, end) 秒だけを合成する（返すバッファはその区間の長さ）
+EXPORT float* vse_render_window(const SynthesisRequest* request, float start, float end, int* out_sample_count) {
+    if (!request || !out_sample_count) return NULL;
+    return vse_synthesize_track(
+        request->notes,
+        request->note_count,
+        request->pitch_events,
+        request->pitch_event_count,
+        start,
+        end,
+        request->resample_quality,
+        out_sample_count
+    );
+}
+
+// request_synthesis_full などが返したバッファの解放（Python 側は自分で free できないため）
+EXPORT void vse_free_buffer(float* buffer) {
+    free(buffer);
+}
+
+
+// --- 呼び出し側のバッファへの直接合成 ---
+// Python 側で確保した NumPy 配列に直接書き込むので、コピーも vse_free_buffer も要らない。
+
+// リクエスト全体の長さ（サンプル数）。バッファを確保する前に呼ぶ
+EXPORT int vse_render_length(const SynthesisRequest* request) {
+    if (!request || request->note_count <= 0) return 0;
+    return (int)(request_end_time(request) * ENGINE_SAMPLE_RATE);
+}
+
+/**
+ * out に先頭から out_len サンプルまで合成する
+ * 戻り値: 書き込んだサンプル数（min(out_len, 全体の長さ)）
+ */
+EXPORT int vse_render_into(const SynthesisRequest* request, float* out, int out_len) {
+    if (!request || !out || out_len <= 0) return 0;
+    int total_len = vse_render_length(request);
+    int n = out_len < total_len ? out_len : total_len;
+    if (n <= 0) return 0;
+    uint64_t t0 = monotonic_ns();
+    ScratchArena* scratch = scratch_acquire();
+    if (!scratch) return 0;
+    PitchContour pc;
+    if (pitch_contour_build(&pc, request->pitch_events, request->pitch_event_count, 0, total_len, scratch) != 0) {
+        scratch_release(scratch);
+        return 0;
+    }
+    memset(out, 0, sizeof(float) * n);
+    RenderContext rc = {bank_acquire_active(), &pc, clamp_quality(request->resample_quality), NULL, 0};
+    render_notes_parallel(&rc, scratch, request->notes, NULL, request->note_count, 0.0f, 0, n, total_len, out);
+    bank_release(rc.vb);
+    pitch_contour_free(&pc);
+    scratch_finish_render(scratch);
+    scratch_release(scratch);
+    perf_render_done(t0, n);
+    return n;
+}
+
+
+// --- ストリーミング合成（ブロック単位の引き出し） ---
+// 曲全体のバッファを確保せず、呼び出し側が指定したフレーム数ずつ順番に合成する。
+struct VseRenderSession {
+    SynthesisRequest request;  // notes / pitch_events は呼び出し側が保持しておくこと
+    PitchContour pitch;        // 開いたときに曲全体のピッチカーブを作っておく
+    RenderContext rc;          // 開いたときのキャラクター（閉じるまで捨てられない）とピッチカーブ
+    int total_len;             // 全体の長さ（request_synthesis_full と同じ）
+    int pos;                   // 次に合成するサンプル位置
+    NoteIndex index;           // 開始位置の昇順に並べたノート
+    int cursor;                // index.order のうち、まだ有効リストに入れていない先頭
+    int* active;               // 現在のブロックにかかり得るノート添字（昇順）
+    int active_cnt;
+    ScratchArena* scratch;     // ブロックごとに空にして使う作業領域
+};
+
+EXPORT VseRenderSession* vse_render_open(const SynthesisRequest* request) {
+    if (!request || request->note_count <= 0) return NULL;
+
+    VseRenderSession* s = (VseRenderSession*)calloc(1, sizeof(VseRenderSession));
+    if (!s) return NULL;
+    s->request = *request;
+    s->rc.vb = bank_acquire_active();
+    s->rc.pc = &s->pitch;
+    s->rc.quality = clamp_quality(request->resample_quality);
+    s->total_len = (int)(request_end_time(request) * ENGINE_SAMPLE_RATE);
+    s->active = (int*)malloc(sizeof(int) * request->note_count);
+    s->scratch = scratch_acquire();
+    int index_failed = note_index_build(&s->index, request->notes, request->note_count, NULL);
+    int contour_failed = pitch_contour_build(&s->pitch, request->pitch_events, request->pitch_event_count,
+                                             0, s->total_len, NULL);
+    if (!s->active || !s->scratch || index_failed || contour_failed) {
+        vse_render_close(s);
+        return NULL;
+    }
+    return s;
+}
+
+EXPORT int vse_render_pull(VseRenderSession* s, float* out, int max_frames) {
+    if (!s || !out || max_frames <= 0) return 0;
+    int n = s->total_len - s->pos;
+    if (n > max_frames) n = max_frames;
+    if (n <= 0) return 0;
+    uint64_t t0 = monotonic_ns();
+
+    const CNoteEvent* notes = s->request.notes;
+    int block_end = s->pos + n;
+
+    // このブロックより前に開始するノートを有効リストへ（添字の昇順を保つ）
+    while (s->cursor < s->index.count && s->index.starts[s->cursor] < block_end) {
+        int idx = s->index.order[s->cursor++];
+        int k = s->active_cnt++;
+        while (k > 0 && s->active[k - 1] > idx) {
+            s->active[k] = s->active[k - 1];
+            k--;
+        }
+        s->active[k] = idx;
+    }
+    // 鳴り終わったノートを外す
+    int kept = 0;
+    for (int k = 0; k < s->active_cnt; k++) {
+        if (note_end_sample(&notes[s->active[k]]) > s->pos) s->active[kept++] = s->active[k];
+    }
+    s->active_cnt = kept;
+
+    memset(out, 0, sizeof(float) * n);
+    scratch_reset(s->scratch);
+    render_notes_parallel(&s->rc, s->scratch, notes, s->active, s->active_cnt, 0.0f, s->pos, n, s->total_len, out);
+    scratch_finish_render(s->scratch);
+    s->pos = block_end;
+    perf_render_done(t0, n);
+    return n;
+}
+
+/**
+ * 次に合成する位置を frame に移す（再生位置の変更用）
+ * その位置で鳴っているノートを区間インデックスで探して有効リストを作り直すので、曲の長さによらず速い。
+ * 続けて引き出した結果は、曲全体を合成したときの同じ位置からとビット単位で一致する
+ */
+EXPORT int vse_render_seek(VseRenderSession* s, int frame) {
+    if (!s) return -1;
+    if (frame < 0) frame = 0;
+    if (frame > s->total_len) frame = s->total_len;
+
+    // 開始が frame より前のノートはすでに有効リストに入れた扱い
+    int lo = 0, hi = s->index.count;
+    while (lo < hi) {
+        int mid = (lo + hi) / 2;
+        if (s->index.starts[mid] < frame) lo = mid + 1;
+        else hi = mid;
+    }
+    s->cursor = lo;
+    // そのうち frame の時点でまだ鳴っているもの（開始 < frame かつ 終了 > frame）
+    int span[2];
+    s->active_cnt = note_index_query(&s->index, frame, frame, s->active, span);
+    s->pos = frame;
+    return frame;
+}
+
+EXPORT int vse_render_total_frames(const VseRenderSession* s) {
+    return s ? s->total_len : 0;
+}
+
+EXPORT void vse_render_close(VseRenderSession* s) {
+    if (!s) return;
+    bank_release(s->rc.vb);
+    pitch_contour_free(&s->pitch);
+    note_index_free(&s->index);
+    free(s->active);
+    scratch_release(s->scratch);
+    free(s);
+}
+
+
+// --- WAV書き出し ---
+// ストリーミング合成と同じようにブロック単位で合成し、ブロックごとにまとめて変換して1回で書き込む。
+// 曲の長さに関係なく使うメモリは一定で、書き出しの速さはほぼディスクの速さで決まる。
+#define WAV_WRITE_BLOCK 16384           // 1回に合成・書き込みするサンプル数
+#define WAV_DITHER_SEED 0x9E3779B9u     // ディザの乱数の初期値（書き出し結果を毎回同じにする）
+
+EXPORT int vse_render_to_wav(const SynthesisRequest* request, const char* output_path, int sample_format, int dither) {
+    if (!output_path) return -1;
+    if (sample_format != VSE_WAV_PCM16 && sample_format != VSE_WAV_PCM24 && sample_format != VSE_WAV_FLOAT32) return -1;
+
+    VseRenderSession* session = vse_render_open(request);
+    if (!session) return -1;
+
+    // 合成結果・変換結果・ディザの乱数用（どれも1ブロック分）
+    float* block = (float*)malloc(sizeof(float) * WAV_WRITE_BLOCK);
+    void* converted = malloc((size_t)WAV_WRITE_BLOCK * 4);
+    float* scratch = (float*)malloc(sizeof(float) * WAV_WRITE_BLOCK);
+
+    drwav_data_format format;
+    format.container = drwav_container_riff;
+    format.format = (sample_format == VSE_WAV_FLOAT32) ? DR_WAVE_FORMAT_IEEE_FLOAT : DR_WAVE_FORMAT_PCM;
+    format.channels = 1;
+    format.sampleRate = ENGINE_SAMPLE_RATE;
+    format.bitsPerSample = sample_format;
+
+    drwav wav;
+    if (!block || !converted || !scratch || !drwav_init_file_write(&wav, output_path, &format, NULL)) {
+        free(block);
+        free(converted);
+        free(scratch);
+        vse_render_close(session);
+        return -1;
+    }
+
+    uint32_t dither_state = WAV_DITHER_SEED;
+    uint32_t* dither_ptr = dither ? &dither_state : NULL;
+    int written = 0;
+    int n;
+    while ((n = vse_render_pull(session, block, WAV_WRITE_BLOCK)) > 0) {
+        uint64_t t0 = monotonic_ns();
+        switch (sample_format) {
+            case VSE_WAV_PCM16:   convert_to_pcm16(block, (int16_t*)converted, n, scratch, dither_ptr); break;
+            case VSE_WAV_PCM24:   convert_to_pcm24(block, (uint8_t*)converted, n, scratch, dither_ptr); break;
+            case VSE_WAV_FLOAT32: convert_to_float32(block, (float*)converted, n); break;
+        }
+        int short_write = drwav_write_pcm_frames(&wav, (drwav_uint64)n, converted) != (drwav_uint64)n;
+        perf_add(VSE_STAGE_ENCODE, t0);
+        if (short_write) {
+            written = -1;
+            break;
+        }
+        written += n;
+    }
+
+    drwav_uninit(&wav);
+    free(block);
+    free(converted);
+    free(scratch);
+    vse_render_close(session);
+    return written;
+}
+
+// 以前からの書き出し窓口（16bit、最高品質のリサンプル）
+EXPORT void execute_render_to_file(const char* output_path, CNoteEvent* notes, int count) {
+    SynthesisRequest request = {notes, count, NULL, 0, ENGINE_SAMPLE_RATE, VSE_RESAMPLE_SINC_BEST};
+    if (vse_render_to_wav(&request, output_path, VSE_WAV_PCM16, 1) < 0) {
+        printf("C-Engine: %s に書き出せません\n", output_path ? output_path : "(null)");
+    }
+}
+
+
+// --- 差分レンダリング（マスターバッファ） ---
+// 合成結果をエンジン側に保持しておき、編集で変わった時間範囲だけを合成し直す。
+// 合成はサンプル単位で決まるので、範囲を塗り直した結果は全体を合成し直した結果と一致する。
+// 変わっていないノートの音素は、範囲内でもリサンプルキャッシュから再利用される。
+// 合成済みの区間を覚えておき、実際に合成するのは要求された時間範囲のうちまだ合成していない部分だけにする
+// （曲の後ろの小節を再生するときも、その小節の分しか合成しない）。
+// GUIのバックグラウンド合成用に、合成には世代番号を付けられる。編集のたびに vse_master_supersede で世代を進めると、
+// 古い世代の合成は合成ループの中で中止される。合成済みの部分は別スレッドから vse_master_read で読める。
+static float* g_master = NULL;
+static int g_master_len = 0;
+static int g_master_cap = 0;
+static int g_master_quality = VSE_RESAMPLE_LINEAR;  // マスターバッファを合成したときのリサンプル品質
+static int* g_master_valid = NULL;  // 合成済みの区間 [a0, b0, a1, b1, ...]（昇順・重なりなし）
+static int g_master_valid_cnt = 0;  // 区間の数
+static int g_master_valid_cap = 0;
+static int g_master_generation = 0;           // 合成済みの区間がどの世代の内容か
+static int g_master_latest = 0;               // vse_master_supersede で進めた最新の世代
+static pthread_mutex_t g_master_lock = PTHREAD_MUTEX_INITIALIZER;         // バッファと合成済みの区間を守る
+static pthread_mutex_t g_master_render_lock = PTHREAD_MUTEX_INITIALIZER;  // マスターへの合成は同時に1つまで
+
+// マスターバッファの長さを合わせる。伸びた部分は 0 で埋める（まだ合成していない扱い）
+static int master_resize(int new_len) {
+    if (new_len > g_master_cap) {
+        float* grown = (float*)realloc(g_master, sizeof(float) * new_len);
+        if (!grown) return -1;
+        g_master = grown;
+        g_master_cap = new_len;
+    }
+    if (new_len > g_master_len) memset(&g_master[g_master_len], 0, sizeof(float) * (new_len - g_master_len));
+    g_master_len = new_len;
+    return 0;
+}
+
+// 区間を1つ増やせるだけの場所を確保しておく
+static int master_valid_reserve(void) {
+    if (g_master_valid_cnt + 1 <= g_master_valid_cap) return 0;
+    int cap = g_master_valid_cap ? g_master_valid_cap * 2 : 16;
+    int* grown = (int*)realloc(g_master_valid, sizeof(int) * 2 * cap);
+    if (!grown) return -1;
+    g_master_valid = grown;
+    g_master_valid_cap = cap;
+    return 0;
+}
+
+// 合成済みの区間から [a, b) を取り除く
+static int master_invalidate(int a, int b) {
+    if (a >= b) return 0;
+    if (master_valid_reserve() < 0) return -1;
+    int* v = g_master_valid;
+    int cnt = g_master_valid_cnt;
+    for (int i = 0; i < cnt; i++) {
+        int va = v[2 * i], vb = v[2 * i + 1];
+        if (vb <= a || va >= b) continue;
+        if (va < a && vb > b) {
+            // 真ん中が抜けて2つに割れる（ほかの区間とは重ならない）
+            memmove(&v[2 * (i + 2)], &v[2 * (i + 1)], sizeof(int) * 2 * (cnt - i - 1));
+            v[2 * i + 1] = a;
+            v[2 * (i + 1)] = b;
+            v[2 * (i + 1) + 1] = vb;
+            cnt++;
+            break;
+        }
+        if (va < a) {
+            v[2 * i + 1] = a;  // 後ろが削れる
+        } else if (vb > b) {
+            v[2 * i] = b;      // 前が削れる
+        } else {
+            memmove(&v[2 * i], &v[2 * (i + 1)], sizeof(int) * 2 * (cnt - i - 1));
+            cnt--;
+            i--;
+        }
+    }
+    g_master_valid_cnt = cnt;
+    return 0;
+}
+
+// [a, b) を合成済みにする（隣り合う区間はまとめる）
+static int master_mark_valid(int a, int b) {
+    if (a >= b) return 0;
+    if (master_valid_reserve() < 0) return -1;
+    int* v = g_master_valid;
+    int cnt = g_master_valid_cnt;
+    // [a, b) と重なる・接する区間をまとめて1つにする
+    int i = 0;
+    while (i < cnt && v[2 * i + 1] < a) i++;
+    int j = i;
+    while (j < cnt && v[2 * j] <= b) {
+        if (v[2 * j] < a) a = v[2 * j];
+        if (v[2 * j + 1] > b) b = v[2 * j + 1];
+        j++;
+    }
+    int removed = j - i;
+    if (removed != 1) memmove(&v[2 * (i + 1)], &v[2 * j], sizeof(int) * 2 * (cnt - j));
+    v[2 * i] = a;
+    v[2 * i + 1] = b;
+    g_master_valid_cnt = cnt - removed + 1;
+    return 0;
+}
+
+/**
+ * [a, b) に合成していない部分があれば、その先頭と終わりを返す（g_master_lock を持って呼ぶ）
+ * 戻り値: 隙間があれば 1
+ */
+static int master_next_gap(int a, int b, int gap[2]) {
+    int v = 0;
+    while (a < b) {
+        while (v < g_master_valid_cnt && g_master_valid[2 * v + 1] <= a) v++;
+        if (v < g_master_valid_cnt && g_master_valid[2 * v] <= a) {
+            a = g_master_valid[2 * v + 1];
+            continue;
+        }
+        gap[0] = a;
+        gap[1] = v < g_master_valid_cnt && g_master_valid[2 * v] < b ? g_master_valid[2 * v] : b;
+        return 1;
+    }
+    return 0;
+}
+
+/**
+ * マスターバッファを更新する（世代付き）
+ * 編集された範囲は中止されても必ず合成済みから外す。そのうえで generation がすでに古ければ合成せずに中止する。
+ * 合成中に世代が進んだら、その隙間は合成済みにしないで中止する（それまでに合成した隙間はそのまま使える）
+ */
+static int master_render(const SynthesisRequest* request, const float* dirty_ranges, int range_count,
+                         int full_render, float start, float end, int generation) {
+    if (!request) return -1;
+    uint64_t t0 = monotonic_ns();
+    int total_len = request->note_count > 0 ? (int)(request_end_time(request) * ENGINE_SAMPLE_RATE) : 0;
+
+    ScratchArena* scratch = scratch_acquire();
+    if (!scratch) return -1;
+    NoteIndex ix;
+    int* hits = NULL;
+    if (note_index_build(&ix, request->notes, request->note_count, scratch) != 0
+        || !(hits = (int*)scratch_alloc(scratch, sizeof(int) * (request->note_count > 0 ? request->note_count : 1)))) {
+        scratch_release(scratch);
+        return -1;
+    }
+
+    pthread_mutex_lock(&g_master_render_lock);
+    pthread_mutex_lock(&g_master_lock);
+    int failed = master_resize(total_len) < 0;
+    // 品質が変わったら全体を合成し直す
+    if (clamp_quality(request->resample_quality) != g_master_quality) {
+        g_master_quality = clamp_quality(request->resample_quality);
+        full_render = 1;
+    }
+    if (full_render) g_master_valid_cnt = 0;
+    // 縮んだ分は合成済みから外す（後で伸びたときに古い音が残らないように）
+    if (!failed) failed = master_invalidate(g_master_len, INT_MAX) < 0;
+
+    for (int r = 0; r < range_count && !failed; r++) {
+        // ノート位置の丸めの差を吸収するため、前後に少し余裕を持たせる
+        // 終了側は無限大（曲の終わりまで）も受け付ける
+        double ta = (double)dirty_ranges[2 * r] * ENGINE_SAMPLE_RATE;
+        double tb = (double)dirty_ranges[2 * r + 1] * ENGINE_SAMPLE_RATE;
+        if (!(ta < g_master_len) || !(tb > 0.0)) continue;
+        int a = ta > 0.0 ? (int)ta - 1 : 0;
+        int b = tb < g_master_len ? (int)tb + 2 : g_master_len;
+        // ピッチの変化は音素の読み取り位置を通して音素全体に効くので、かかるノートは丸ごと塗り直す
+        int span[2];
+        if (note_index_query(&ix, a, b, hits, span) > 0) {
+            if (span[0] < a) a = span[0];
+            if (span[1] > b) b = span[1];
+        }
+        failed = master_invalidate(a, b) < 0;
+    }
+    // 残っている合成済みの区間は、この世代の内容としても正しい
+    g_master_generation = generation;
+    int master_len = g_master_len;
+    pthread_mutex_unlock(&g_master_lock);
+
+    // 要求された範囲のうち、合成済みでない隙間を合成する
+    // 秒をサンプル位置に直すときの丸めの差（長い曲では float の精度で数サンプルずれる）を吸収するため、
+    // 前後に制御ブロック1つ分だけ余分に合成する
+    // バッファの大きさが変わるのは g_master_render_lock の中だけなので、隙間への書き込みはロックの外で行う
+    double wa = (double)start * ENGINE_SAMPLE_RATE - PITCH_CONTROL_BLOCK;
+    double wb = (double)end * ENGINE_SAMPLE_RATE + PITCH_CONTROL_BLOCK;
+    int win_a = wa > 0.0 ? (int)wa : 0;
+    int win_b = wb < master_len ? (int)wb : master_len;
+    RenderContext rc = {bank_acquire_active(), NULL, g_master_quality, &g_master_latest, generation};
+    int cancelled = render_cancelled(&rc);
+    int rendered = 0;
+    int pos = win_a;
+    while (!failed && !cancelled && pos < win_b) {
+        int gap[2];
+        pthread_mutex_lock(&g_master_lock);
+        int found = master_next_gap(pos, win_b, gap);
+        pthread_mutex_unlock(&g_master_lock);
+        if (!found) break;
+
+        memset(&g_master[gap[0]], 0, sizeof(float) * (gap[1] - gap[0]));
+        failed = render_window(&rc, scratch, request->notes, &ix, request->pitch_events, request->pitch_event_count,
+                               gap[0], gap[1], master_len, &g_master[gap[0]]) != 0;
+        cancelled = render_cancelled(&rc);
+        if (!failed && !cancelled) {
+            pthread_mutex_lock(&g_master_lock);
+            failed = master_mark_valid(gap[0], gap[1]) != 0;
+            pthread_mutex_unlock(&g_master_lock);
+            rendered += gap[1] - gap[0];
+        }
+        pos = gap[1];
+    }
+    bank_release(rc.vb);
+    note_index_free(&ix);
+    scratch_finish_render(scratch);
+    scratch_release(scratch);
+    if (failed) {
+        pthread_mutex_lock(&g_master_lock);
+        g_master_valid_cnt = 0; // どこまで正しいか分からないので、次回は合成し直す
+        pthread_mutex_unlock(&g_master_lock);
+    }
+    pthread_mutex_unlock(&g_master_render_lock);
+    if (failed) return -1;
+    perf_render_done(t0, rendered);
+    return cancelled ? VSE_RENDER_CANCELLED : master_len;
+}
+
+/**
+ * マスターバッファを更新する
+ * dirty_ranges: [開始秒, 終了秒] の組を range_count 個並べた配列
+ * full_render: 0 以外なら全体を合成し直す（キャラクター切り替え時など）
+ * [start, end) 秒のうち、まだ合成していない部分と編集された部分だけを合成する
+ * 戻り値: マスターバッファの長さ（サンプル数）。失敗時は -1、中止されたときは VSE_RENDER_CANCELLED
+ */
+EXPORT int vse_master_render_window(const SynthesisRequest* request, const float* dirty_ranges, int range_count,
+                                    int full_render, float start, float end) {
+    // 世代を使わない呼び出しは、その時点で最新の世代の合成として扱う（合成中に次の世代が来たら中止される）
+    int generation = __atomic_load_n(&g_master_latest, __ATOMIC_ACQUIRE);
+    return master_render(request, dirty_ranges, range_count, full_render, start, end, generation);
+}
+
+/**
+ * vse_master_render_window の世代付き版（バックグラウンド合成用）
+ * generation より新しい世代が vse_master_supersede されていたら、合成ループの中で中止する
+ * 戻り値: マスターバッファの長さ / 失敗 -1 / 中止 VSE_RENDER_CANCELLED
+ */
+EXPORT int vse_master_render_job(const SynthesisRequest* request, const float* dirty_ranges, int range_count,
+                                 int full_render, float start, float end, int generation) {
+    return master_render(request, dirty_ranges, range_count, full_render, start, end, generation);
+}
+
+/**
+ * 最新の世代を generation にする。それより前の世代の合成は中止される（どのスレッドから呼んでもよい）
+ */
+EXPORT void vse_master_supersede(int generation) {
+    __atomic_store_n(&g_master_latest, generation, __ATOMIC_RELEASE);
+}
+
+/**
+ * マスターバッファの [frame, frame + count) を out にコピーする
+ * generation と quality の合成結果で、範囲がすべて合成済みのときだけコピーする（合成中でも読める）
+ * 戻り値: コピーしたサンプル数（count）。まだなら 0
+ */
+EXPORT int vse_master_read(int generation, int quality, int frame, float* out, int count) {
+    if (!out || frame < 0 || count <= 0) return 0;
+    int copied = 0;
+    pthread_mutex_lock(&g_master_lock);
+    if (generation == g_master_generation && clamp_quality(quality) == g_master_quality
+        && frame + count <= g_master_len) {
+        // 合成済みの区間は昇順で隣り合うものはまとめてあるので、frame を含む1つに収まっていればよい
+        int lo = 0, hi = g_master_valid_cnt;
+        while (lo < hi) {
+            int mid = (lo + hi) / 2;
+            if (g_master_valid[2 * mid + 1] <= frame) lo = mid + 1;
+            else hi = mid;
+        }
+        if (lo < g_master_valid_cnt && g_master_valid[2 * lo] <= frame && frame + count <= g_master_valid[2 * lo + 1]) {
+            memcpy(out, &g_master[frame], sizeof(float) * count);
+            copied = count;
+        }
+    }
+    pthread_mutex_unlock(&g_master_lock);
+    return copied;
+}
+
+// 曲全体を対象にした vse_master_render_window
+EXPORT int vse_master_render(const SynthesisRequest* request, const float* dirty_ranges, int range_count, int full_render) {
+    return vse_master_render_window(request, dirty_ranges, range_count, full_render, 0.0f, INFINITY);
+}
+
+// マスターバッファの先頭ポインタ（次の vse_master_render / vse_master_reset まで有効）
+// 別のスレッドがマスターへ合成している間は vse_master_read を使うこと
+EXPORT const float* vse_master_buffer(int* out_len) {
+    if (out_len) *out_len = g_master_len;
+    return g_master;
+}
+
+EXPORT void vse_master_reset(void) {
+    pthread_mutex_lock(&g_master_render_lock);
+    pthread_mutex_lock(&g_master_lock);
+    free(g_master);
+    g_master = NULL;
+    g_master_len = 0;
+    g_master_cap = 0;
+    free(g_master_valid);
+    g_master_valid = NULL;
+    g_master_valid_cnt = 0;
+    g_master_valid_cap = 0;
+    g_master_generation = 0;
+    pthread_mutex_unlock(&g_master_lock);
+    pthread_mutex_unlock(&g_master_render_lock);
+}
+
+
+// --- プレビューボイス ---
+// ノートのクリックや編集の試聴用に、合成パイプラインを通さず音素を直接鳴らす発音数つきのボイスプール。
+// 音素の先頭（アタック部分）はキャラクターを読み込んだときに vse_preview_prepare でテーブルへコピーしておくので、
+// 発音の瞬間にデコードやページフォルトが起きない。
+// 発音・消音はキューに積むだけですぐ戻り、実際の処理は出力デバイスのコールバックから呼ばれる
+// vse_preview_render が行う。コールバックはロックを待たない（取れなければそのブロックは鳴らさない）。
+#define PREVIEW_VOICES 16
+#define PREVIEW_ATTACK_FRAMES 8192      // 約186ms。これより後は音素の波形を直接読む
+#define PREVIEW_FADE_IN_FRAMES 64       // 発音直後のクリックノイズ防止
+#define PREVIEW_RELEASE_FRAMES 1323     // 消音時のフェードアウト（約30ms）
+#define PREVIEW_QUEUE_SIZE 256          // 2の累乗
+#define PREVIEW_BASE_NOTE 60            // 音素をそのままの速さで鳴らすノート番号
+
+#define PREVIEW_CMD_ON      0
+#define PREVIEW_CMD_OFF     1
+#define PREVIEW_CMD_ALL_OFF 2
+
+typedef struct {
+    Voicebank* vb;              // users を1つ持っておき、プレビューに使っている間は捨てられないようにする
+    int phoneme_cnt;
+    float* attack;              // 音素ごとに PREVIEW_ATTACK_FRAMES ずつ
+    int attack_len[MAX_PHONEMES];
+} PreviewBank;
+
+typedef struct {
+    int type;
+    int id;
+    int phoneme;
+    float rate;
+    float amp;
+    uint64_t t_trigger;         // 発音を指示した時刻（レイテンシ計測用）
+} PreviewCommand;
+
+typedef struct {
+    int id;                     // 0 なら空き
+    int phoneme;
+    double pos;                 // 元の波形上の読み取り位置
+    float rate;
+    float amp;
+    unsigned age;               // 発音順（上限を超えたら一番古いものを止める）
+    int fade_in;                // 鳴らしたフレーム数（PREVIEW_FADE_IN_FRAMES まで）
+    int release;                // 消音のフェードの残りフレーム。押さえている間は -1
+} PreviewVoice;
+
+typedef struct {
+    long long triggers;
+    long long dropped;
+    long long stolen;
+    long long active;
+    long long latency_last;     // ナノ秒
+    long long latency_max;
+    long long latency_sum;
+    long long latency_cnt;
+} PreviewCounters;
+
+static PreviewBank* g_preview_bank = NULL;
+static PreviewVoice g_preview_voices[PREVIEW_VOICES];
+static unsigned g_preview_age = 0;
+static pthread_mutex_t g_preview_lock = PTHREAD_MUTEX_INITIALIZER;       // バンクとボイス（コールバックは trylock）
+
+static PreviewCommand g_preview_queue[PREVIEW_QUEUE_SIZE];
+static unsigned g_preview_head = 0;     // 発音側が書く位置
+static unsigned g_preview_tail = 0;     // コールバックが読む位置
+static int g_preview_next_id = 1;
+static pthread_mutex_t g_preview_push_lock = PTHREAD_MUTEX_INITIALIZER;  // 発音側どうしの排他（コールバックは取らない）
+
+static PreviewCounters g_preview_counters;
+
+static void preview_bank_free(PreviewBank* pb) {
+    if (!pb) return;
+    bank_release(pb->vb);
+    free(pb->attack);
+    free(pb);
+}
+
+// 発音側から呼ぶ（g_preview_push_lock を持って）。キューが満杯なら 0
+static int preview_push(const PreviewCommand* cmd) {
+    unsigned head = g_preview_head;
+    if (head - __atomic_load_n(&g_preview_tail, __ATOMIC_ACQUIRE) >= PREVIEW_QUEUE_SIZE) {
+        STAT_ADD(g_preview_counters.dropped, 1);
+        return 0;
+    }
+    g_preview_queue[head & (PREVIEW_QUEUE_SIZE - 1)] = *cmd;
+    __atomic_store_n(&g_preview_head, head + 1, __ATOMIC_RELEASE);
+    return 1;
+}
+
+static void preview_start_voice(const PreviewCommand* cmd, uint64_t now) {
+    PreviewVoice* v = NULL;
+    for (int i = 0; i < PREVIEW_VOICES; i++) {
+        if (g_preview_voices[i].id == 0) {
+            v = &g_preview_voices[i];
+            break;
+        }
+        if (!v || g_preview_voices[i].age < v->age) v = &g_preview_voices[i];
+    }
+    if (v->id != 0) STAT_ADD(g_preview_counters.stolen, 1);
+
+    v->id = cmd->id;
+    v->phoneme = cmd->phoneme;
+    v->pos = 0.0;
+    v->rate = cmd->rate;
+    v->amp = cmd->amp;
+    v->age = g_preview_age++;
+    v->fade_in = 0;
+    v->release = -1;
+
+    // 発音の指示からコールバックで鳴らし始めるまで（この後に出力デバイスのバッファ分が加わる）
+    long long latency = (long long)(now - cmd->t_trigger);
+    __atomic_store_n(&g_preview_counters.latency_last, latency, __ATOMIC_RELAXED);
+    if (latency > __atomic_load_n(&g_preview_counters.latency_max, __ATOMIC_RELAXED)) {
+        __atomic_store_n(&g_preview_counters.latency_max, latency, __ATOMIC_RELAXED);
+    }
+    STAT_ADD(g_preview_counters.latency_sum, latency);
+    STAT_ADD(g_preview_counters.latency_cnt, 1);
+    STAT_ADD(g_preview_counters.triggers, 1);
+}
+
+// キューに溜まった指示を処理する（コールバック側）
+static void preview_drain(uint64_t now) {
+    unsigned tail = g_preview_tail;
+    unsigned head = __atomic_load_n(&g_preview_head, __ATOMIC_ACQUIRE);
+    for (; tail != head; tail++) {
+        const PreviewCommand* cmd = &g_preview_queue[tail & (PREVIEW_QUEUE_SIZE - 1)];
+        if (cmd->type == PREVIEW_CMD_ON) {
+            preview_start_voice(cmd, now);
+            continue;
+        }
+        for (int i = 0; i < PREVIEW_VOICES; i++) {
+            PreviewVoice* v = &g_preview_voices[i];
+            if (v->id != 0 && v->release < 0 && (cmd->type == PREVIEW_CMD_ALL_OFF || v->id == cmd->id)) {
+                v->release = PREVIEW_RELEASE_FRAMES;
+            }
+        }
+    }
+    __atomic_store_n(&g_preview_tail, tail, __ATOMIC_RELEASE);
+}
+
+// 1つのボイスを out に足し込む。鳴り終わったら空きにして 0 を返す
+static int preview_voice_mix(const PreviewBank* pb, PreviewVoice* v, float* out, int frames) {
+    const Phoneme* ph = &pb->vb->lib[v->phoneme];
+    const float* attack = pb->attack + (size_t)v->phoneme * PREVIEW_ATTACK_FRAMES;
+    int attack_len = pb->attack_len[v->phoneme];
+    int len = (int)ph->count;
+
+    for (int k = 0; k < frames; k++) {
+        int i = (int)v->pos;
+        if (i + 1 >= len || v->release == 0) {
+            v->id = 0;
+            return 0;
+        }
+        const float* src = i + 1 < attack_len ? attack : ph->samples;
+        float frac = (float)(v->pos - i);
+        float s = src[i] + (src[i + 1] - src[i]) * frac;
+
+        float env = v->amp;
+        if (v->fade_in < PREVIEW_FADE_IN_FRAMES) env *= (float)v->fade_in++ / PREVIEW_FADE_IN_FRAMES;
+        if (v->release > 0) env *= (float)v->release-- / PREVIEW_RELEASE_FRAMES;
+        out[k] += s * env;
+        v->pos += v->rate;
+    }
+    return 1;
+}
+
+/**
+ * アクティブなキャラクターの音素のアタック部分をプレビュー用のテーブルに読み込む
+ * 遅延読み込みの音素もここでデコードしておく。鳴っているプレビューは止まる
+ * 戻り値: 使える音素の数。キャラクター未読み込み・メモリ不足なら -1
+ */
+EXPORT int vse_preview_prepare(void) {
+    PreviewBank* pb = NULL;
+    Voicebank* vb = bank_acquire_active();
+    if (vb) {
+        pb = (PreviewBank*)calloc(1, sizeof(PreviewBank));
+        float* attack = (float*)malloc(sizeof(float) * PREVIEW_ATTACK_FRAMES * (vb->lib_cnt > 0 ? vb->lib_cnt : 1));
+        if (!pb || !attack) {
+            free(pb);
+            free(attack);
+            bank_release(vb);
+            return -1;
+        }
+        pb->vb = vb;
+        pb->attack = attack;
+        pb->phoneme_cnt = vb->lib_cnt;
+        for (int i = 0; i < vb->lib_cnt; i++) {
+            Phoneme* ph = &vb->lib[i];
+            if (!phoneme_ensure_loaded(ph)) continue; // attack_len = 0 の音素は鳴らさない
+            int n = ph->count < PREVIEW_ATTACK_FRAMES ? (int)ph->count : PREVIEW_ATTACK_FRAMES;
+            memcpy(attack + (size_t)i * PREVIEW_ATTACK_FRAMES, ph->samples, sizeof(float) * n);
+            pb->attack_len[i] = n;
+        }
+    }
+
+    pthread_mutex_lock(&g_preview_push_lock);
+    pthread_mutex_lock(&g_preview_lock);
+    PreviewBank* old = g_preview_bank;
+    g_preview_bank = pb;
+    memset(g_preview_voices, 0, sizeof(g_preview_voices));
+    __atomic_store_n(&g_preview_tail, g_preview_head, __ATOMIC_RELEASE); // 前のキャラクター向けの指示は捨てる
+    pthread_mutex_unlock(&g_preview_lock);
+    pthread_mutex_unlock(&g_preview_push_lock);
+
+    preview_bank_free(old);
+    return pb ? pb->phoneme_cnt : -1;
+}
+
+/**
+ * 音素をノート番号の高さで鳴らし始める（キューに積むだけなのですぐ戻る）
+ * 戻り値: vse_preview_note_off に渡すボイスID。音素がない・準備前・キューが満杯なら -1
+ */
+EXPORT int vse_preview_note_on(const char* phoneme, int note_number, int velocity) {
+    if (!phoneme) return -1;
+    PreviewCommand cmd;
+    cmd.type = PREVIEW_CMD_ON;
+    cmd.t_trigger = monotonic_ns();
+    cmd.rate = powf(2.0f, (note_number - PREVIEW_BASE_NOTE) / 12.0f);
+    cmd.amp = (velocity < 0 ? 0 : velocity > 127 ? 127 : velocity) / 127.0f;
+
+    int id = -1;
+    pthread_mutex_lock(&g_preview_push_lock);
+    PreviewBank* pb = g_preview_bank;
+    if (pb) {
+        // 合成時の検索と同じく 音素名 -> 別名 -> 代用音素 の順に探す（試聴は欠落音素の統計には数えない）
+        int index = resolve_phoneme_index(pb->vb, phoneme);
+        if (index < 0) {
+            NameSlot* slot = name_map_find(&pb->vb->fallback, phoneme);
+            index = slot ? name_slot_value(slot) : -1;
+        }
+        if (index >= 0 && pb->attack_len[index] > 1) {
+            cmd.id = g_preview_next_id;
+            cmd.phoneme = index;
+            if (preview_push(&cmd)) {
+                id = g_preview_next_id;
+                g_preview_next_id = g_preview_next_id == INT_MAX ? 1 : g_preview_next_id + 1;
+            }
+        }
+    }
+    pthread_mutex_unlock(&g_preview_push_lock);
+    return id;
+}
+
+/**
+ * MIDI入力のモニタリングなど、歌詞のない発音に使う音素名を buf に入れる
+ * 母音 "a"（別名も可）があればそれを、なければ鳴らせる最初の音素を選ぶ
+ * 戻り値: 見つかれば 0、準備前・鳴らせる音素がなければ -1
+ */
+EXPORT int vse_preview_default_phoneme(char* buf, int buf_len) {
+    if (!buf || buf_len <= 0) return -1;
+    int result = -1;
+    pthread_mutex_lock(&g_preview_push_lock);
+    PreviewBank* pb = g_preview_bank;
+    if (pb) {
+        int index = resolve_phoneme_index(pb->vb, "a");
+        if (index >= 0 && pb->attack_len[index] > 1) {
+            snprintf(buf, buf_len, "a");
+            result = 0;
+        }
+        for (int i = 0; result != 0 && i < pb->phoneme_cnt; i++) {
+            if (pb->attack_len[i] > 1) {
+                snprintf(buf, buf_len, "%s", pb->vb->lib[i].name);
+                result = 0;
+            }
+        }
+    }
+    pthread_mutex_unlock(&g_preview_push_lock);
+    return result;
+}
+
+// ボイスを短いフェードアウトで止める（キューに積むだけなのですぐ戻る）
+EXPORT void vse_preview_note_off(int voice_id) {
+    PreviewCommand cmd = {0};
+    cmd.type = PREVIEW_CMD_OFF;
+    cmd.id = voice_id;
+    pthread_mutex_lock(&g_preview_push_lock);
+    preview_push(&cmd);
+    pthread_mutex_unlock(&g_preview_push_lock);
+}
+
+EXPORT void vse_preview_all_off(void) {
+    PreviewCommand cmd = {0};
+    cmd.type = PREVIEW_CMD_ALL_OFF;
+    pthread_mutex_lock(&g_preview_push_lock);
+    preview_push(&cmd);
+    pthread_mutex_unlock(&g_preview_push_lock);
+}
+
+/**
+ * 鳴っているプレビューを out に frames フレーム足し込む（出力デバイスのコールバックから呼ぶ）
+ * 出力はモノラル・ENGINE_SAMPLE_RATE。戻り値: 鳴っているボイスの数
+ */
+EXPORT int vse_preview_render(float* out, int frames) {
+    if (!out || frames <= 0) return 0;
+    if (pthread_mutex_trylock(&g_preview_lock) != 0) return 0; // 音源の差し替え中はこのブロックだけ鳴らさない
+
+    int active = 0;
+    PreviewBank* pb = g_preview_bank;
+    if (pb) {
+        preview_drain(monotonic_ns());
+        for (int i = 0; i < PREVIEW_VOICES; i++) {
+            if (g_preview_voices[i].id != 0) active += preview_voice_mix(pb, &g_preview_voices[i], out, frames);
+        }
+    }
+    pthread_mutex_unlock(&g_preview_lock);
+    __atomic_store_n(&g_preview_counters.active, active, __ATOMIC_RELAXED);
+    return active;
+}
+
+EXPORT void vse_preview_get_stats(VsePreviewStats* out) {
+    if (!out) return;
+    long long cnt = __atomic_load_n(&g_preview_counters.latency_cnt, __ATOMIC_RELAXED);
+    out->triggers = __atomic_load_n(&g_preview_counters.triggers, __ATOMIC_RELAXED);
+    out->dropped = __atomic_load_n(&g_preview_counters.dropped, __ATOMIC_RELAXED);
+    out->stolen = __atomic_load_n(&g_preview_counters.stolen, __ATOMIC_RELAXED);
+    out->active_voices = (int)__atomic_load_n(&g_preview_counters.active, __ATOMIC_RELAXED);
+    out->last_latency_ms = __atomic_load_n(&g_preview_counters.latency_last, __ATOMIC_RELAXED) / 1e6;
+    out->max_latency_ms = __atomic_load_n(&g_preview_counters.latency_max, __ATOMIC_RELAXED) / 1e6;
+    out->avg_latency_ms = cnt > 0 ? __atomic_load_n(&g_preview_counters.latency_sum, __ATOMIC_RELAXED) / 1e6 / cnt : 0.0;
+}
+
+EXPORT void vse_preview_reset_stats(void) {
+    long long active = __atomic_load_n(&g_preview_counters.active, __ATOMIC_RELAXED);
+    memset(&g_preview_counters, 0, sizeof(g_preview_counters));
+    __atomic_store_n(&g_preview_counters.active, active, __ATOMIC_RELAXED);
+}
+
+
+// --- 合成結果の解放 ---       
+EXPORT void free_synthesized_audio(float* audio_data) {
+    if (audio_data) {
+        free(audio_data);
+    }
+}
+// --- エンジン終了処理 ---
+EXPORT void shutdown_engine() {
+    sinc_tables_free();
+
+    // プレビューが持っているキャラクターを手放してから音源を解放する
+    pthread_mutex_lock(&g_preview_push_lock);
+    pthread_mutex_lock(&g_preview_lock);
+    PreviewBank* preview = g_preview_bank;
+    g_preview_bank = NULL;
+    memset(g_preview_voices, 0, sizeof(g_preview_voices));
+    pthread_mutex_unlock(&g_preview_lock);
+    pthread_mutex_unlock(&g_preview_push_lock);
+    preview_bank_free(preview);
+
+    pthread_mutex_lock(&g_bank_lock);
+    for (int i = 0; i < MAX_RESIDENT_BANKS; i++) {
+        if (g_banks[i].users == 0) unload_voicebank(&g_banks[i]);
+    }
+    g_active = NULL;
+    pthread_mutex_unlock(&g_bank_lock);
+    cache_clear();
+    vse_master_reset();
+
+    pthread_mutex_lock(&g_render_lock);
+    pool_stop();
+    pthread_mutex_unlock(&g_render_lock);
+    scratch_pool_free();
 } 
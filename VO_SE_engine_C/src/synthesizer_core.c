@@ -1,102 +1,208 @@
 #include <stdlib.h>
 #include <math.h>
 #include <string.h>
+#include <stdint.h>
 #include "../include/synthesizer_core.h"
-#include "../include/dr_wav.h"
 
-// 10msのクロスフェード（44100Hzの場合、441サンプル）
-#define CROSSFADE_LEN 441
+#ifndef M_PI
+#define M_PI 3.14159265358979323846
+#endif
+
+// --- WAV書き出し用のサンプル変換 ---
+// 書き出しは一定サイズのブロック単位で行う。ディザの乱数は先にまとめて作っておき、
+// 変換ループには依存関係を残さない（コンパイラがベクトル化できる形にする）。
 
 /**
- * 線形クロスフェードを適用する内部関数
- * out: 出力先
- * prev_buf: 前の音素の末尾
- * next_buf: 次の音素の先頭
- * len: フェードさせるサンプル数
+ * TPDF（三角分布）ディザを n 個作る（単位は出力の1LSB、範囲は -1〜+1）
+ * state: xorshift32 の状態。同じ初期値なら毎回同じ列になる（書き出し結果が再現できる）
  */
-static void apply_linear_crossfade(float* out, const float* prev_buf, const float* next_buf, int len) {
-    for (int i = 0; i < len; i++) {
-        // 0.0から1.0へ変化する比率
-        float ratio = (float)i / (float)len;
-        // 前の音をフェードアウト(1->0)、次の音をフェードイン(0->1)
-        out[i] = (prev_buf[i] * (1.0f - ratio)) + (next_buf[i] * ratio);
+static void make_tpdf_dither(float* noise, int n, uint32_t* state) {
+    uint32_t x = *state;
+    for (int i = 0; i < n; i++) {
+        x ^= x << 13; x ^= x >> 17; x ^= x << 5;
+        float r1 = (float)(x >> 8) * (1.0f / 16777216.0f);
+        x ^= x << 13; x ^= x >> 17; x ^= x << 5;
+        float r2 = (float)(x >> 8) * (1.0f / 16777216.0f);
+        noise[i] = r1 - r2;
     }
+    *state = x;
 }
 
-/**
- * 指定された周波数(Hz)に基づいてリサンプリングを行いながら波形を生成する
- */
-void process_note_with_fade(drwav* wav, float target_hz, float duration_sec, const char* lyric, float* overlap_buffer, int* has_overlap) {
-    // 1. 音素データの読み込み（実際はaudio_data/からlyricに応じたWAVをロード）
-    // ここでは簡易的に、ロード済みのソースバッファがあると仮定
-    float source_hz = 440.0f; // 元の音素の基準ピッチ
-    float speed_ratio = target_hz / source_hz;
-    
-    int sample_rate = 44100;
-    int total_samples = (int)(duration_sec * sample_rate);
-    
-    // 出力用一時バッファ
-    float* current_note_buf = (float*)malloc(sizeof(float) * total_samples);
-    
-    // --- [リサンプリング処理] ---
-    for (int i = 0; i < total_samples; i++) {
-        // speed_ratioに応じて読み取り位置を計算（簡易的な線形補間が望ましい）
-        float read_pos = i * speed_ratio;
-        // current_note_buf[i] = read_sample(lyric_data, read_pos);
+// ディザがあれば乱数、なければ 0 を scratch に用意する（変換ループに分岐を入れないため）
+static void prepare_dither(float* scratch, int n, uint32_t* dither_state) {
+    if (dither_state) make_tpdf_dither(scratch, n, dither_state);
+    else memset(scratch, 0, sizeof(float) * n);
+}
+
+void convert_to_pcm16(const float* in, int16_t* out, int n, float* scratch, uint32_t* dither_state) {
+    prepare_dither(scratch, n, dither_state);
+    for (int i = 0; i < n; i++) {
+        float v = in[i] * 32767.0f + scratch[i];
+        v = v > -32768.0f ? v : -32768.0f;
+        v = v < 32767.0f ? v : 32767.0f;
+        out[i] = (int16_t)(int32_t)(v + copysignf(0.5f, v)); // 四捨五入（lrintf と違ってベクトル化される）
     }
+}
+
+void convert_to_pcm24(const float* in, uint8_t* out, int n, float* scratch, uint32_t* dither_state) {
+    prepare_dither(scratch, n, dither_state);
+    // 値の計算はまとめて行い、3バイトへの詰め込みだけを別のループにする
+    for (int i = 0; i < n; i++) {
+        float v = in[i] * 8388607.0f + scratch[i];
+        v = v > -8388608.0f ? v : -8388608.0f;
+        v = v < 8388607.0f ? v : 8388607.0f;
+        scratch[i] = v + copysignf(0.5f, v);
+    }
+    for (int i = 0; i < n; i++) {
+        int32_t q = (int32_t)scratch[i];
+        // リトルエンディアンの3バイト
+        out[i * 3 + 0] = (uint8_t)(q & 0xFF);
+        out[i * 3 + 1] = (uint8_t)((q >> 8) & 0xFF);
+        out[i * 3 + 2] = (uint8_t)((q >> 16) & 0xFF);
+    }
+}
 
-    // --- [クロスフェード適用] ---
-    if (*has_overlap) {
-        // 前のノートとの重なりがある場合、冒頭部分をフェード
-        apply_linear_crossfade(current_note_buf, overlap_buffer, current_note_buf, CROSSFADE_LEN);
+void convert_to_float32(const float* in, float* out, int n) {
+    // 32bit float はそのまま書けるので、範囲外だけ丸める
+    for (int i = 0; i < n; i++) {
+        float v = in[i] > -1.0f ? in[i] : -1.0f;
+        out[i] = v < 1.0f ? v : 1.0f;
     }
+}
+
+// --- ミックスカーネル ---
+// 音素1つ分を出力に重ねる処理（リサンプル・音量・クロスフェード・書き込み）を1回のループで行う。
+// 音素の区間をフェードイン・中間・フェードアウトの3つに分けて、それぞれを分岐のないループで処理するので、
+// コンパイラがベクトル化できる。フェードは等パワー（sin / cos）で、係数は表から引く。
 
-    // 2. WAVファイルへの書き出し（フェード後の本体部分）
-    // 末尾のCROSSFADE_LEN分は次のノートのために取っておく
-    int write_len = total_samples - CROSSFADE_LEN;
-    
-    // 16bit PCMに変換して書き込み
-    for (int i = 0; i < write_len; i++) {
-        int16_t pcm = (int16_t)(current_note_buf[i] * 32767.0f);
-        drwav_write_pcm_frames(wav, 1, &pcm);
+int fade_table_init(FadeTable* table, int len) {
+    table->len = len > 0 ? len : 0;
+    table->fade_in = (float*)malloc(sizeof(float) * (table->len > 0 ? table->len : 1));
+    table->fade_out = (float*)malloc(sizeof(float) * (table->len > 0 ? table->len : 1));
+    if (!table->fade_in || !table->fade_out) {
+        fade_table_free(table);
+        return -1;
+    }
+    for (int j = 0; j < table->len; j++) {
+        double w = (double)j / table->len * (M_PI / 2.0);
+        table->fade_in[j] = (float)sin(w);
+        table->fade_out[j] = (float)cos(w);
     }
+    return 0;
+}
+
+void fade_table_free(FadeTable* table) {
+    free(table->fade_in);
+    free(table->fade_out);
+    table->fade_in = NULL;
+    table->fade_out = NULL;
+    table->len = 0;
+}
 
-    // 3. 次のノートのために、今回の末尾部分をオーバーラップバッファに保存
-    memcpy(overlap_buffer, &current_note_buf[write_len], sizeof(float) * CROSSFADE_LEN);
-    *has_overlap = 1;
+// 音素内の区間 [a, b) と処理する [from, from + count) の重なりを、dest 上の添字 [*k0, *k1) で返す
+static inline void clip_segment(int a, int b, int from, int count, int* k0, int* k1) {
+    int lo = a > from ? a : from;
+    int hi = b < from + count ? b : from + count;
+    *k0 = lo - from;
+    *k1 = hi > lo ? hi - from : lo - from;
+}
 
-    free(current_note_buf);
+// フェードイン・中間・フェードアウトの境界（音素が短くフェードが重なる場合はフェードインを優先する）
+static inline void fade_segments(int ph_len, int fade_len, int* head_end, int* tail_start) {
+    *head_end = fade_len < ph_len ? fade_len : ph_len;
+    *tail_start = ph_len - fade_len > *head_end ? ph_len - fade_len : *head_end;
 }
 
-/**
- * Pythonから呼ばれるメインのレンダリング関数
- */
-void execute_render_to_file(const char* output_path, NoteEvent* notes, int count) {
-    drwav_data_format format;
-    format.container = drwav_container_riff;
-    format.format = DR_WAV_FORMAT_PCM;
-    format.channels = 1;
-    format.sampleRate = 44100;
-    format.bitsPerSample = 16;
-
-    drwav wav;
-    if (!drwav_init_file_write(&wav, output_path, &format, NULL)) return;
-
-    float overlap_buffer[CROSSFADE_LEN];
-    int has_overlap = 0;
-
-    for (int i = 0; i < count; i++) {
-        process_note_with_fade(&wav, notes[i].frequency, notes[i].duration, notes[i].lyric, overlap_buffer, &has_overlap);
+void mix_span(float* restrict dest, const float* restrict src, float gain, int ph_len, int from, int count,
+              const FadeTable* fade, int crossfade) {
+    if (!crossfade) {
+        for (int k = 0; k < count; k++) dest[k] = src[k] * gain;
+        return;
     }
+    int head_end, tail_start, k0, k1;
+    fade_segments(ph_len, fade->len, &head_end, &tail_start);
+
+    // フェードイン: 係数の添字は音素の先頭から
+    clip_segment(0, head_end, from, count, &k0, &k1);
+    const float* fi = fade->fade_in + from;
+    const float* fo = fade->fade_out + from;
+    for (int k = k0; k < k1; k++) dest[k] = dest[k] * fo[k] + (src[k] * gain) * fi[k];
 
-    // 最後に残ったバッファを書き出し
-    if (has_overlap) {
-        for (int i = 0; i < CROSSFADE_LEN; i++) {
-            int16_t pcm = (int16_t)(overlap_buffer[i] * 32767.0f);
-            drwav_write_pcm_frames(&wav, 1, &pcm);
+    // 中間: 足し込むだけ
+    clip_segment(head_end, tail_start, from, count, &k0, &k1);
+    for (int k = k0; k < k1; k++) dest[k] += src[k] * gain;
+
+    // フェードアウト側: 係数の添字は (ph_len - fade->len) から
+    clip_segment(tail_start, ph_len, from, count, &k0, &k1);
+    fi = fade->fade_in + (from - (ph_len - fade->len));
+    fo = fade->fade_out + (from - (ph_len - fade->len));
+    for (int k = k0; k < k1; k++) dest[k] = dest[k] * fo[k] + (src[k] * gain) * fi[k];
+}
+
+// resample_linear_rate_range と同じ式で、出力位置 i の読み取り位置
+static inline float linear_position(int i, int input_len, int output_len, float rate) {
+    return (float)i * (input_len - 1) / (output_len - 1) * rate;
+}
+
+// 線形補間の値（t_int + 1 < input_len の範囲でだけ呼ぶ）
+static inline float linear_tap(const float* restrict input, float t) {
+    int t_int = (int)t;
+    float t_frac = t - t_int;
+    return input[t_int] * (1.0f - t_frac) + input[t_int + 1] * t_frac;
+}
+
+#define MIX_TAIL_CHUNK 256
+
+void mix_linear_rate(float* restrict dest, const float* restrict input, int input_len, float rate, float gain,
+                     int ph_len, int from, int count, const FadeTable* fade, int crossfade) {
+    // 補間の両端が元の波形に収まる範囲（読み取り位置は単調に増えるので境界を二分探索する）
+    int lo = from, hi = from + count;
+    if (ph_len < 2 || input_len < 2) {
+        hi = from;
+    } else {
+        while (lo < hi) {
+            int mid = lo + (hi - lo) / 2;
+            if ((int)linear_position(mid, input_len, ph_len, rate) + 1 < input_len) lo = mid + 1;
+            else hi = mid;
         }
     }
+    int valid = lo - from;
 
-    drwav_uninit(&wav);
-}
+    int head_end, tail_start, k0, k1;
+    if (!crossfade) {
+        for (int k = 0; k < valid; k++) {
+            dest[k] = linear_tap(input, linear_position(from + k, input_len, ph_len, rate)) * gain;
+        }
+    } else {
+        fade_segments(ph_len, fade->len, &head_end, &tail_start);
 
+        clip_segment(0, head_end, from, valid, &k0, &k1);
+        const float* fi = fade->fade_in + from;
+        const float* fo = fade->fade_out + from;
+        for (int k = k0; k < k1; k++) {
+            float v = linear_tap(input, linear_position(from + k, input_len, ph_len, rate)) * gain;
+            dest[k] = dest[k] * fo[k] + v * fi[k];
+        }
+
+        clip_segment(head_end, tail_start, from, valid, &k0, &k1);
+        for (int k = k0; k < k1; k++) {
+            dest[k] += linear_tap(input, linear_position(from + k, input_len, ph_len, rate)) * gain;
+        }
+
+        clip_segment(tail_start, ph_len, from, valid, &k0, &k1);
+        fi = fade->fade_in + (from - (ph_len - fade->len));
+        fo = fade->fade_out + (from - (ph_len - fade->len));
+        for (int k = k0; k < k1; k++) {
+            float v = linear_tap(input, linear_position(from + k, input_len, ph_len, rate)) * gain;
+            dest[k] = dest[k] * fo[k] + v * fi[k];
+        }
+    }
+
+    // 元の波形の最後のサンプルとそれより後（無音）は、値を作ってから mix_span で重ねる
+    float chunk[MIX_TAIL_CHUNK];
+    for (int k = valid; k < count; k += MIX_TAIL_CHUNK) {
+        int n = count - k < MIX_TAIL_CHUNK ? count - k : MIX_TAIL_CHUNK;
+        resample_linear_rate_range(input, input_len, chunk, ph_len, rate, from + k, n);
+        mix_span(dest + k, chunk, gain, ph_len, from + k, n, fade, crossfade);
+    }
+}
@@ -0,0 +1,65 @@
+# test_render_determinism.py
+#
+# 合成スレッド数を変えても、合成結果がビット単位で同じになることを確かめる。
+# 音源は benchmark.write_voicebank の正弦波の音源、曲は benchmark.make_project で毎回同じものを作る。
+# 先に VO_SE_engine_C で make してエンジンをビルドしておくこと。
+#
+#   python -m pytest tests/test_render_determinism.py
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GUI"))
+
+from benchmark import write_voicebank, make_project
+from data_models import CharacterInfo
+from vo_se_engine import VO_SE_Engine, RESAMPLE_LINEAR, RESAMPLE_SINC_FAST, RESAMPLE_SINC_BEST
+
+THREAD_COUNTS = (1, 2, 8)
+
+
+@pytest.fixture(scope="module")
+def voicebank(tmp_path_factory):
+    """(音源フォルダ, 音素名の一覧)"""
+    audio_dir = str(tmp_path_factory.mktemp("voicebank"))
+    return audio_dir, write_voicebank(audio_dir, count=40, seed=1)
+
+
+@pytest.fixture(scope="module")
+def engine(voicebank):
+    engine = VO_SE_Engine()
+    if engine.lib is None:
+        pytest.skip(f"エンジンがビルドされていません（VO_SE_engine_C で make してください）: {engine.load_error}")
+    audio_dir, _ = voicebank
+    engine.set_active_character(CharacterInfo(id="determinism", name="determinism", audio_dir=audio_dir))
+    assert engine.wait_for_character_load(60)
+    assert engine.active_character_id == "determinism"
+    yield engine
+    engine.set_render_threads(0)
+
+
+@pytest.fixture(scope="module")
+def project(voicebank):
+    # 和音とピッチベンドのある 30 秒の曲（スレッドごとの区間の境目をノートとクロスフェードがまたぐ）
+    _, phonemes = voicebank
+    return make_project(600, phonemes, seed=7, notes_per_sec=20.0, max_song_sec=30.0, max_phonemes=3,
+                        pitch_density=40.0)
+
+
+@pytest.mark.parametrize("quality", [RESAMPLE_LINEAR, RESAMPLE_SINC_FAST, RESAMPLE_SINC_BEST])
+def test_thread_count_does_not_change_output(engine, project, quality):
+    notes, pitches = project
+    results = {}
+    for threads in THREAD_COUNTS:
+        engine.set_render_threads(threads)
+        assert engine.get_render_threads() == threads
+        engine.clear_resample_cache()  # キャッシュに頼らず、各スレッドでリサンプルさせる
+        results[threads] = engine.synthesize(notes, pitches, quality=quality)
+
+    reference = results[THREAD_COUNTS[0]]
+    assert reference.size > 0 and np.any(reference != 0.0)
+    for threads in THREAD_COUNTS[1:]:
+        assert np.array_equal(results[threads], reference), f"threads={threads} の結果が threads=1 と違います"